@@ -0,0 +1,70 @@
+// SPDX-License-Identifier: MIT
+
+pragma solidity 0.6.11;
+pragma experimental ABIEncoderV2;
+
+import "../TroveManager.sol";
+import "../Interfaces/ISortedTroves.sol";
+import "../Interfaces/IStabilityPool.sol";
+import "./PriceFeedTestnet.sol";
+
+/*  Helper contract for the simulation: reads the system totals it logs every step in a single call.
+ *  Not part of the core BeraBorrow system. */
+contract SystemStateGetter {
+    struct SystemState {
+        uint price;
+        uint numTroves;
+
+        uint totalColl;
+        uint totalDebt;
+        uint TCR;
+        bool recoveryMode;
+
+        address lastTrove;
+        uint lastICR;
+
+        uint stabilityPoolNECT;
+        uint stabilityPooliBGT;
+
+        uint totalStakesSnapshot;
+        uint totalCollateralSnapshot;
+    }
+
+    TroveManager public troveManager;
+    ISortedTroves public sortedTroves;
+    IStabilityPool public stabilityPool;
+    PriceFeedTestnet public priceFeed;
+
+    constructor(
+        TroveManager _troveManager,
+        ISortedTroves _sortedTroves,
+        IStabilityPool _stabilityPool,
+        PriceFeedTestnet _priceFeed
+    )
+        public
+    {
+        troveManager = _troveManager;
+        sortedTroves = _sortedTroves;
+        stabilityPool = _stabilityPool;
+        priceFeed = _priceFeed;
+    }
+
+    function getSystemState() external view returns (SystemState memory state) {
+        state.price = priceFeed.getPrice();
+        state.numTroves = sortedTroves.getSize();
+
+        state.totalColl = troveManager.getEntireSystemColl();
+        state.totalDebt = troveManager.getEntireSystemDebt();
+        state.TCR = troveManager.getTCR(state.price);
+        state.recoveryMode = troveManager.checkRecoveryMode(state.price);
+
+        state.lastTrove = sortedTroves.getLast();
+        state.lastICR = troveManager.getCurrentICR(state.lastTrove, state.price);
+
+        state.stabilityPoolNECT = stabilityPool.getTotalNECTDeposits();
+        state.stabilityPooliBGT = stabilityPool.getiBGT();
+
+        state.totalStakesSnapshot = troveManager.totalStakesSnapshot();
+        state.totalCollateralSnapshot = troveManager.totalCollateralSnapshot();
+    }
+}
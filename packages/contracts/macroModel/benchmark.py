@@ -0,0 +1,254 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from kernels import load as load_kernels
+from result_buffer import ResultBuffer
+from simulation import MacroModel, ModelParams
+from trove_book import TroveBook
+
+# Benchmarks of the macro model and of the aggregate models in ../model.
+# - phase/<phase>/troves=<n>: one call of a step phase of MacroModel on a book of n
+#   troves, after a short warm-up run; every repetition starts from a fresh copy of the
+#   same state, so it redoes the same work.
+# - run/troves=<n>/horizon=<h>: a whole baseline run opening n troves at the start.
+# - aggregate/<module>/steps=<n>: simulate() of model/model.py and model/model_v2.py on
+#   the sublinear iBGT price path.
+# Each benchmark is repeated until `repeat` timings or `budget` seconds, whichever comes
+# first (at least once); the results go to a JSON-lines history, one line per session
+# with the commit, machine and library versions, and --check compares the session with
+# the previous ones on the same machine:
+#
+#   python benchmark.py                        # default grid, appended to the history
+#   python benchmark.py --full --only run/     # every population x horizon
+#   python benchmark.py --check                # exit 1 on regressions over --threshold
+#
+# The trove population of a whole run grows well past the troves opened at the start
+# (a month from 1e5 troves ends near 3e5, a year from 1e2 near 1.6e4), so the whole runs
+# from 1e5 troves and over ten years are left to --full; the phase benchmarks cover every
+# population. Horizons past the one-year period of the exogenous series stretch the period to the
+# horizon, so a ten-year run is not the default model run repeated.
+
+POPULATIONS = (100, 1000, 10000, 100000, 1000000)
+HORIZONS = {"month": 720, "year": 8760, "decade": 87600}
+PHASES = ("liquidate_troves", "close_troves", "adjust_troves", "open_troves", "stability_update",
+          "price_stabilizer", "POLLEN_market", "step")
+AGGREGATE_STEPS = (1000, 10000)
+#(population, horizon) pairs of the default grid, the whole runs that take seconds rather than minutes;
+#--full adds 1e5 and 1e6 troves and the longer horizons
+DEFAULT_RUNS = ((100, "month"), (1000, "month"), (10000, "month"), (100, "year"))
+#MACRO_BENCHMARK_HISTORY moves the history file, e.g. to a results directory shared by machines
+HISTORY = os.environ.get("MACRO_BENCHMARK_HISTORY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_history.jsonl"))
+THRESHOLD = 0.2
+SEED = 2019375
+WARMUP = 24
+
+
+# Timings (seconds) of `setup()()`: setup runs untimed before every repetition and returns
+# the call to time.
+def measure(setup, repeat=5, budget=2.0):
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat and (not timings or time.perf_counter() - started < budget):
+        function = setup()
+        begin = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - begin)
+    return timings
+
+
+def _label(n):
+    return f"1e{len(str(n)) - 1}" if str(n).strip("0") == "1" else str(n)
+
+
+# Model, result buffer and trove columns after opening `population` troves and running
+# WARMUP steps.
+def _warm_state(population, kernels=None):
+    params = ModelParams(initial_open=population, n_sim=WARMUP + 2)
+    model = MacroModel(params, seed=SEED, kernels=kernels)
+    data, troves = model.run(stop=WARMUP + 1)
+    return model, data.state(), {c: troves[c].copy() for c in troves.columns}
+
+
+def phase_benchmarks(populations=POPULATIONS, phases=PHASES, kernels=None):
+    benchmarks = {}
+    for population in populations:
+        cache = {}
+
+        def state(population=population, cache=cache):
+            if not cache:
+                cache["state"] = _warm_state(population, kernels)
+            return cache["state"]
+
+        for phase in phases:
+            def setup(phase=phase, state=state):
+                model, data_state, columns = state()
+                data = ResultBuffer.from_state(data_state)
+                troves = TroveBook.from_columns({c: values.copy() for c, values in columns.items()}, model.kernels)
+                #build the liquidation index now, so its first compaction is not timed as part of the phase
+                troves.reindex()
+                index = len(data)
+                model.price_ibgt_current = model.price_ibgt[index]
+                troves['iBGT_Price'] = model.price_ibgt_current
+                price_NECT_previous = data.previous('Price_NECT')
+                stability_pool = data.previous('stability')
+                return {
+                    "liquidate_troves": lambda: model.liquidate_troves(troves, index, data),
+                    "close_troves": lambda: model.close_troves(troves, index, price_NECT_previous),
+                    "adjust_troves": lambda: model.adjust_troves(troves, index),
+                    "open_troves": lambda: model.open_troves(troves, index, price_NECT_previous),
+                    "stability_update": lambda: model.stability_update(stability_pool, data.previous('return_stability'), index),
+                    "price_stabilizer": lambda: model.price_stabilizer(troves, index, data, stability_pool, 0),
+                    "POLLEN_market": lambda: model.POLLEN_market(index, data),
+                    "step": lambda: model.step(troves, data, index),
+                }[phase]
+            benchmarks[f"phase/{phase}/troves={_label(population)}"] = setup
+    return benchmarks
+
+
+def run_benchmarks(runs=DEFAULT_RUNS, kernels=None):
+    benchmarks = {}
+    for population, horizon in runs:
+        steps = HORIZONS[horizon]
+        params = ModelParams(initial_open=population, n_sim=steps, period=max(ModelParams.period, steps))
+
+        def setup(params=params):
+            model = MacroModel(params, seed=SEED, kernels=kernels)
+            return model.run
+        benchmarks[f"run/troves={_label(population)}/horizon={horizon}"] = setup
+    return benchmarks
+
+
+def aggregate_benchmarks(steps=AGGREGATE_STEPS):
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model")
+    if directory not in sys.path:
+        sys.path.append(directory)
+    import model
+    import model_v2
+
+    benchmarks = {}
+    for module in (model, model_v2):
+        for n in steps:
+            #the deterministic sublinear iBGT path: the random walk can drive model_v2 to a zero division
+            def setup(module=module, n=n):
+                return lambda: module.simulate(module.ModelParams(), n, "sublinear", verbose=False)
+            benchmarks[f"aggregate/{module.__name__}/steps={_label(n)}"] = setup
+    return benchmarks
+
+
+# {name: setup} of the default grid, or with full=True of every population x horizon.
+def benchmarks(full=False, kernels=None):
+    runs = [(n, h) for h in HORIZONS for n in POPULATIONS] if full else DEFAULT_RUNS
+    found = {}
+    found.update(phase_benchmarks(kernels=kernels))
+    found.update(run_benchmarks(runs, kernels))
+    found.update(aggregate_benchmarks())
+    return found
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _machine():
+    return {"node": platform.node(), "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count()}
+
+
+# Time every benchmark of `found` whose name matches `only` (a regular expression).
+# Returns the session: {"time", "commit", "machine", "versions", "results"}, with the
+# min, median and mean seconds and the repeat count of each benchmark.
+def run_session(found, only=None, repeat=5, budget=2.0, progress=None, kernels=None):
+    results = {}
+    for name, setup in found.items():
+        if only and not re.search(only, name):
+            continue
+        timings = measure(setup, repeat, budget)
+        results[name] = {"min": min(timings), "median": float(np.median(timings)), "mean": float(np.mean(timings)),
+                         "repeat": len(timings)}
+        if progress is not None:
+            progress(name, results[name])
+    return {"time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"), "commit": _commit(),
+            "machine": _machine(),
+            "versions": {"python": platform.python_version(), "numpy": np.__version__,
+                         "kernels": load_kernels(kernels).name},
+            "results": results}
+
+
+def load_history(path=HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(session, path=HISTORY):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(session, sort_keys=True) + "\n")
+
+
+# Benchmarks of `session` slower than the baseline by more than `threshold` (relative,
+# on the min of the timings, the least noisy statistic). The baseline of a benchmark is
+# the median of its mins over the last `window` sessions of `history` on the same
+# machine. Returns {name: (baseline seconds, current seconds, relative change)}.
+def regressions(session, history, threshold=THRESHOLD, window=5):
+    same = [s for s in history if s.get("machine") == session["machine"]]
+    slower = {}
+    for name, result in session["results"].items():
+        previous = [s["results"][name]["min"] for s in same[-window:] if name in s["results"]]
+        if not previous:
+            continue
+        baseline = float(np.median(previous))
+        change = result["min"] / baseline - 1
+        if change > threshold:
+            slower[name] = (baseline, result["min"], change)
+    return slower
+
+
+def _print_result(name, result):
+    print(f"{name:50s} {result['min'] * 1e3:12.3f} ms  (median {result['median'] * 1e3:.3f} ms, {result['repeat']}x)", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the macro model and the aggregate models")
+    parser.add_argument("--only", default=None, help="regular expression selecting benchmarks by name")
+    parser.add_argument("--full", action="store_true", help="every trove population x horizon for whole runs")
+    parser.add_argument("--repeat", type=int, default=5, help="timings per benchmark at most")
+    parser.add_argument("--budget", type=float, default=2.0, help="seconds per benchmark before it stops repeating")
+    parser.add_argument("--kernels", default=None, help="kernel backend (kernels.py)")
+    parser.add_argument("--history", default=HISTORY, help="JSON-lines file of past sessions")
+    parser.add_argument("--no-save", action="store_true", help="do not append this session to the history")
+    parser.add_argument("--check", action="store_true", help="exit 1 if a benchmark regressed past the threshold")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="relative slowdown counted as a regression")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    found = benchmarks(args.full, args.kernels)
+    if args.list:
+        print("\n".join(name for name in found if not args.only or re.search(args.only, name)))
+        return 0
+    history = load_history(args.history)
+    session = run_session(found, args.only, args.repeat, args.budget, _print_result, args.kernels)
+    if not args.no_save:
+        append_history(session, args.history)
+
+    slower = regressions(session, history, args.threshold)
+    for name, (baseline, current, change) in sorted(slower.items()):
+        print(f"REGRESSION {name}: {baseline * 1e3:.3f} ms -> {current * 1e3:.3f} ms (+{change:.0%})", file=sys.stderr)
+    return 1 if args.check and slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import argparse
+import hashlib
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+
+import numpy as np
+import pandas as pd
+
+import kernels
+from result_sink import ColumnSink, read_columns
+from simulation import ModelParams, RunTimeout, resume_simulation, run_simulation
+
+# Monte Carlo ensemble of the macro model.
+# Independent (params, seed) runs are spread over a process pool in chunks of seeds: each
+# task runs its chunk back to back and ships home only the columns the bands are built
+# from, so the per-run scheduling and pickling overhead stays small next to a run and the
+# throughput grows with the number of workers. A run that takes longer than `timeout`
+# seconds, or fails, is recorded as failed and left out of the bands.
+# With a checkpoint directory every run saves its state there as it goes, and an ensemble
+# started again after a crash resumes each run from its checkpoint (finished runs are
+# only read back) instead of starting over.
+
+ENSEMBLE_COLUMNS = ("Price_NECT", "n_liquidate", "stability", "supply_NECT", "price_POLLEN")
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+# Checkpoint file of a run, named by seed and a hash of the parameters.
+def _checkpoint_path(directory, params, seed):
+    digest = hashlib.sha1(repr(asdict(params)).encode()).hexdigest()[:12]
+    return os.path.join(directory, f"run-{seed}-{digest}.npz")
+
+
+def _run_chunk(params, seeds, columns, timeout, shared=None, checkpoints=None, every=None, sinks=None):
+    results = []
+    for seed in seeds:
+        started = time.monotonic()
+        try:
+            path = None if checkpoints is None else _checkpoint_path(checkpoints, params, seed)
+            if path is not None and os.path.exists(path):
+                data, _ = resume_simulation(path, timeout=timeout, every=every)
+            else:
+                paths = shared[seed].open() if shared else None
+                if sinks is None:
+                    data, _ = run_simulation(params, seed=seed, timeout=timeout, paths=paths, checkpoint=path, every=every)
+                else:
+                    directory = os.path.join(sinks, f"run-{seed}")
+                    with ColumnSink(directory) as sink:
+                        run_simulation(params, seed=seed, timeout=timeout, paths=paths, sink=sink)
+                    data = read_columns(directory, columns)
+        except RunTimeout as error:
+            results.append((seed, None, f"timeout: {error}", time.monotonic() - started))
+            continue
+        except Exception as error:
+            results.append((seed, None, f"{type(error).__name__}: {error}", time.monotonic() - started))
+            continue
+        paths = np.stack([np.asarray(data[c]) for c in columns])
+        results.append((seed, paths, None, time.monotonic() - started))
+    return results
+
+
+# Per-run paths of an ensemble, one (runs x steps) array per column. Runs that stopped
+# early are padded with NaN after their last recorded step.
+class EnsembleResult:
+    def __init__(self, params, columns, seeds, paths, failed, elapsed):
+        self.params = params
+        self.columns = tuple(columns)
+        self.seeds = list(seeds)
+        self.paths = paths
+        self.failed = failed
+        self.elapsed = elapsed
+
+    def __len__(self):
+        return len(self.seeds)
+
+    # Number of runs still going at every step.
+    def alive(self):
+        return (~np.isnan(self.paths[self.columns[0]])).sum(axis=0)
+
+    # Per-step quantiles of `column` across the runs, one DataFrame column per quantile.
+    def bands(self, column, quantiles=QUANTILES):
+        paths = self.paths[column]
+        if not len(paths):
+            return pd.DataFrame(np.nan, index=range(paths.shape[1]), columns=list(quantiles))
+        with np.errstate(all="ignore"):
+            values = np.nanquantile(paths, quantiles, axis=0)
+        return pd.DataFrame(values.T, columns=list(quantiles))
+
+    # Bands of every column side by side, columns indexed by (column, quantile).
+    def quantile_bands(self, quantiles=QUANTILES):
+        return pd.concat({c: self.bands(c, quantiles) for c in self.columns}, axis=1)
+
+
+# Run the baseline model once per seed and collect the ensemble columns.
+#
+# `seeds` is an iterable of seeds or a number of runs (seeds 0..n-1). `workers` defaults
+# to the number of CPUs; workers=1 runs in this process. `chunksize` is the number of
+# seeds per task, by default about four tasks per worker. `progress(done, total, failed)`
+# is called as runs complete.
+#
+# With a PathStore (exogenous.py) the exogenous series of every seed are published
+# once into shared memory and the workers attach to them instead of generating them;
+# a store reused across calls, e.g. one per parameter variant of a sweep, generates
+# each (seed, exogenous parameters) series only once.
+#
+# With `checkpoints` (a directory) each run saves its state there every `every` steps
+# and when it ends; calling again with the same directory resumes the runs from there.
+# With `sinks` (a directory) instead, each run streams all its columns to a ColumnSink in
+# run-<seed>/ there, holding one step in memory, and only the ensemble columns are read
+# back.
+def run_ensemble(params=None, seeds=100, workers=None, chunksize=None, timeout=None,
+                 progress=None, columns=ENSEMBLE_COLUMNS, store=None, checkpoints=None, every=None, sinks=None):
+    params = params or ModelParams()
+    seeds = list(range(seeds)) if isinstance(seeds, int) else list(seeds)
+    workers = workers or os.cpu_count() or 1
+    chunksize = chunksize or max(1, math.ceil(len(seeds) / (4 * workers)))
+    chunks = [seeds[i:i + chunksize] for i in range(0, len(seeds), chunksize)]
+    shared = None if store is None else {seed: store.publish(params, seed) for seed in seeds}
+    if checkpoints is not None and sinks is not None:
+        raise ValueError("runs streamed to sinks cannot be checkpointed")
+    for directory in (checkpoints, sinks):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    started = time.monotonic()
+    outcomes = {}
+    failed = {}
+
+    def collect(results):
+        for seed, paths, error, _ in results:
+            if error is None:
+                outcomes[seed] = paths
+            else:
+                failed[seed] = error
+        if progress is not None:
+            progress(len(outcomes) + len(failed), len(seeds), len(failed))
+
+    if workers == 1:
+        for chunk in chunks:
+            collect(_run_chunk(params, chunk, columns, timeout, shared, checkpoints, every, sinks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_chunk, params, chunk, columns, timeout,
+                                   shared and {seed: shared[seed] for seed in chunk}, checkpoints, every, sinks)
+                       for chunk in chunks]
+            for future in as_completed(futures):
+                collect(future.result())
+
+    done = [s for s in seeds if s in outcomes]
+    paths = {}
+    for k, c in enumerate(columns):
+        stacked = np.full((len(done), params.n_sim), np.nan)
+        for row, seed in enumerate(done):
+            path = outcomes[seed][k]
+            stacked[row, :len(path)] = path
+        paths[c] = stacked
+    return EnsembleResult(params, columns, done, paths, failed, time.monotonic() - started)
+
+
+def _print_progress(done, total, failed):
+    print(f"\r{done}/{total} runs ({failed} failed)", end="\n" if done == total else "", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo ensemble of the macro model")
+    parser.add_argument("--runs", type=int, default=100, help="number of seeds")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=ModelParams.n_sim, help="hours per run")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None, help="seconds per run")
+    parser.add_argument("--output", default=None, help="CSV file for the quantile bands")
+    parser.add_argument("--checkpoints", default=None, help="directory to checkpoint runs in and resume them from")
+    parser.add_argument("--every", type=int, default=720, help="steps between checkpoints")
+    parser.add_argument("--sinks", default=None, help="directory to stream the full per-run columns to")
+    parser.add_argument("--kernels", choices=kernels.BACKENDS + ("auto",), default=None, help="per-trove kernel backend")
+    args = parser.parse_args(argv)
+
+    if args.kernels:
+        kernels.use(args.kernels)
+
+    params = ModelParams(n_sim=args.steps)
+    seeds = range(args.first_seed, args.first_seed + args.runs)
+    result = run_ensemble(params, seeds, workers=args.workers, chunksize=args.chunksize,
+                          timeout=args.timeout, progress=_print_progress, checkpoints=args.checkpoints, every=args.every, sinks=args.sinks)
+    print(f"{len(result)} runs in {result.elapsed:.1f}s, {len(result.failed)} failed", file=sys.stderr)
+    for seed, error in sorted(result.failed.items()):
+        print(f"  seed {seed}: {error}", file=sys.stderr)
+
+    bands = result.quantile_bands()
+    if args.output:
+        bands.to_csv(args.output, index_label="step")
+    else:
+        print(bands.iloc[-1].unstack())
+
+
+if __name__ == "__main__":
+    main()
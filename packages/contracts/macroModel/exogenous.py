@@ -0,0 +1,219 @@
+import hashlib
+import os
+import shutil
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from rng_streams import RandomStreams
+
+# Exogenous series of the macro model: the iBGT price and the natural rate for every
+# hour of the period, and the POLLEN price over the first month (afterwards it comes
+# out of the model). They depend only on the seed and the parameters in EXOGENOUS_PARAMS,
+# so runs that share those (e.g. every variant of a policy sweep) can share the series.
+
+EXOGENOUS_SERIES = ("price_ibgt", "natural_rate", "price_POLLEN")
+EXOGENOUS_PARAMS = ("period", "month", "price_ibgt_initial", "sd_ibgt", "drift_ibgt", "ibgt_regimes",
+                    "natural_rate_initial", "sd_natural_rate",
+                    "price_POLLEN_initial", "sd_POLLEN", "drift_POLLEN")
+
+# Generated series are cached on disk as .npy files, one directory per exogenous_key,
+# under the user's cache directory. MACRO_PATH_CACHE moves the cache; an empty value
+# turns it off.
+PATH_CACHE = os.environ.get("MACRO_PATH_CACHE", os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "beraborrow-macro", "paths"))
+
+# Part of every exogenous_key; bump it when the generated series change for the same
+# seed and parameters, so series cached by an older version are not read back.
+PATH_CACHE_VERSION = 1
+
+
+# Per-step drift and sd of a regime schedule: (stop, drift, sd) stages, each covering
+# the steps from the previous stage's stop (the first one from `start`) up to its own.
+def regime_steps(schedule, start=1):
+    stops = np.array([stop for stop, _, _ in schedule])
+    lengths = np.diff(np.concatenate(([start], stops)))
+    if (lengths < 0).any():
+        raise ValueError("regime stops must be increasing")
+    drift = np.repeat([float(d) for _, d, _ in schedule], lengths)
+    sd = np.repeat([float(s) for _, _, s in schedule], lengths)
+    return drift, sd
+
+
+# initial, then initial*(1+shock)*(1+drift) compounded step by step, as one cumulative
+# product. The shock and drift factors are interleaved so the products are taken in the
+# order of the recursion and the series matches it bit for bit. `shocks` may carry a
+# trailing lanes axis; `drift` is a scalar or one value per step.
+def regime_path(initial, shocks, drift=0.0):
+    shocks = np.asarray(shocks, dtype=float)
+    drift = np.asarray(drift, dtype=float)
+    if drift.ndim:
+        drift = drift.reshape(drift.shape + (1,) * (shocks.ndim - 1))
+    factors = np.empty((2 * len(shocks) + 1,) + shocks.shape[1:])
+    factors[0] = initial
+    factors[1::2] = 1 + shocks
+    factors[2::2] = 1 + drift
+    return np.cumprod(factors, axis=0)[::2]
+
+
+# The iBGT regimes of `params`: its ibgt_regimes, or one regime of drift_ibgt and sd_ibgt
+# over the whole period.
+def ibgt_regimes(params):
+    return params.ibgt_regimes or ((params.period, params.drift_ibgt, params.sd_ibgt),)
+
+
+# Series of `phase` following a regime schedule from `initial`. The shocks are standard
+# normal draws scaled by the regime's sd, which equals drawing normal(0, sd) directly.
+# With `lanes`, a (steps x lanes) block of independent series.
+def regime_series(streams, phase, initial, schedule, lanes=None):
+    drift, sd = regime_steps(schedule)
+    z = streams.path(phase, 1, 1 + len(sd), lanes=lanes).normal(0, 1)
+    shocks = z * (sd if lanes is None else sd[:, None])
+    return regime_path(initial, shocks, drift)
+
+
+# Generate the series for `params` from `streams`; returns {name: array}.
+def generate_paths(params, streams):
+    p = params
+    return {"price_ibgt": regime_series(streams, 'ibgt_price', p.price_ibgt_initial, ibgt_regimes(p)),
+            "natural_rate": regime_series(streams, 'natural_rate', p.natural_rate_initial, ((p.period, 0, p.sd_natural_rate),)),
+            "price_POLLEN": regime_series(streams, 'POLLEN_price', p.price_POLLEN_initial, ((p.month, p.drift_POLLEN, p.sd_POLLEN),))}
+
+
+# Key of the series for a seed: a hash of PATH_CACHE_VERSION, the stream coordinates
+# and EXOGENOUS_PARAMS.
+def exogenous_key(params, seed, run=0, legacy=False):
+    fields = (PATH_CACHE_VERSION, seed, run, legacy) + tuple(getattr(params, name) for name in EXOGENOUS_PARAMS)
+    return hashlib.sha1(repr(fields).encode()).hexdigest()[:20]
+
+
+# The series for a seed, loaded from the disk cache in `cache_dir` (PATH_CACHE by
+# default) when they were generated before, otherwise generated and saved there. Each
+# file is written under a temporary name and renamed, so concurrent runs never read a
+# partial file; a cache that cannot be written only costs the regeneration next time.
+def load_paths(params, seed, run=0, legacy=False, cache_dir=None):
+    cache_dir = PATH_CACHE if cache_dir is None else cache_dir
+    if not cache_dir:
+        return generate_paths(params, RandomStreams(seed=seed, run=run, legacy=legacy))
+    directory = os.path.join(cache_dir, exogenous_key(params, seed, run, legacy))
+    files = {name: os.path.join(directory, f"{name}.npy") for name in EXOGENOUS_SERIES}
+    try:
+        return {name: np.load(f) for name, f in files.items()}
+    except (OSError, ValueError):
+        pass
+    series = generate_paths(params, RandomStreams(seed=seed, run=run, legacy=legacy))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for name, f in files.items():
+            temporary = f"{f}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as out:
+                np.save(out, series[name])
+            os.replace(temporary, f)
+    except OSError:
+        pass
+    return series
+
+
+# Remove cached series from `cache_dir` (PATH_CACHE by default): those of `keys`
+# (exogenous_key values) if given, otherwise all of them. Returns how many were removed.
+def clear_path_cache(keys=None, cache_dir=None):
+    cache_dir = PATH_CACHE if cache_dir is None else cache_dir
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return 0
+    keys = os.listdir(cache_dir) if keys is None else keys
+    removed = 0
+    for key in keys:
+        directory = os.path.join(cache_dir, key)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+# Hourly POLLEN airdrop to the stability pool when `total` tokens are issued with
+# issuance factor F: total*(F**(i-1) - F**i) at step i >= 1, 0 at step 0. The powers
+# are Python's, so entries equal the per-call formula exactly.
+def airdrop_schedule(steps, total=32e6, F=0.99992087674):
+    powers = np.array([F ** i for i in range(steps)], dtype=float)
+    schedule = np.zeros(steps)
+    schedule[1:] = total * (powers[:-1] - powers[1:])
+    return schedule
+
+
+# segments this process has attached to, by name
+_attached = {}
+
+
+# Picklable handle on series published by a PathStore. open() attaches to the shared
+# memory segment (once per process) and returns read-only views, without copying.
+class SharedPaths:
+    def __init__(self, name, lengths):
+        self.name = name
+        self.lengths = dict(lengths)
+
+    def open(self):
+        attached = _attached.get(self.name)
+        if attached is None:
+            segment = shared_memory.SharedMemory(name=self.name)
+            series = {}
+            offset = 0
+            for name, length in self.lengths.items():
+                view = np.ndarray(length, dtype=float, buffer=segment.buf, offset=offset)
+                view.flags.writeable = False
+                series[name] = view
+                offset += length * view.itemsize
+            attached = (segment, series)
+            _attached[self.name] = attached
+        return attached[1]
+
+
+# Exogenous series published once into shared memory, keyed by seed and parameters.
+# publish() generates the series of a key the first time it is asked for and returns a
+# SharedPaths handle; workers of a process pool get the handle (a name and three
+# lengths) and attach to the same memory. close() releases the segments; the store is
+# also a context manager.
+class PathStore:
+    def __init__(self, prefix=None):
+        self.prefix = prefix or f"macro-{os.getpid()}"
+        self._segments = {}
+
+    def __len__(self):
+        return len(self._segments)
+
+    def __contains__(self, key):
+        return key in self._segments
+
+    def publish(self, params, seed, run=0, legacy=False):
+        key = exogenous_key(params, seed, run, legacy)
+        if key in self._segments:
+            return self._segments[key][1]
+        series = load_paths(params, seed, run, legacy)
+        size = sum(a.nbytes for a in series.values())
+        segment = shared_memory.SharedMemory(name=f"{self.prefix}-{key}", create=True, size=max(1, size))
+        offset = 0
+        for a in series.values():
+            np.ndarray(len(a), dtype=float, buffer=segment.buf, offset=offset)[:] = a
+            offset += a.nbytes
+        handle = SharedPaths(segment.name, {name: len(a) for name, a in series.items()})
+        self._segments[key] = (segment, handle)
+        return handle
+
+    def close(self):
+        for segment, handle in self._segments.values():
+            attached = _attached.pop(handle.name, None)
+            segments = (segment,) if attached is None else (attached[0], segment)
+            attached = None
+            for s in segments:
+                try:
+                    s.close()
+                except BufferError:
+                    #views still held elsewhere; the memory goes when they do
+                    pass
+            segment.unlink()
+        self._segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,213 @@
+import os
+import warnings
+
+import numpy as np
+
+# Per-trove kernels of the macro model step, with two backends:
+# - "numpy": whole-array expressions, the reference path.
+# - "numba": the same arithmetic as fused loops, JIT-compiled by Numba. This skips the
+#   temporaries of the array expressions and stops the redemption walk at the last
+#   redeemed trove instead of summing the whole book.
+# The loops do the same floating-point operations in the same order as the array
+# expressions (sums left to right like np.cumsum), and they are compiled without
+# fastmath, so the two backends give the same results; TOLERANCE is the relative
+# difference the backends are held to. The random draws stay on the keyed NumPy streams
+# either way, so a backend never changes which numbers a run draws.
+#
+# MACRO_KERNELS picks the default backend ("numpy", "numba" or "auto" for numba when it
+# is installed); use() changes it at run time and MacroModel(kernels=...) per model. A
+# request for numba without Numba installed falls back to numpy with a warning.
+
+BACKENDS = ("numpy", "numba")
+TOLERANCE = 1e-12
+
+_default = os.environ.get("MACRO_KERNELS", "numpy")
+_loaded = {}
+
+
+# The kernels a backend provides, all with the same signatures.
+class Kernels:
+    def __init__(self, name, adjust, open_supply, redeem_walk, below_ratio):
+        self.name = name
+        self.adjust = adjust
+        self.open_supply = open_supply
+        self.redeem_walk = redeem_walk
+        self.below_ratio = below_ratio
+
+    def __repr__(self):
+        return f"Kernels({self.name!r})"
+
+
+# Adjustment check of the given troves at their current iBGT price. Returns (CR_current,
+# by_debt, supply_new, by_collateral, quantity_new, issuance): the troves outside their
+# inattention band re-target CR_initial by changing their debt (mask by_debt, new Supply
+# supply_new) or their collateral (mask by_collateral, new iBGT_Quantity quantity_new),
+# split by the draws `p` against `ratio`; `issuance` is the fee on the debt increases.
+def _adjust(price, quantity, supply, CR_initial, inattention, p, ratio, rate_issuance):
+    CR_current = price*quantity/supply
+    check = (CR_current-CR_initial)/(CR_initial*inattention)
+    outside = (check < -1) | (check > 2)
+
+    by_debt = outside & (p >= ratio)
+    supply_new = price[by_debt]*quantity[by_debt]/CR_initial[by_debt]
+    increase = check[by_debt] > 2
+    issuance = 0
+    if increase.any():
+        #cumsum adds left to right, matching the accumulation order of the original loop
+        issuance = np.cumsum(rate_issuance * (supply_new[increase] - supply[by_debt][increase]))[-1]
+
+    by_collateral = outside & (p < ratio)
+    quantity_new = CR_initial[by_collateral]*supply[by_collateral]/price[by_collateral]
+    return CR_current, by_debt, supply_new, by_collateral, quantity_new, issuance
+
+
+# Supply of newly opened troves and the issuance fee on it.
+def _open_supply(price, quantity, CR_ratio, rate_issuance):
+    supply = price * quantity / CR_ratio
+    issuance = 0
+    if len(supply) > 0:
+        #cumsum adds left to right, matching the accumulation order of the per-trove loop
+        issuance = np.cumsum(rate_issuance * supply)[-1]
+    return supply, issuance
+
+
+# Troves summed at a time by the redemption walk.
+REDEEM_BLOCK = 4096
+
+
+# Walk `amount` of redemptions down `supply` (in redemption order). Returns
+# (n_redempt, redempted): the number of troves fully redeemed and their total supply.
+# n_redempt == len(supply) when the whole book is redeemed. The running sum is taken a
+# block at a time and the walk stops at the block where it passes `amount`, so it costs
+# O(n_redempt) rather than a cumsum of the whole book.
+def _redeem_walk(supply, amount):
+    carry = 0.0
+    for start in range(0, len(supply), REDEEM_BLOCK):
+        block = supply[start:start + REDEEM_BLOCK]
+        #the running sum carried in front, so every partial sum is the left-to-right one of a single cumsum
+        cumulative = np.cumsum(np.concatenate(([carry], block)))[1:]
+        beyond = cumulative > amount
+        if beyond.any():
+            n = int(beyond.argmax())
+            # cumulative[n] - supply[n] rather than cumulative[n-1]: same rounding as the trove-by-trove walk
+            return start + n, cumulative[n] - block[n]
+        carry = cumulative[-1]
+    return len(supply), carry
+
+
+# The candidate `rows` whose collateral ratio at iBGT price `price` is below `ratio`.
+def _below_ratio(rows, price, quantity, supply, ratio):
+    return rows[price * quantity[rows] / supply[rows] < ratio]
+
+
+# Loop versions of the kernels above, compiled by Numba.
+
+def _adjust_loop(price, quantity, supply, CR_initial, inattention, p, ratio, rate_issuance):
+    n = len(price)
+    CR_current = np.empty(n)
+    check = np.empty(n)
+    by_debt = np.zeros(n, dtype=np.bool_)
+    by_collateral = np.zeros(n, dtype=np.bool_)
+    n_debt = 0
+    n_collateral = 0
+    for i in range(n):
+        CR_current[i] = price[i]*quantity[i]/supply[i]
+        check[i] = (CR_current[i]-CR_initial[i])/(CR_initial[i]*inattention[i])
+        if check[i] < -1 or check[i] > 2:
+            if p[i] >= ratio:
+                by_debt[i] = True
+                n_debt += 1
+            elif p[i] < ratio:
+                by_collateral[i] = True
+                n_collateral += 1
+
+    supply_new = np.empty(n_debt)
+    quantity_new = np.empty(n_collateral)
+    issuance = 0.0
+    increased = False
+    j = 0
+    k = 0
+    for i in range(n):
+        if by_debt[i]:
+            supply_new[j] = price[i]*quantity[i]/CR_initial[i]
+            if check[i] > 2:
+                fee = rate_issuance * (supply_new[j] - supply[i])
+                issuance = issuance + fee if increased else fee
+                increased = True
+            j += 1
+        elif by_collateral[i]:
+            quantity_new[k] = CR_initial[i]*supply[i]/price[i]
+            k += 1
+    return CR_current, by_debt, supply_new, by_collateral, quantity_new, issuance
+
+
+def _open_supply_loop(price, quantity, CR_ratio, rate_issuance):
+    n = len(quantity)
+    supply = np.empty(n)
+    issuance = 0.0
+    for i in range(n):
+        supply[i] = price * quantity[i] / CR_ratio[i]
+        fee = rate_issuance * supply[i]
+        issuance = issuance + fee if i > 0 else fee
+    return supply, issuance
+
+
+def _redeem_walk_loop(supply, amount):
+    cumulative = 0.0
+    for i in range(len(supply)):
+        cumulative = cumulative + supply[i] if i > 0 else supply[i]
+        if cumulative > amount:
+            return i, cumulative - supply[i]
+    return len(supply), cumulative
+
+
+def _below_ratio_loop(rows, price, quantity, supply, ratio):
+    keep = np.empty(len(rows), dtype=rows.dtype)
+    n = 0
+    for row in rows:
+        if price * quantity[row] / supply[row] < ratio:
+            keep[n] = row
+            n += 1
+    return keep[:n]
+
+
+def _numpy():
+    return Kernels("numpy", _adjust, _open_supply, _redeem_walk, _below_ratio)
+
+
+def _numba():
+    try:
+        import numba
+    except ImportError:
+        return None
+    #error_model="numpy": division by zero gives inf/nan like the array path instead of raising
+    jit = numba.njit(cache=True, error_model="numpy")
+    return Kernels("numba", jit(_adjust_loop), jit(_open_supply_loop), jit(_redeem_walk_loop), jit(_below_ratio_loop))
+
+
+# The kernels of `backend` ("numpy", "numba", "auto", or None for the default); a
+# Kernels value is returned as it is.
+def load(backend=None):
+    if isinstance(backend, Kernels):
+        return backend
+    backend = backend or _default
+    if backend not in BACKENDS + ("auto",):
+        raise ValueError(f"unknown kernel backend {backend!r}, expected one of {BACKENDS + ('auto',)}")
+    if backend not in _loaded:
+        kernels = _numpy() if backend == "numpy" else _numba()
+        if kernels is None:
+            if backend == "numba":
+                warnings.warn("numba is not installed, using the numpy kernels", RuntimeWarning, stacklevel=2)
+            kernels = _loaded.setdefault("numpy", _numpy())
+        _loaded[backend] = kernels
+    return _loaded[backend]
+
+
+# Make `backend` the default for models created from now on, here and in worker
+# processes started afterwards; returns the kernels it resolves to.
+def use(backend):
+    global _default
+    kernels = load(backend)
+    _default = backend
+    os.environ["MACRO_KERNELS"] = backend
+    return kernels
@@ -0,0 +1,484 @@
+import time
+
+import numpy as np
+
+from ensemble import ENSEMBLE_COLUMNS, EnsembleResult
+from exogenous import ibgt_regimes, regime_series
+from result_buffer import ResultBuffer
+from rng_streams import RandomStreams
+from simulation import ModelParams
+from trove_book import LIQUIDATION_RATIO, TROVE_COLUMNS
+
+# Lockstep multi-path engine for the macro model.
+# K independent paths advance together: the troves of all paths share one flat
+# structure-of-arrays book tagged with their path, every per-path quantity is a
+# K-vector, and each phase runs once per hour for all paths as array operations
+# (per-path totals via np.bincount), so the interpreter overhead of a step is paid
+# once for the whole batch instead of once per path.
+#
+# The phases follow MacroModel step by step. The draws come from keyed streams laid
+# out per batch (one vector per phase and step), so path k is a sample of the same
+# model but not the same path as MacroModel with a given seed.
+
+
+# Troves of K paths in one structure-of-arrays book. Rows keep their insertion order
+# within each path; rows of different paths are interleaved.
+class LockstepBook:
+    growth_factor = 2
+
+    def __init__(self, paths, capacity=1024, columns=TROVE_COLUMNS):
+        self.paths = paths
+        self.columns = tuple(columns)
+        self._size = 0
+        self._data = {c: np.empty(max(1, capacity)) for c in self.columns}
+        self._path = np.empty(max(1, capacity), dtype=np.int64)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._path)
+
+    def __getitem__(self, column):
+        return self._data[column][:self._size]
+
+    def __setitem__(self, column, value):
+        self._data[column][:self._size] = value
+
+    # Path of every live row.
+    @property
+    def path(self):
+        return self._path[:self._size]
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(capacity, self.growth_factor * self.capacity)
+        for c in self.columns:
+            grown = np.empty(new_capacity)
+            grown[:self._size] = self._data[c][:self._size]
+            self._data[c] = grown
+        path = np.empty(new_capacity, dtype=np.int64)
+        path[:self._size] = self._path[:self._size]
+        self._path = path
+
+    # Append troves for the given paths (one entry of `path` per trove).
+    def append(self, path, **row):
+        n = len(path)
+        start = self._size
+        self.reserve(start + n)
+        self._path[start:start + n] = path
+        for c in self.columns:
+            self._data[c][start:start + n] = row[c]
+        self._size = start + n
+
+    # Remove rows given as positions or a boolean mask, keeping the survivors in order.
+    def remove(self, rows):
+        keep = np.ones(self._size, dtype=bool)
+        keep[rows] = False
+        n = int(keep.sum())
+        if n == self._size:
+            return
+        for c in self.columns:
+            self._data[c][:n] = self._data[c][:self._size][keep]
+        self._path[:n] = self._path[:self._size][keep]
+        self._size = n
+
+    def counts(self):
+        return np.bincount(self.path, minlength=self.paths)
+
+    # Per-path total of `column`, over the rows in `rows` if given.
+    def total(self, column, rows=slice(None)):
+        return np.bincount(self.path[rows], weights=self[column][rows], minlength=self.paths)
+
+    # Rank of every row within its path, in row order.
+    def ranks(self, order=None):
+        path = self.path if order is None else self.path[order]
+        starts = np.concatenate(([0], np.cumsum(np.bincount(path, minlength=self.paths))[:-1]))
+        return np.arange(len(path)) - starts[path]
+
+
+# K paths of the macro model advanced in lockstep. Paths whose liquidity pool or NECT
+# price turns negative stop individually, like the single-path loop breaks; their
+# troves are dropped and their remaining steps stay NaN.
+class LockstepModel:
+    def __init__(self, params=None, paths=100, seed=2019375):
+        self.params = params or ModelParams()
+        self.paths = paths
+        self.streams = RandomStreams(seed=seed)
+        self.rate_issuance = np.full(paths, float(self.params.rate_issuance))
+        self.rate_redemption = np.full(paths, float(self.params.rate_redemption))
+        self.price_ibgt_current = np.full(paths, float(self.params.price_ibgt_initial))
+        self.active = np.ones(paths, dtype=bool)
+        #step at which a path failed, 0 for paths that did not
+        self.failed_at = np.zeros(paths, dtype=np.int64)
+        self.exogenous_paths()
+
+    # One vector of draws for a phase at one step, one entry per path.
+    def _lanes(self, phase, index):
+        return self.streams.agents(phase, index, self.paths)
+
+    #Exogenous Factors
+
+    # (steps x paths) exogenous series
+    def exogenous_paths(self):
+        p = self.params
+        self.price_ibgt = regime_series(self.streams, 'ibgt_price', p.price_ibgt_initial, ibgt_regimes(p), lanes=self.paths)
+        self.natural_rate = regime_series(self.streams, 'natural_rate', p.natural_rate_initial,
+                                          ((p.period, 0, p.sd_natural_rate),), lanes=self.paths)
+        self.price_POLLEN = regime_series(self.streams, 'POLLEN_price', p.price_POLLEN_initial,
+                                          ((p.month, p.drift_POLLEN, p.sd_POLLEN),), lanes=self.paths)
+
+    #Troves
+
+    def liquidate_troves(self, troves, index, data):
+        p = self.params
+        price_NECT_previous = data.previous('Price_NECT')
+        price_POLLEN_previous = data.previous('price_POLLEN')
+        stability_pool_previous = data.previous('stability')
+
+        price = self.price_ibgt_current[troves.path]
+        liquidated = price*troves['iBGT_Quantity']/troves['Supply'] < LIQUIDATION_RATIO
+        debt_liquidated = troves.total('Supply', liquidated)
+        ibgt_liquidated = troves.total('iBGT_Quantity', liquidated)
+        n_liquidate = np.bincount(troves.path[liquidated], minlength=self.paths)
+        troves.remove(liquidated)
+
+        liquidation_gain = ibgt_liquidated*self.price_ibgt_current - debt_liquidated*price_NECT_previous
+        airdrop_gain = price_POLLEN_previous * p.quantity_POLLEN_airdrop
+
+        shock_return = self._lanes('liquidate_troves', index).normal(0, p.sd_return)
+        if index <= p.day:
+            return_stability = p.initial_return*(1+shock_return)
+        elif index <= p.month:
+            return_stability = np.minimum(0.5, 365*(data.window_sum('liquidation_gain', p.day)+data.window_sum('airdrop_gain', p.day))/(price_NECT_previous*stability_pool_previous))
+        else:
+            return_stability = (365/30)*(data.window_sum('liquidation_gain', p.month)+data.window_sum('airdrop_gain', p.month))/(price_NECT_previous*stability_pool_previous)
+
+        return[troves, return_stability, debt_liquidated, ibgt_liquidated, liquidation_gain, airdrop_gain, n_liquidate]
+
+    def close_troves(self, troves, index2, price_NECT_previous):
+        p = self.params
+        stream = self._lanes('close_troves', index2)
+        shock_closetroves = stream.normal(0, p.sd_closetroves)
+        uniform = stream.uniform(0, 1)
+        n_troves = troves.counts()
+
+        if index2 <= 240:
+            number_closetroves = uniform
+        else:
+            number_closetroves = np.maximum(0, p.n_steady * (1+shock_closetroves))
+            number_closetroves = np.where(price_NECT_previous >= 1, number_closetroves, number_closetroves + p.beta*(1-price_NECT_previous)*n_troves)
+        number_closetroves = np.where(self.active, np.rint(number_closetroves), 0).astype(np.int64)
+
+        #k distinct troves of each path: the k smallest of one uniform key per trove
+        drops = np.minimum(number_closetroves, n_troves)
+        if drops.any():
+            candidates = np.flatnonzero(drops[troves.path] > 0)
+            keys = self.streams.agents('close_troves_sample', index2, len(troves)).uniform(0, 1)[candidates]
+            order = candidates[np.lexsort((keys, troves.path[candidates]))]
+            ranks = troves.ranks(order)
+            troves.remove(order[ranks < drops[troves.path[order]]])
+        number_closetroves = np.where(n_troves - drops < number_closetroves, -999, number_closetroves)
+
+        return[troves, number_closetroves]
+
+    def adjust_troves(self, troves, index):
+        ratio = self._lanes('adjust_troves', index).uniform(0, 1)[troves.path]
+        p = self.streams.agents('adjust_troves_trove', index, len(troves)).uniform(0, 1)
+
+        price = troves['iBGT_Price']
+        quantity = troves['iBGT_Quantity']
+        supply = troves['Supply']
+        CR_initial = troves['CR_initial']
+        troves['CR_current'] = price*quantity/supply
+        check = (troves['CR_current']-CR_initial)/(CR_initial*troves['Rational_inattention'])
+        outside = (check < -1) | (check > 2)
+
+        #A part of the troves are adjusted by adjusting debt
+        by_debt = outside & (p >= ratio)
+        supply_new = price[by_debt]*quantity[by_debt]/CR_initial[by_debt]
+        increase = check[by_debt] > 2
+        path = troves.path[by_debt]
+        issuance_NECT_adjust = np.bincount(path[increase], weights=self.rate_issuance[path[increase]] * (supply_new[increase] - supply[by_debt][increase]), minlength=self.paths)
+        supply[by_debt] = supply_new
+
+        #Another part of the troves are adjusted by adjusting collaterals
+        by_collateral = outside & (p < ratio)
+        quantity[by_collateral] = CR_initial[by_collateral]*supply[by_collateral]/price[by_collateral]
+
+        return[troves, issuance_NECT_adjust]
+
+    def open_troves(self, troves, index1, price_NECT_previous):
+        p = self.params
+        streams = self.streams
+        shock_opentroves = self._lanes('open_troves', index1).normal(0, p.sd_opentroves)
+        n_troves = troves.counts()
+
+        if index1 <= 0:
+            number_opentroves = np.full(self.paths, float(p.initial_open))
+        else:
+            number_opentroves = np.maximum(0, p.n_steady * (1+shock_opentroves))
+            number_opentroves = np.where(price_NECT_previous <= 1 + self.rate_issuance, number_opentroves,
+                                         number_opentroves + p.alpha*(price_NECT_previous-self.rate_issuance-1)*n_troves)
+        number_opentroves = np.where(self.active, np.rint(number_opentroves), 0).astype(np.int64)
+
+        n = int(number_opentroves.sum())
+        path = np.repeat(np.arange(self.paths), number_opentroves)
+        price_ibgt_current = self.price_ibgt[index1][path]
+        CR_ratio = p.distribution_parameter1_CR + p.distribution_parameter2_CR * streams.agents('open_troves_CR', index1, n).chisquare(p.distribution_parameter3_CR)
+        quantity_ibgt = streams.agents('open_troves_quantity', index1, n).gamma(p.distribution_parameter1_ibgt_quantity, p.distribution_parameter2_ibgt_quantity)
+        rational_inattention = streams.agents('open_troves_inattention', index1, n).gamma(p.distribution_parameter1_inattention, p.distribution_parameter2_inattention)
+
+        supply_trove = price_ibgt_current * quantity_ibgt / CR_ratio
+        issuance_NECT_open = np.bincount(path, weights=self.rate_issuance[path] * supply_trove, minlength=self.paths)
+
+        troves.append(path, iBGT_Price=price_ibgt_current, iBGT_Quantity=quantity_ibgt,
+                      CR_initial=CR_ratio, Supply=supply_trove,
+                      Rational_inattention=rational_inattention, CR_current=CR_ratio)
+
+        return[troves, number_opentroves, issuance_NECT_open]
+
+    #NECT Market
+
+    def stability_update(self, stability_pool_previous, return_previous, index):
+        p = self.params
+        shock_stability = self._lanes('stability_update', index).normal(0, p.sd_stability)
+        natural_rate_current = self.natural_rate[index]
+        if index <= p.month:
+            stability_pool = stability_pool_previous* (p.drift_stability+shock_stability)* (1+ return_previous- natural_rate_current)**p.theta
+        else:
+            stability_pool = stability_pool_previous* (1+shock_stability)* (1+ return_previous- natural_rate_current)**p.theta
+        return[stability_pool]
+
+    # Redeem `amount[k]` of NECT on every path k in `redeeming`: each path's troves are
+    # taken in order of CR_current and one segmented cumulative sum finds the fully
+    # redeemed prefix; the residual comes from the next trove.
+    # Returns (n_redempt, unfilled) per path.
+    def redeem(self, troves, redeeming, amount):
+        n_redempt = np.zeros(self.paths, dtype=np.int64)
+        unfilled = np.zeros(self.paths)
+        if not redeeming.any():
+            return n_redempt, unfilled
+        rows = np.flatnonzero(redeeming[troves.path])
+        order = rows[np.lexsort((troves['CR_current'][rows], troves.path[rows]))]
+        path = troves.path[order]
+        supply = troves['Supply'][order]
+        ranks = troves.ranks(order)
+        #cumulative supply within each path: the global running sum minus its value before the path's first trove
+        cumulative = np.cumsum(supply)
+        first_rows = ranks == 0
+        cumulative -= (cumulative - supply)[first_rows][np.cumsum(first_rows) - 1]
+        beyond = cumulative > amount[path]
+
+        counts = np.bincount(path, minlength=self.paths)
+        first = np.full(self.paths, -1)
+        beyond_rows = np.flatnonzero(beyond)
+        paths_beyond, at = np.unique(path[beyond_rows], return_index=True)
+        first[paths_beyond] = beyond_rows[at]
+
+        #paths whose whole book is redeemed
+        exhausted = redeeming & (first < 0)
+        totals = np.bincount(path, weights=supply, minlength=self.paths)
+        n_redempt[exhausted] = counts[exhausted]
+        unfilled[exhausted] = amount[exhausted] - totals[exhausted]
+
+        #the others lose their prefix and the next trove takes the residual
+        partial = paths_beyond
+        n_redempt[partial] = ranks[first[partial]]
+        nxt = order[first[partial]]
+        redempted = cumulative[first[partial]] - supply[first[partial]]
+        residual = amount[partial] - redempted
+        price = self.price_ibgt_current[partial]
+        troves['Supply'][nxt] = troves['Supply'][nxt] - residual
+        troves['iBGT_Quantity'][nxt] = troves['iBGT_Quantity'][nxt] - residual/price
+        troves['CR_current'][nxt] = price * troves['iBGT_Quantity'][nxt] / troves['Supply'][nxt]
+        troves.remove(order[ranks < n_redempt[path]])
+        return n_redempt, unfilled
+
+    def price_stabilizer(self, troves, index, data, stability_pool, n_open):
+        p = self.params
+        rate_issuance = self.rate_issuance
+        rate_redemption = self.rate_redemption
+        price_ibgt_current = self.price_ibgt_current
+        #Calculating Price
+        supply = troves.total('Supply')
+        shock_liquidity = self._lanes('liquidity', index).normal(0, p.sd_liquidity)
+        liquidity_pool_previous = data.previous('liquidity')
+        price_NECT_previous = data.previous('Price_NECT')
+        price_NECT_current = price_NECT_previous*((supply-stability_pool)/(liquidity_pool_previous*(p.drift_liquidity+shock_liquidity)))**(1/p.delta)
+
+        #Liquidity Pool
+        liquidity_pool = supply-stability_pool
+
+        #Stabilizer
+        #Ceiling Arbitrageurs
+        ceiling = self.active & (price_NECT_current > 1.1 + rate_issuance)
+        supply_wanted = stability_pool+liquidity_pool_previous*(p.drift_liquidity+shock_liquidity)*((1.1+rate_issuance)/price_NECT_previous)**p.delta
+        supply_trove = supply_wanted - supply
+        CR_ratio = 1.1
+        quantity_ibgt = supply_trove * CR_ratio / price_ibgt_current
+        issuance_NECT_stabilizer = np.where(ceiling, rate_issuance * supply_trove, 0)
+        if ceiling.any():
+            troves.append(np.flatnonzero(ceiling), iBGT_Price=price_ibgt_current[ceiling], iBGT_Quantity=quantity_ibgt[ceiling], CR_initial=CR_ratio,
+                          Supply=supply_trove[ceiling], Rational_inattention=0.1, CR_current=CR_ratio)
+        price_NECT_current = np.where(ceiling, 1.1 + rate_issuance, price_NECT_current)
+        liquidity_pool = np.where(ceiling, supply_wanted-stability_pool, liquidity_pool)
+        n_open = n_open + ceiling
+
+        #Floor Arbitrageurs
+        floor = self.active & (price_NECT_current < 1 - rate_redemption)
+        shock_redemption = self._lanes('redemption', index).normal(0, p.sd_redemption)
+        redemption_ratio = p.redemption_star * (1+shock_redemption)
+        supply_target = stability_pool+liquidity_pool_previous*(p.drift_liquidity+shock_liquidity)*((1-rate_redemption)/price_NECT_previous)**p.delta
+        supply_diff = supply - supply_target
+        to_target = supply_diff < redemption_ratio * liquidity_pool
+        redemption_pool = np.where(floor, np.where(to_target, supply_diff, redemption_ratio * liquidity_pool), 0)
+        price_NECT_current = np.where(floor & to_target, 1 - rate_redemption, price_NECT_current)
+        price_NECT_current = np.where(floor & ~to_target, price_NECT_previous * (liquidity_pool/(liquidity_pool_previous*(p.drift_liquidity+shock_liquidity)))**(1/p.delta), price_NECT_current)
+
+        #Shutting down the riskiest troves, residual taken from the next one
+        n_redempt, unfilled = self.redeem(troves, floor, redemption_pool)
+        redemption_pool = redemption_pool - unfilled
+
+        #Redemption Fee
+        redemption_fee = rate_redemption * redemption_pool
+
+        return[price_NECT_current, liquidity_pool, troves, issuance_NECT_stabilizer, redemption_fee, n_redempt, redemption_pool, n_open]
+
+    #POLLEN Market
+
+    def POLLEN_market(self, index, data):
+        p = self.params
+        quantity_POLLEN = (100000000/3)*(1-0.5**(index/p.period))
+        if index <= p.month:
+            price_POLLEN_current = self.price_POLLEN[index-1]
+            annualized_earning = (index/p.month)**0.5*self._lanes('POLLEN_market', index).normal(200000000, 500000)
+        else:
+            revenue_issuance = data.window_sum('issuance_fee', p.month)
+            revenue_redemption = data.window_sum('redemption_fee', p.month)
+            annualized_earning = 365*(revenue_issuance+revenue_redemption)/30
+            discount = index/p.period
+            price_POLLEN_current = discount*p.PE_ratio*annualized_earning/p.POLLEN_total_supply
+
+        MC_POLLEN_current = price_POLLEN_current * quantity_POLLEN
+        return[price_POLLEN_current, annualized_earning, MC_POLLEN_current]
+
+    #Simulation Program
+
+    def track_windows(self, data):
+        p = self.params
+        for column in ['liquidation_gain', 'airdrop_gain']:
+            data.track(column, p.day)
+            data.track(column, p.month)
+        for column in ['issuance_fee', 'redemption_fee']:
+            data.track(column, p.month)
+
+    def start(self):
+        p = self.params
+        initials = {"Price_NECT":1.00, "Price_iBGT":p.price_ibgt_initial, "n_open":p.initial_open, "n_close":0, "n_liquidate": 0, "n_redempt":0,
+                    "n_troves":p.initial_open, "stability":0, "liquidity":0, "redemption_pool":0,
+                    "supply_NECT":0,  "return_stability":p.initial_return, "airdrop_gain":0, "liquidation_gain":0,  "issuance_fee":0, "redemption_fee":0,
+                    "price_POLLEN":p.price_POLLEN_initial, "MC_POLLEN":0, "annualized_earning":0}
+        data = ResultBuffer(initials, p.n_sim, lanes=self.paths)
+        self.track_windows(data)
+        troves = LockstepBook(self.paths, capacity=4 * p.initial_open * self.paths)
+        result_open = self.open_troves(troves, 0, np.full(self.paths, initials['Price_NECT']))
+        issuance_NECT_open = result_open[2]
+        supply = troves.total('Supply')
+        initials['issuance_fee'] = issuance_NECT_open * initials["Price_NECT"]
+        initials['supply_NECT'] = supply
+        initials['liquidity'] = 0.5*supply
+        initials['stability'] = 0.5*supply
+        data.record(initials)
+        return data, troves
+
+    # Advance all paths by hour `index`; returns the row to record (NaN for paths that
+    # are stopped) and the paths that stop before recording this step: those whose
+    # liquidity pool ran dry and those that failed.
+    def step(self, troves, data, index):
+        #exogenous ibgt price input
+        price_ibgt_current = self.price_ibgt[index]
+        self.price_ibgt_current = price_ibgt_current
+        troves['iBGT_Price'] = price_ibgt_current[troves.path]
+        price_NECT_previous = data.previous('Price_NECT')
+
+        result_liquidation = self.liquidate_troves(troves, index, data)
+        return_stability = result_liquidation[1]
+        liquidation_gain = result_liquidation[4]
+        airdrop_gain = result_liquidation[5]
+        n_liquidate = result_liquidation[6]
+
+        n_close = self.close_troves(troves, index, price_NECT_previous)[1]
+        issuance_NECT_adjust = self.adjust_troves(troves, index)[1]
+
+        result_open = self.open_troves(troves, index, price_NECT_previous)
+        n_open = result_open[1]
+        issuance_NECT_open = result_open[2]
+
+        stability_pool = self.stability_update(data.previous('stability'), return_stability, index)[0]
+
+        result_price = self.price_stabilizer(troves, index, data, stability_pool, n_open)
+        price_NECT_current = result_price[0]
+        liquidity_pool = result_price[1]
+        issuance_NECT_stabilizer = result_price[3]
+        redemption_fee = result_price[4]
+        n_redempt = result_price[5]
+        redemption_pool = result_price[6]
+        n_open = result_price[7]
+        dry = self.active & (liquidity_pool < 0)
+        #a NaN price stops a single-path run with an error (in close_troves), here only the path fails
+        failed = self.active & ~dry & ~np.isfinite(price_NECT_current)
+        self.failed_at[failed] = index
+
+        result_POLLEN = self.POLLEN_market(index, data)
+        price_POLLEN_current = result_POLLEN[0]
+        annualized_earning = result_POLLEN[1]
+        MC_POLLEN_current = result_POLLEN[2]
+
+        issuance_fee = price_NECT_current * (issuance_NECT_adjust + issuance_NECT_open + issuance_NECT_stabilizer)
+        row = {"Price_NECT":price_NECT_current, "Price_iBGT":price_ibgt_current, "n_open":n_open, "n_close":n_close,
+               "n_liquidate":n_liquidate, "n_redempt":n_redempt, "n_troves":troves.counts(),
+               "stability":stability_pool, "liquidity":liquidity_pool, "redemption_pool":redemption_pool, "supply_NECT":troves.total('Supply'),
+               "issuance_fee":issuance_fee, "redemption_fee":redemption_fee,
+               "airdrop_gain":airdrop_gain, "liquidation_gain":liquidation_gain, "return_stability":return_stability,
+               "annualized_earning":annualized_earning, "MC_POLLEN":MC_POLLEN_current, "price_POLLEN":price_POLLEN_current}
+        stopped = dry | failed
+        for c, value in row.items():
+            row[c] = np.where(self.active & ~stopped, value, np.nan)
+        return row, stopped
+
+    # Stop the given paths and drop their troves.
+    def stop(self, troves, paths):
+        self.active &= ~paths
+        troves.remove(paths[troves.path])
+
+    def run(self):
+        data, troves = self.start()
+        with np.errstate(all='ignore'):
+            for index in range(1, self.params.n_sim):
+                if not self.active.any():
+                    break
+                row, stopped = self.step(troves, data, index)
+                self.stop(troves, stopped)
+                data.record(row)
+                self.stop(troves, self.active & (row["Price_NECT"] < 0))
+        return data, troves
+
+
+# K lockstep paths of the baseline model, returned like run_ensemble() so the same
+# quantile bands apply; failed paths are left out and listed in `failed`.
+def run_lockstep(params=None, paths=1000, seed=2019375, columns=ENSEMBLE_COLUMNS):
+    params = params or ModelParams()
+    started = time.monotonic()
+    model = LockstepModel(params, paths, seed)
+    data, _ = model.run()
+    done = np.flatnonzero(model.failed_at == 0)
+    failed = {int(k): f"non-finite NECT price at step {model.failed_at[k]}" for k in np.flatnonzero(model.failed_at)}
+    stacked = {}
+    for c in columns:
+        values = np.full((len(done), params.n_sim), np.nan)
+        values[:, :len(data)] = data[c][:, done].T
+        stacked[c] = values
+    return EnsembleResult(params, columns, done.tolist(), stacked, failed, time.monotonic() - started)
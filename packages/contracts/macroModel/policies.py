@@ -0,0 +1,216 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from simulation import Checkpoint, MacroModel, ModelParams, RunTimeout
+
+# Fee policies for the macro model.
+# A policy sets the issuance and redemption rates of a MacroModel before every step and
+# can record columns of its own next to the model's. MacroModel.run(policy) drives any of
+# them through the same step loop, so a new policy is a small class instead of another
+# copy of the simulation loop:
+#
+#   class MyPolicy(FeePolicy):
+#       def rates(self, model, troves, data, index):
+#           return 0.005, 0.02, {}
+
+
+class FeePolicy:
+    # Extra columns the policy records, with their values at step 0.
+    def initials(self, model):
+        return {}
+
+    # Called once before the initial troves are opened.
+    def start(self, model):
+        pass
+
+    # (rate_issuance, rate_redemption, extra columns) for step `index`, from the state
+    # the step starts from.
+    def rates(self, model, troves, data, index):
+        raise NotImplementedError
+
+    # Set the model's rates for step `index`; returns the extra columns to record.
+    def apply(self, model, troves, data, index):
+        rate_issuance, rate_redemption, extra = self.rates(model, troves, data, index)
+        model.rate_issuance = rate_issuance
+        model.rate_redemption = rate_redemption
+        return extra
+
+
+# Constant rates; by default the ones in the model's parameters (the baseline).
+class FixedRates(FeePolicy):
+    def __init__(self, rate_issuance=None, rate_redemption=None):
+        self.rate_issuance = rate_issuance
+        self.rate_redemption = rate_redemption
+
+    def _rates(self, model):
+        p = model.params
+        return (p.rate_issuance if self.rate_issuance is None else self.rate_issuance,
+                p.rate_redemption if self.rate_redemption is None else self.rate_redemption)
+
+    def start(self, model):
+        model.rate_issuance, model.rate_redemption = self._rates(model)
+
+    def rates(self, model, troves, data, index):
+        return self._rates(model) + ({},)
+
+
+# Issuance fee = redemption fee = base rate, where the base rate decays geometrically and
+# rises with the share of the supply redeemed in the previous step:
+#   base_rate = decay * base_rate_previous + weight * redemption_pool_previous / supply
+# The initial troves are opened at the parameters' rates, as in the original loop.
+class DecayingBaseRate(FeePolicy):
+    def __init__(self, decay=0.98, weight=0.5, initial=None):
+        self.decay = decay
+        self.weight = weight
+        self.initial = initial
+
+    def initials(self, model):
+        return {"base_rate": model.params.base_rate_initial if self.initial is None else self.initial}
+
+    def rates(self, model, troves, data, index):
+        base_rate_current = self.decay * data.previous('base_rate') + self.weight*(data.previous('redemption_pool')/troves['Supply'].sum())
+        return base_rate_current, base_rate_current, {"base_rate": float(base_rate_current)}
+
+
+# One table out of per-policy results ({name: ResultBuffer or DataFrame}), indexed by
+# (policy, step); columns a policy does not record are NaN for it.
+def policy_table(results):
+    frames = {name: data if isinstance(data, pd.DataFrame) else data.to_frame() for name, data in results.items()}
+    return pd.concat(frames, names=["policy", "step"])
+
+
+def _run_grid_chunk(params, policies, seeds, columns, timeout, shared):
+    results = []
+    for seed in seeds:
+        paths = shared[seed].open() if shared else None
+        #one model per seed: every policy sees the same exogenous series and draws
+        model = MacroModel(params, seed=seed, paths=paths)
+        for name, policy in policies.items():
+            try:
+                data, _ = model.run(policy, timeout=timeout)
+            except RunTimeout as error:
+                results.append((name, seed, None, f"timeout: {error}"))
+                continue
+            except Exception as error:
+                results.append((name, seed, None, f"{type(error).__name__}: {error}"))
+                continue
+            frame = data.to_frame()
+            if columns is not None:
+                frame = frame.reindex(columns=list(columns))
+            results.append((name, seed, frame, None))
+    return results
+
+
+# Evaluate every policy in `policies` ({name: FeePolicy}) on every seed, with common
+# random numbers: for a given seed all policies run on the same exogenous series and the
+# same keyed draws, so their differences come from the policies alone.
+#
+# The runs are scheduled over a process pool (workers=1 runs in this process) in tasks of
+# about `chunksize` runs, by default four tasks per worker. A task covers several seeds
+# with all policies, or one seed with a slice of the policies when there are many of
+# them, and builds each seed's model once. `store` (a PathStore) shares the exogenous
+# series across workers and calls. `columns` limits what is kept, which matters for
+# large grids. Returns (table, failed): the table is indexed by (policy, seed, step),
+# `failed` maps (policy, seed) to the error of runs that did not finish.
+def run_policy_grid(policies, params=None, seeds=(2019375,), workers=None, chunksize=None,
+                    timeout=None, progress=None, columns=None, store=None):
+    params = params or ModelParams()
+    seeds = list(range(seeds)) if isinstance(seeds, int) else list(seeds)
+    workers = workers or os.cpu_count() or 1
+    names = list(policies)
+    total = len(seeds) * len(names)
+    chunksize = chunksize or max(1, math.ceil(total / (4 * workers)))
+    if chunksize >= len(names):
+        per_task = chunksize // max(1, len(names))
+        tasks = [(seeds[i:i + per_task], names) for i in range(0, len(seeds), per_task)]
+    else:
+        tasks = [([seed], names[i:i + chunksize]) for seed in seeds for i in range(0, len(names), chunksize)]
+    shared = None if store is None else {seed: store.publish(params, seed) for seed in seeds}
+
+    frames = {}
+    failed = {}
+
+    def collect(results):
+        for name, seed, frame, error in results:
+            if error is None:
+                frames[(name, seed)] = frame
+            else:
+                failed[(name, seed)] = error
+        if progress is not None:
+            progress(len(frames) + len(failed), total, len(failed))
+
+    if workers == 1:
+        for task_seeds, task_names in tasks:
+            collect(_run_grid_chunk(params, {n: policies[n] for n in task_names}, task_seeds, columns, timeout, shared))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_grid_chunk, params, {n: policies[n] for n in task_names}, task_seeds, columns, timeout,
+                                   shared and {seed: shared[seed] for seed in task_seeds}) for task_seeds, task_names in tasks]
+            for future in as_completed(futures):
+                collect(future.result())
+
+    ordered = {(name, seed): frames[(name, seed)] for name in names for seed in seeds if (name, seed) in frames}
+    if not ordered:
+        return pd.DataFrame(), failed
+    table = pd.concat(ordered, names=["policy", "seed", "step"])
+    return table, failed
+
+
+def _run_fork_chunk(checkpoint, policies, columns, timeout):
+    results = []
+    for name, policy in policies.items():
+        model, data, troves = MacroModel.from_checkpoint(checkpoint)
+        try:
+            data, _ = model.run(policy, timeout=timeout, state=(data, troves))
+        except RunTimeout as error:
+            results.append((name, None, f"timeout: {error}"))
+            continue
+        except Exception as error:
+            results.append((name, None, f"{type(error).__name__}: {error}"))
+            continue
+        frame = data.to_frame()
+        if columns is not None:
+            frame = frame.reindex(columns=list(columns))
+        results.append((name, frame, None))
+    return results
+
+
+# Fork one run into a variant per policy in `policies` ({name: FeePolicy}): each variant
+# carries on from `checkpoint` (a Checkpoint or a file saved by one) under its policy,
+# so a prefix the variants share, e.g. the months before a policy is switched on, is
+# simulated once. A policy whose columns the prefix did not record starts them from its
+# initial values at the checkpoint. The variants run over a process pool, one task per
+# policy (workers=1 runs in this process). Returns (table, failed) like
+# run_policy_grid(), the table indexed by (policy, step) and including the prefix.
+def fork_policies(checkpoint, policies, workers=None, timeout=None, columns=None, progress=None):
+    if not isinstance(checkpoint, Checkpoint):
+        checkpoint = Checkpoint.load(checkpoint)
+    workers = workers or os.cpu_count() or 1
+    names = list(policies)
+    frames = {}
+    failed = {}
+
+    def collect(results):
+        for name, frame, error in results:
+            if error is None:
+                frames[name] = frame
+            else:
+                failed[name] = error
+        if progress is not None:
+            progress(len(frames) + len(failed), len(names), len(failed))
+
+    if workers == 1:
+        collect(_run_fork_chunk(checkpoint, policies, columns, timeout))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_fork_chunk, checkpoint, {name: policies[name]}, columns, timeout) for name in names]
+            for future in as_completed(futures):
+                collect(future.result())
+
+    ordered = {name: frames[name] for name in names if name in frames}
+    if not ordered:
+        return pd.DataFrame(), failed
+    return policy_table(ordered), failed
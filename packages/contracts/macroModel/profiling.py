@@ -0,0 +1,280 @@
+import os
+import time
+import tracemalloc
+
+# Per-phase instrumentation of the simulation loops.
+# A Profiler times named phases (with profiler.phase(name): ...), counting calls and
+# wall time and, with memory=True, the net allocation and peak traced by tracemalloc.
+# Phases nest: a phase opened inside another is recorded under its path, e.g.
+# ("step", "price_stabilizer", "redeem"), so the time of each phase splits into its own
+# and its children's. Durations go into log2 histograms (bucket k holds the calls that
+# took 2**(k-1) to 2**k ns), so memory stays constant however long the run is.
+#
+#   profiler = Profiler()
+#   model.run(profiler=profiler)
+#   print(profiler.summary())
+#   profiler.write_folded("run.folded")    # flamegraph.pl, speedscope, inferno
+#
+# attach() times methods of an object in place of its own, and proxy() the calls to a
+# set of (brownie) contracts, so the loops themselves need no changes. A profiler made
+# with enabled=False does nothing: phase() hands out one shared no-op context, and
+# attach() / proxy() leave their targets alone.
+
+#log2 buckets of the duration histograms, enough for calls of up to 2**63 ns
+BUCKETS = 64
+
+
+# A profiler that is on if MACRO_PROFILE is set: "memory" also traces allocations.
+def profiler_from_env(variable="MACRO_PROFILE"):
+    value = os.environ.get(variable, "")
+    return Profiler(enabled=bool(value), memory=value == "memory")
+
+
+class _Idle:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_IDLE = _Idle()
+
+
+class _Phase:
+    __slots__ = ("profiler", "name")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._exit()
+        return False
+
+
+# Statistics of one phase path.
+class _Stats:
+    __slots__ = ("calls", "total", "children", "max", "allocated", "peak", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0
+        self.children = 0
+        self.max = 0
+        self.allocated = 0
+        self.peak = 0
+        self.histogram = [0] * BUCKETS
+
+
+# Calls of a contract function, timed as phase "<contract>.<function>"; everything else
+# (.call, .estimate_gas, ...) is passed through untimed.
+class _TimedCall:
+    def __init__(self, profiler, function, name):
+        self._profiler = profiler
+        self._function = function
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        with self._profiler.phase(self._name):
+            return self._function(*args, **kwargs)
+
+    def __getattr__(self, attribute):
+        return getattr(self._function, attribute)
+
+
+class _ContractProxy:
+    def __init__(self, profiler, contract, name):
+        self._profiler = profiler
+        self._contract = contract
+        self._name = name
+
+    def __getattr__(self, attribute):
+        value = getattr(self._contract, attribute)
+        if callable(value):
+            return _TimedCall(self._profiler, value, f"{self._name}.{attribute}")
+        return value
+
+
+class _Contracts:
+    pass
+
+
+class Profiler:
+    def __init__(self, enabled=True, memory=False):
+        self.enabled = enabled
+        self.memory = memory and enabled
+        self._stats = {}
+        self._stack = []
+        self._attached = []
+        self._started_tracing = False
+
+    def phase(self, name):
+        if not self.enabled:
+            return _IDLE
+        return _Phase(self, name)
+
+    # frame: [path, start, child time, memory at start, highest peak seen]
+    def _enter(self, name):
+        path = (self._stack[-1][0] if self._stack else ()) + (name,)
+        current = 0
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                #the peak is reset for this phase; keep the enclosing phase's so far
+                self._stack[-1][4] = max(self._stack[-1][4], peak)
+            tracemalloc.reset_peak()
+        self._stack.append([path, time.perf_counter_ns(), 0, current, current])
+
+    def _exit(self):
+        elapsed = time.perf_counter_ns()
+        path, start, children, current, peak = self._stack.pop()
+        elapsed -= start
+        stats = self._stats.get(path)
+        if stats is None:
+            stats = self._stats[path] = _Stats()
+        stats.calls += 1
+        stats.total += elapsed
+        stats.children += children
+        stats.max = max(stats.max, elapsed)
+        stats.histogram[min(elapsed.bit_length(), BUCKETS - 1)] += 1
+        if self.memory:
+            now, traced_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, traced_peak)
+            stats.allocated += now - current
+            stats.peak = max(stats.peak, peak - current)
+        if self._stack:
+            self._stack[-1][2] += elapsed
+            if self.memory:
+                self._stack[-1][4] = max(self._stack[-1][4], peak)
+
+    # Time `function` as phase `name` (its __name__ by default).
+    def wrap(self, function, name=None):
+        if not self.enabled:
+            return function
+        name = name or function.__name__
+
+        def timed(*args, **kwargs):
+            with _Phase(self, name):
+                return function(*args, **kwargs)
+        return timed
+
+    # Time the methods `names` of `obj`, each as a phase of its name, until detach().
+    def attach(self, obj, names):
+        if not self.enabled:
+            return obj
+        for name in names:
+            setattr(obj, name, self.wrap(getattr(obj, name), name))
+        self._attached.append((obj, names))
+        return obj
+
+    # Undo attach(), so the objects can be pickled or checkpointed again.
+    def detach(self):
+        while self._attached:
+            obj, names = self._attached.pop()
+            for name in names:
+                if name in vars(obj):
+                    delattr(obj, name)
+
+    # `contracts` (an object holding brownie contracts as attributes) with every contract
+    # function call timed as "<attribute>.<function>".
+    def proxy(self, contracts):
+        if not self.enabled:
+            return contracts
+        proxied = _Contracts()
+        for name, contract in vars(contracts).items():
+            setattr(proxied, name, _ContractProxy(self, contract, name))
+        return proxied
+
+    # Stop tracing allocations, if this profiler started it.
+    def close(self):
+        self.detach()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def reset(self):
+        self._stats = {}
+
+    # Per phase: calls, total and own time, mean, approximate p50 / p95 (upper edges of
+    # the histogram buckets) and max in ms, and with memory=True the net allocation and
+    # the largest peak over the phase's start in KiB. `by` = "name" adds up the paths
+    # ending in the same phase, "path" keeps them apart ("step/adjust_troves").
+    def summary(self, by="name"):
+        import pandas as pd
+
+        merged = {}
+        for path, stats in self._stats.items():
+            key = path[-1] if by == "name" else "/".join(path)
+            entry = merged.setdefault(key, _Stats())
+            entry.calls += stats.calls
+            entry.total += stats.total
+            entry.children += stats.children
+            entry.max = max(entry.max, stats.max)
+            entry.allocated += stats.allocated
+            entry.peak = max(entry.peak, stats.peak)
+            entry.histogram = [a + b for a, b in zip(entry.histogram, stats.histogram)]
+        rows = {}
+        for key, stats in merged.items():
+            row = {"calls": stats.calls, "total_s": stats.total / 1e9, "own_s": (stats.total - stats.children) / 1e9,
+                   "mean_ms": stats.total / stats.calls / 1e6,
+                   "p50_ms": _quantile(stats.histogram, 0.5) / 1e6, "p95_ms": _quantile(stats.histogram, 0.95) / 1e6,
+                   "max_ms": stats.max / 1e6}
+            if self.memory:
+                row["allocated_kib"] = stats.allocated / 1024
+                row["peak_kib"] = stats.peak / 1024
+            rows[key] = row
+        table = pd.DataFrame.from_dict(rows, orient="index")
+        table.index.name = "phase"
+        return table.sort_values("total_s", ascending=False) if len(table) else table
+
+    # Duration histograms, one column per phase name, indexed by the upper edge of each
+    # log2 bucket in ms; empty buckets at either end are left out.
+    def histograms(self):
+        import pandas as pd
+
+        counts = {}
+        for path, stats in self._stats.items():
+            merged = counts.setdefault(path[-1], [0] * BUCKETS)
+            counts[path[-1]] = [a + b for a, b in zip(merged, stats.histogram)]
+        table = pd.DataFrame(counts, index=[2**k / 1e6 for k in range(BUCKETS)])
+        table.index.name = "upto_ms"
+        used = table.sum(axis=1).to_numpy().nonzero()[0]
+        return table.iloc[used[0]:used[-1] + 1] if len(used) else table.iloc[:0]
+
+    # Own time of every phase path in folded-stack format ("step;adjust_troves 1234", in
+    # microseconds), the input of flamegraph.pl, speedscope and inferno.
+    def folded(self):
+        lines = []
+        for path, stats in sorted(self._stats.items()):
+            own = (stats.total - stats.children) // 1000
+            if own > 0:
+                lines.append(f"{';'.join(path)} {own}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            f.write(self.folded())
+
+    def write_summary(self, path, by="name"):
+        self.summary(by).to_csv(path)
+
+
+# Upper edge (ns) of the bucket holding quantile `q` of a log2 histogram.
+def _quantile(histogram, q):
+    total = sum(histogram)
+    if total == 0:
+        return 0
+    seen = 0
+    for k, count in enumerate(histogram):
+        seen += count
+        if seen >= q * total:
+            return 2**k
+    return 2**(len(histogram) - 1)
@@ -0,0 +1,335 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from result_sink import read_columns
+
+# Reporting layer for the macro model.
+# The exhibition figures are specs (Figure, Trace) instead of plotting code, built on
+# demand from results already computed or stored: a {run name: DataFrame} dict, a
+# policy_table(), or result_sink directories/files, of which only the columns the figures
+# use are read. Line traces are downsampled to a target number of points with LTTB
+# (largest triangle three buckets), which keeps the peaks and crashes a plain stride
+# would drop, so figures of year- or decade-long hourly runs stay small and fast.
+#
+#   show(EXHIBITION, {"baseline": data})
+#   render(COMPARISON, {"baseline": data, "base rate": data2}, "figures", format="png")
+#
+# render() writes the figures of a batch to static files over a process pool; formats
+# other than html need plotly's kaleido.
+
+#steps per month, the unit of the time axis
+MONTH = 720
+POINTS = 2000
+
+
+# Indices of `points` samples of (x, y) chosen by LTTB: the first and last points, and
+# from each of the buckets in between the point spanning the largest triangle with the
+# point kept before it and the average of the next bucket.
+def lttb(x, y, points=POINTS):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    keep = np.empty(points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < points - 1 else n
+        x_next = x[next_lo:next_hi].mean()
+        y_next = y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - x_next) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (y_next - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+# (x, y) of a series downsampled to `points`; missing values (e.g. after a run stopped)
+# are dropped first.
+def downsample(x, y, points=POINTS):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    keep = lttb(x, y, points)
+    return x[keep], y[keep]
+
+
+# One series of a figure: `column` of run `run` (or the constant `value`) times `scale`.
+# Histograms read `column` from the troves of `run`.
+@dataclass
+class Trace:
+    column: str
+    name: str
+    run: str = "baseline"
+    secondary_y: bool = False
+    row: int = 1
+    col: int = 1
+    mode: str = None
+    dash: str = None
+    scale: float = 1
+    value: float = None
+
+
+# A figure: line traces against time in months (x="month"), against the row of the
+# trove book (x="row"), or histograms (kind="histogram"). `yaxes` are
+# (title, update_yaxes keywords) pairs.
+@dataclass
+class Figure:
+    title: str
+    traces: tuple
+    rows: int = 1
+    cols: int = 1
+    kind: str = "line"
+    x: str = "month"
+    xaxis: str = "Month"
+    yaxes: tuple = ()
+    nbins: int = 25
+    troves: bool = False
+
+    @property
+    def secondary_y(self):
+        return self.rows == 1 and self.cols == 1 and self.kind == "line"
+
+    # The (run, column) pairs the figure reads.
+    def columns(self):
+        return {(t.run, t.column) for t in self.traces if t.value is None}
+
+
+_LEFT, _RIGHT = {"secondary_y": False}, {"secondary_y": True}
+
+# Exhibition of a single run, named "baseline".
+EXHIBITION = {
+    "prices": Figure("Price Dynamics of NECT and iBGT", (
+        Trace("Price_NECT", "NECT Price"), Trace("Price_iBGT", "iBGT Price", secondary_y=True)),
+        yaxes=(("NECT Price", _LEFT), ("iBGT Price", _RIGHT))),
+    "troves": Figure("Dynamics of Trove Numbers and NECT Supply", (
+        Trace("n_troves", "Number of Troves"), Trace("supply_NECT", "NECT Supply", secondary_y=True)),
+        yaxes=(("Number of Troves", _LEFT), ("NECT Supply", _RIGHT))),
+    "open_close": Figure("Dynamics of Number of Troves Opened and Closed", (
+        Trace("n_open", "Number of Troves Opened", mode="markers"),
+        Trace("n_close", "Number of Troves Closed", row=2, mode="markers")), rows=2,
+        yaxes=(("Troves Opened", {"row": 1, "col": 1}), ("Troves Closed", {"row": 2, "col": 1}))),
+    "liquidations": Figure("Dynamics of Number of Liquidated and Redempted Troves", (
+        Trace("n_liquidate", "Number of Liquidated Troves", mode="markers"),
+        Trace("n_redempt", "Number of Redempted Troves", mode="markers")),
+        yaxes=(("Number of Liquidated Troves", _LEFT), ("Number of Redempted Troves", _RIGHT))),
+    "pools": Figure("Dynamics of Liquidity, Stability, Redemption Pools and Return of Stability Pool", (
+        Trace("liquidity", "Liquidity Pool"), Trace("stability", "Stability Pool"),
+        Trace("redemption_pool", "100*Redemption Pool", scale=100),
+        Trace("return_stability", "Return of Stability Pool", secondary_y=True)),
+        yaxes=(("Size of Pools", _LEFT), ("Return", _RIGHT))),
+    "gains": Figure("Dynamics of Airdrop and Liquidation Gain", (
+        Trace("airdrop_gain", "Airdrop Gain"), Trace("liquidation_gain", "Liquidation Gain", secondary_y=True)),
+        yaxes=(("Airdrop Gain", _LEFT), ("Liquidation Gain", _RIGHT))),
+    "fees": Figure("Dynamics of Issuance Fee and Redemption Fee", (
+        Trace("issuance_fee", "Issuance Fee"), Trace("redemption_fee", "Redemption Fee", secondary_y=True)),
+        yaxes=(("Issuance Fee", _LEFT), ("Redemption Fee", _RIGHT))),
+    "POLLEN": Figure("Dynamics of the Price and Market Cap of POLLEN", (
+        Trace("price_POLLEN", "POLLEN Price"), Trace("MC_POLLEN", "POLLEN Market Cap", secondary_y=True)),
+        yaxes=(("POLLEN Price", _LEFT), ("POLLEN Market Cap", _RIGHT))),
+}
+
+_TROVE_COLUMNS = ("iBGT_Quantity", "CR_initial", "Supply", "Rational_inattention", "CR_current")
+
+
+# Final trove book of run `run`: a histogram per column, and the columns by row.
+def trove_figures(run="baseline"):
+    figures = {f"histogram {c}": Figure("Distribution of " + c, (Trace(c, c, run),), kind="histogram", xaxis=c, troves=True)
+               for c in _TROVE_COLUMNS}
+    figures.update({f"rows {c}": Figure(c + " by trove", (Trace(c, c, run),), x="row", xaxis="Trove", troves=True)
+                    for c in ("iBGT_Quantity", "CR_initial", "Supply", "CR_current")})
+    return figures
+
+
+TROVE_FIGURES = trove_figures()
+
+
+def _new(trace):
+    return Trace(trace.column, trace.name + " New", "base rate", trace.secondary_y, trace.row, trace.col,
+                 trace.mode, trace.dash or ("dot" if trace.mode is None else None), trace.scale, trace.value)
+
+
+# Baseline against the base-rate policy ("baseline" and "base rate" runs); the policy's
+# traces are dotted.
+COMPARISON = {
+    "prices": Figure("Price Dynamics of NECT and iBGT", (
+        Trace("Price_NECT", "NECT Price"), Trace("Price_iBGT", "iBGT Price", secondary_y=True),
+        _new(Trace("Price_NECT", "NECT Price"))),
+        yaxes=(("NECT Price", _LEFT), ("iBGT Price", _RIGHT))),
+    "troves": Figure("Dynamics of Trove Numbers and NECT Supply", (
+        Trace("n_troves", "Number of Troves"), Trace("supply_NECT", "NECT Supply", secondary_y=True),
+        _new(Trace("n_troves", "Number of Troves")), _new(Trace("supply_NECT", "NECT Supply", secondary_y=True))),
+        yaxes=(("Number of Troves", _LEFT), ("NECT Supply", _RIGHT))),
+    "open_close": Figure("Dynamics of Number of Troves Opened and Closed", (
+        Trace("n_open", "Number of Troves Opened", mode="markers"),
+        Trace("n_close", "Number of Troves Closed", row=2, mode="markers"),
+        _new(Trace("n_open", "Number of Troves Opened", col=2, mode="markers")),
+        _new(Trace("n_close", "Number of Troves Closed", row=2, col=2, mode="markers"))), rows=2, cols=2,
+        yaxes=(("Troves Opened", {"row": 1, "col": 1}), ("Troves Closed", {"row": 2, "col": 1}))),
+    "liquidations": Figure("Dynamics of Number of Liquidated and Redempted Troves", (
+        Trace("n_liquidate", "Number of Liquidated Troves"), Trace("n_redempt", "Number of Redempted Troves", row=2),
+        _new(Trace("n_liquidate", "Number of Liquidated Troves")),
+        _new(Trace("n_redempt", "Number of Redempted Troves", row=2))), rows=2,
+        yaxes=(("Troves Liquidated", {"row": 1, "col": 1}), ("Troves Redempted", {"row": 2, "col": 1}))),
+    "pools": Figure("Dynamics of Liquidity, Stability, Redemption Pools and Return of Stability Pool", (
+        Trace("liquidity", "Liquidity Pool"), Trace("stability", "Stability Pool"),
+        Trace("redemption_pool", "100*Redemption Pool", scale=100),
+        _new(Trace("liquidity", "Liquidity Pool")), _new(Trace("stability", "Stability Pool")),
+        _new(Trace("redemption_pool", "100*Redemption Pool", scale=100))),
+        yaxes=(("Size of Pools", _LEFT),)),
+    "return": Figure("Dynamics of Liquidity, Stability, Redemption Pools and Return of Stability Pool", (
+        Trace("return_stability", "Return of Stability Pool"), _new(Trace("return_stability", "Return of Stability Pool"))),
+        yaxes=(("Return", _LEFT),)),
+    "gains": Figure("Dynamics of Airdrop and Liquidation Gain", (
+        Trace("airdrop_gain", "Airdrop Gain"), Trace("liquidation_gain", "Liquidation Gain", secondary_y=True),
+        _new(Trace("airdrop_gain", "Airdrop Gain")), _new(Trace("liquidation_gain", "Liquidation Gain", secondary_y=True))),
+        yaxes=(("Airdrop Gain", _LEFT), ("Liquidation Gain", _RIGHT))),
+    "fees": Figure("Dynamics of Issuance Fee and Redemption Fee", (
+        Trace("issuance_fee", "Issuance Fee"), Trace("redemption_fee", "Redemption Fee", row=2),
+        _new(Trace("issuance_fee", "Issuance Fee")), _new(Trace("redemption_fee", "Redemption Fee", row=2))), rows=2,
+        yaxes=(("Issuance Fee", {"secondary_y": False, "row": 1, "col": 1}),
+               ("Redemption Fee", {"secondary_y": False, "row": 2, "col": 1}))),
+    "earning": Figure("Dynamics of Annualized Earning", (
+        Trace("annualized_earning", "Annualized Earning"), _new(Trace("annualized_earning", "Annualized Earning"))),
+        yaxes=(("Annualized Earning", _LEFT),)),
+    "POLLEN": Figure("Dynamics of the Price and Market Cap of POLLEN", (
+        Trace("price_POLLEN", "POLLEN Price"), Trace("MC_POLLEN", "POLLEN Market Cap", secondary_y=True),
+        _new(Trace("price_POLLEN", "POLLEN Price")), _new(Trace("MC_POLLEN", "POLLEN Market Cap", secondary_y=True))),
+        yaxes=(("POLLEN Price", _LEFT), ("POLLEN Market Cap", _RIGHT))),
+    #the baseline's fixed rates against the policy's base rate
+    "base_rate": Figure("Dynamics of Issuance Fee and Redemption Fee", (
+        Trace("base_rate", "Base Rate", value=0.01), Trace("base_rate", "Base Rate New", "base rate")),
+        yaxes=(("Issuance Fee", _LEFT), ("Redemption Fee", _RIGHT))),
+}
+
+
+# {run name: DataFrame} out of `results`: such a dict, a policy_table() indexed by
+# (policy, step), or {run name: path} of result_sink output, of which only `columns`
+# ({run name: column names}) are read.
+def load_runs(results, columns=None):
+    if isinstance(results, pd.DataFrame):
+        return {name: frame.droplevel(0) for name, frame in results.groupby(level=0, sort=False)}
+    runs = {}
+    for name, result in results.items():
+        if isinstance(result, (str, os.PathLike)):
+            wanted = None if columns is None else sorted(columns.get(name, ())) or None
+            result = read_columns(result, wanted)
+        elif not isinstance(result, pd.DataFrame):
+            result = result.to_frame()
+        runs[name] = result
+    return runs
+
+
+# Plain data of a figure, its traces downsampled to `points`: what a worker needs to
+# build it, without the full series.
+def _payload(figure, runs, points):
+    traces = []
+    for trace in figure.traces:
+        frame = runs[trace.run]
+        if figure.kind == "histogram":
+            traces.append((trace, None, np.asarray(frame[trace.column], dtype=float)))
+            continue
+        x = np.arange(len(frame), dtype=float) if figure.x == "row" else np.asarray(frame.index, dtype=float) / MONTH
+        y = np.full(len(frame), float(trace.value)) if trace.value is not None else np.asarray(frame[trace.column], dtype=float)
+        traces.append((trace,) + downsample(x, trace.scale * y, points))
+    return figure, traces
+
+
+def _build(payload):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    figure, traces = payload
+    if figure.kind == "histogram":
+        fig = go.Figure([go.Histogram(x=values, name=trace.name, nbinsx=figure.nbins) for trace, _, values in traces])
+        fig.update_layout(title_text=figure.title)
+        fig.update_xaxes(title_text=figure.xaxis)
+        return fig
+    if figure.secondary_y:
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
+    else:
+        fig = make_subplots(rows=figure.rows, cols=figure.cols)
+    for trace, x, y in traces:
+        scatter = go.Scatter(x=x, y=y, name=trace.name, mode=trace.mode, line=dict(dash=trace.dash) if trace.dash else None)
+        if figure.secondary_y:
+            fig.add_trace(scatter, secondary_y=trace.secondary_y)
+        else:
+            fig.add_trace(scatter, row=trace.row, col=trace.col)
+    fig.update_layout(title_text=figure.title)
+    if figure.x == "month":
+        fig.update_xaxes(tick0=0, dtick=1, title_text=figure.xaxis)
+    else:
+        fig.update_xaxes(title_text=figure.xaxis)
+    for title, where in figure.yaxes:
+        fig.update_yaxes(title_text=title, **where)
+    return fig
+
+
+# The plotly figure `figure` of `runs`, its line traces downsampled to `points`. Trove
+# figures read `troves` ({run name: trove DataFrame or TroveBook}) instead.
+def build(figure, runs, troves=None, points=POINTS):
+    runs, troves = _prepare({"": figure}, runs, troves)
+    return _build(_payload(figure, troves if figure.troves else runs, points))
+
+
+def _wanted(figures):
+    wanted = {}
+    for figure in figures.values():
+        for run, column in figure.columns():
+            wanted.setdefault(run, set()).add(column)
+    return wanted
+
+
+# The runs and trove books `figures` read, loading only the columns they use.
+def _prepare(figures, runs, troves):
+    if troves is None and any(f.troves for f in figures.values()):
+        raise ValueError("trove figures need the trove books (troves=...)")
+    wanted = _wanted(figures)
+    return (None if runs is None else load_runs(runs, wanted)), (None if troves is None else load_runs(troves, wanted))
+
+
+# Build and show the figures of `figures` ({key: Figure}) one at a time; `only` limits
+# them to some keys.
+def show(figures, runs, troves=None, points=POINTS, only=None):
+    figures = {k: f for k, f in figures.items() if only is None or k in only}
+    runs, troves = _prepare(figures, runs, troves)
+    for figure in figures.values():
+        _build(_payload(figure, troves if figure.troves else runs, points)).show()
+
+
+def _write(payload, path, format, plotlyjs):
+    fig = _build(payload)
+    if format == "html":
+        fig.write_html(path, include_plotlyjs=plotlyjs)
+    else:
+        fig.write_image(path, format=format)
+    return path
+
+
+# Write the figures of `figures` to `directory`, one <key>.<format> file each, built over
+# a process pool (workers=1 builds them in this process). Only the downsampled traces
+# are sent to the workers. html files load plotly.js from a CDN by default
+# (plotlyjs=True embeds it). Returns {key: path}.
+def render(figures, runs, directory, troves=None, format="html", points=POINTS, workers=None, plotlyjs="cdn"):
+    runs, troves = _prepare(figures, runs, troves)
+    os.makedirs(directory, exist_ok=True)
+    jobs = {key: (_payload(figure, troves if figure.troves else runs, points),
+                  os.path.join(directory, f"{key.replace(' ', '_')}.{format}"))
+            for key, figure in figures.items()}
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1:
+        return {key: _write(payload, path, format, plotlyjs) for key, (payload, path) in jobs.items()}
+    paths = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_write, payload, path, format, plotlyjs): key for key, (payload, path) in jobs.items()}
+        for future in as_completed(futures):
+            paths[futures[future]] = future.result()
+    return {key: paths[key] for key in jobs}
@@ -0,0 +1,125 @@
+import numpy as np
+
+from rolling import RollingSum
+
+# Fixed-capacity per-step result recorder.
+# One preallocated typed array per column; recording a step and reading the previous
+# step are O(1), so the per-step cost does not grow with the length of the run.
+# The DataFrame is only built once, by to_frame(), when the run is over.
+# Columns can be tracked with rolling window sums that are updated on every record.
+# With `lanes` each step records a vector per column (one entry per lane, e.g. per path
+# of a lockstep simulation) and the columns are (steps x lanes) arrays.
+# With a `sink` (result_sink.ColumnSink) every recorded step streams out to it and only
+# the last one stays in memory, for previous() and the window sums, so memory does not
+# grow with the run; to_frame() reads the columns back from the sink.
+class ResultBuffer:
+    # `dtypes` overrides the default float64 for selected columns.
+    def __init__(self, columns, capacity, dtypes=None, lanes=None, sink=None):
+        dtypes = dtypes or {}
+        if sink is not None and lanes is not None:
+            raise ValueError("a result sink takes single-path columns")
+        self.columns = tuple(columns)
+        self.lanes = lanes
+        self.sink = sink
+        self._capacity = capacity
+        rows = capacity if sink is None else 1
+        shape = rows if lanes is None else (rows, lanes)
+        self._size = 0
+        self._data = {c: np.zeros(shape, dtype=dtypes.get(c, float)) for c in self.columns}
+        self._windows = []
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    # Recorded values of a column (a view, no copy); with a sink, only the last step.
+    def __getitem__(self, column):
+        if self.sink is not None:
+            return self._data[column][:min(self._size, 1)]
+        return self._data[column][:self._size]
+
+    def record(self, row):
+        i = self._size
+        if i >= self.capacity:
+            raise IndexError(f"result buffer is full ({self.capacity} steps)")
+        data = self._data
+        slot = i
+        if self.sink is not None:
+            slot = 0
+            for c in self.columns:
+                data[c][0] = 0
+        for c, value in row.items():
+            data[c][slot] = value
+        for c, window in self._windows:
+            window.push(data[c][slot])
+        if self.sink is not None:
+            self.sink.record({c: data[c][0] for c in self.columns})
+        self._size = i + 1
+        return i
+
+    # Add a column after steps were recorded: NaN for the earlier steps except the last
+    # one, which gets `last` (e.g. the initial value of a policy switched on mid-run).
+    def add_column(self, column, last=np.nan, dtype=float):
+        if column in self._data:
+            raise KeyError(f"{column} is already recorded")
+        if self.sink is not None:
+            raise ValueError("the columns of a result sink are fixed once it has records")
+        shape = self.capacity if self.lanes is None else (self.capacity, self.lanes)
+        values = np.full(shape, np.nan, dtype=dtype)
+        if self._size:
+            values[self._size - 1] = last
+        self._data[column] = values
+        self.columns += (column,)
+
+    # Keep a running sum of `column` over its last `window` recorded steps.
+    def track(self, column, window, inclusive=False, compensated=True):
+        if self.sink is not None and self._size:
+            raise ValueError("windows on a result sink are tracked before the first record")
+        rolling = RollingSum(window, inclusive, compensated, self.lanes)
+        for value in self[column]:
+            rolling.push(value)
+        self._windows.append((column, rolling))
+        return rolling
+
+    # Sum of `column` over the last `window` recorded steps, from its tracker.
+    def window_sum(self, column, window):
+        for c, rolling in self._windows:
+            if c == column and rolling.window == window:
+                return rolling.total()
+        raise KeyError(f"{column} is not tracked over a window of {window}")
+
+    # Value of `column` at the most recently recorded step.
+    def previous(self, column):
+        return self._data[column][0 if self.sink is not None else self._size - 1]
+
+    # A copy of the recorded steps and window sums, for checkpoints; from_state() builds
+    # an equal buffer that carries on from the same step.
+    def state(self):
+        if self.sink is not None:
+            raise ValueError("a result buffer streaming to a sink cannot be checkpointed")
+        return {"columns": list(self.columns), "capacity": self.capacity, "lanes": self.lanes,
+                "dtypes": {c: self._data[c].dtype.str for c in self.columns},
+                "data": {c: self[c].copy() for c in self.columns},
+                "windows": [(c, rolling.state()) for c, rolling in self._windows]}
+
+    @classmethod
+    def from_state(cls, state):
+        buffer = cls(state["columns"], state["capacity"], {c: np.dtype(d) for c, d in state["dtypes"].items()}, state["lanes"])
+        size = None
+        for c, values in state["data"].items():
+            size = len(values)
+            buffer._data[c][:size] = values
+        buffer._size = size or 0
+        buffer._windows = [(c, RollingSum.from_state(rolling)) for c, rolling in state["windows"]]
+        return buffer
+
+    #pandas is imported here, not at the top, to keep the core quick to import in workers
+    def to_frame(self):
+        import pandas as pd
+
+        if self.sink is not None:
+            return self.sink.read(self.columns)
+        return pd.DataFrame({c: self[c].copy() for c in self.columns})
@@ -0,0 +1,174 @@
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+# Streaming columnar sink for per-step results.
+# Steps are buffered in typed column chunks and written out whenever a chunk holds `rows`
+# steps, or `nbytes` bytes if that comes first, so memory stays bounded however long the
+# run is. The formats:
+# - "npy": a directory with one .npy file per column, appended chunk by chunk. The header
+#   is rewritten on every flush, so each file is a valid array of every step flushed so
+#   far, and a single column loads (or memory-maps) without touching the others.
+# - "parquet" / "arrow": one file with a row group / record batch per chunk; these need
+#   pyarrow.
+# read_columns() reads any of them back, optionally only some of the columns.
+
+FORMATS = ("npy", "parquet", "arrow")
+
+#bytes of a .npy header, fixed so it can be rewritten in place as the column grows
+_NPY_HEADER = 128
+
+
+def _npy_header(dtype, length):
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (length,)})
+    header = header.ljust(_NPY_HEADER - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError("the parquet and arrow formats need pyarrow; format='npy' works without it") from error
+    return pyarrow
+
+
+# Format of `path`: the one given, or by extension (.parquet, .arrow/.feather), else npy.
+def _format(path, format=None):
+    if format is not None:
+        if format not in FORMATS:
+            raise ValueError(f"unknown format {format!r}, expected one of {FORMATS}")
+        return format
+    extension = os.path.splitext(str(path))[1]
+    return {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}.get(extension, "npy")
+
+
+# Columns of a run streamed to `path`. `columns` fixes the columns and their order; by
+# default they are taken from the first recorded row. `dtypes` overrides float64 for
+# selected columns. Use as a context manager, or call close() when the run is over.
+class ColumnSink:
+    def __init__(self, path, columns=None, dtypes=None, format=None, rows=65536, nbytes=None):
+        self.path = str(path)
+        self.format = _format(self.path, format)
+        self.rows = rows
+        self.nbytes = nbytes
+        self.columns = None
+        self._dtypes = dict(dtypes or {})
+        self._written = 0
+        self._size = 0
+        self._files = {}
+        self._writer = None
+        self._closed = False
+        if self.format != "npy":
+            _pyarrow()
+        if columns is not None:
+            self._open(columns)
+
+    # Steps recorded so far, written out or buffered.
+    def __len__(self):
+        return self._written + self._size
+
+    def _open(self, columns):
+        self.columns = tuple(columns)
+        self._dtypes = {c: np.dtype(self._dtypes.get(c, float)) for c in self.columns}
+        chunk = self.rows
+        if self.nbytes is not None:
+            row_bytes = sum(d.itemsize for d in self._dtypes.values())
+            chunk = min(chunk, max(1, self.nbytes // max(1, row_bytes)))
+        self._chunk = {c: np.zeros(chunk, dtype=d) for c, d in self._dtypes.items()}
+        if self.format == "npy":
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, "columns.txt"), "w") as f:
+                f.write("\n".join(self.columns) + "\n")
+            for c in self.columns:
+                f = open(os.path.join(self.path, f"{c}.npy"), "w+b")
+                f.write(_npy_header(self._dtypes[c], 0))
+                self._files[c] = f
+
+    def record(self, row):
+        if self.columns is None:
+            self._open(row)
+        i = self._size
+        chunk = self._chunk
+        for c in self.columns:
+            chunk[c][i] = row[c]
+        self._size = i + 1
+        if self._size == len(chunk[self.columns[0]]):
+            self.flush()
+
+    # Write the buffered steps out.
+    def flush(self):
+        n = self._size
+        if n == 0 or self.columns is None:
+            return
+        if self.format == "npy":
+            for c, f in self._files.items():
+                f.seek(0, os.SEEK_END)
+                f.write(self._chunk[c][:n].tobytes())
+                f.seek(0)
+                f.write(_npy_header(self._dtypes[c], self._written + n))
+                f.flush()
+        else:
+            self._write_table({c: self._chunk[c][:n].copy() for c in self.columns})
+        self._written += n
+        self._size = 0
+
+    def _write_table(self, chunk):
+        pa = _pyarrow()
+        table = pa.table(chunk)
+        if self._writer is None:
+            if self.format == "parquet":
+                self._writer = pa.parquet.ParquetWriter(self.path, table.schema)
+            else:
+                self._writer = pa.ipc.new_file(self.path, table.schema)
+        self._writer.write_table(table)
+
+    # Flush and close the files; closing again does nothing.
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        if self.format != "npy" and self._writer is None and self.columns is not None:
+            #no steps recorded: still leave a file with the schema behind
+            self._write_table({c: self._chunk[c][:0] for c in self.columns})
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    # The steps recorded so far as a DataFrame (flushes first).
+    def read(self, columns=None):
+        self.flush()
+        return read_columns(self.path, columns, self.format)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Columns written by a ColumnSink as a DataFrame; `columns` selects some of them, and only
+# those are read.
+def read_columns(path, columns=None, format=None):
+    path = str(path)
+    format = _format(path, format)
+    if format == "npy":
+        if columns is None:
+            with open(os.path.join(path, "columns.txt")) as f:
+                columns = [line for line in f.read().split("\n") if line]
+        return pd.DataFrame({c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r") for c in columns})
+    pa = _pyarrow()
+    if format == "parquet":
+        return pa.parquet.read_table(path, columns=None if columns is None else list(columns)).to_pandas()
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    if columns is not None:
+        table = table.select(list(columns))
+    return table.to_pandas()
@@ -0,0 +1,214 @@
+import random
+import zlib
+
+import numpy as np
+
+# Seed formulas used by the original simulators before every draw, per phase.
+# Each entry is (engine, seed(step, agent)): "random" is Python's `random` module,
+# "numpy" the legacy `np.random` global state. Legacy streams replay these exactly.
+LEGACY_SEEDS = {
+    "ibgt_price": ("random", lambda step, agent: 2019375 + 10000*step),
+    "natural_rate": ("random", lambda step, agent: 201597 + 10*step),
+    "POLLEN_price": ("random", lambda step, agent: 2 + 13*step),
+    "liquidate_troves": ("numpy", lambda step, agent: 2 + step),
+    "close_troves": ("numpy", lambda step, agent: 208 + step),
+    "close_troves_sample": ("random", lambda step, agent: 293 + 100*step),
+    "adjust_troves": ("random", lambda step, agent: 57984 - 3*step),
+    "adjust_troves_trove": ("random", lambda step, agent: 187*step + 3*agent),
+    "open_troves": ("random", lambda step, agent: 2019*step),
+    "open_troves_CR": ("numpy", lambda step, agent: 2033 + step + agent*agent),
+    "open_troves_quantity": ("numpy", lambda step, agent: 20 + 10*agent + step),
+    "open_troves_inattention": ("numpy", lambda step, agent: 209870 - step + agent*agent),
+    "stability_update": ("numpy", lambda step, agent: 27 + 3*step),
+    "liquidity": ("numpy", lambda step, agent: 20*step),
+    "redemption": ("numpy", lambda step, agent: 30*step),
+    "POLLEN_market": ("numpy", lambda step, agent: 2 + 3*step),
+}
+
+# Python's `random` behind the same method names as numpy's generators.
+class _PythonEngine:
+    def __init__(self):
+        self._random = random.Random()
+
+    def seed(self, seed):
+        self._random.seed(seed)
+
+    def normal(self, loc=0.0, scale=1.0):
+        return self._random.normalvariate(loc, scale)
+
+    def uniform(self, low=0.0, high=1.0):
+        return self._random.uniform(low, high)
+
+    def gamma(self, shape, scale=1.0):
+        return self._random.gammavariate(shape, scale)
+
+    def chisquare(self, df):
+        return self._random.gammavariate(df/2, 2.0)
+
+    def sample(self, n, k):
+        return self._random.sample(range(n), k)
+
+
+class _NumpyEngine:
+    def __init__(self, generator):
+        self._generator = generator
+
+    def seed(self, seed):
+        self._generator.seed(seed)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        return self._generator.normal(loc, scale, size)
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        return self._generator.uniform(low, high, size)
+
+    def gamma(self, shape, scale=1.0, size=None):
+        return self._generator.gamma(shape, scale, size)
+
+    def chisquare(self, df, size=None):
+        return self._generator.chisquare(df, size)
+
+    def sample(self, n, k):
+        return [int(i) for i in self._generator.choice(n, size=k, replace=False)]
+
+
+# Draws of a keyed stream at some positions (ascending) of its vector only. A uniform
+# draw takes one 64-bit Philox output, four to a counter block, so the draw at
+# position i is read off block i//4 directly when there are few positions far apart;
+# otherwise, and for the other distributions, the vector is drawn up to the last
+# position and picked from.
+class _PickedEngine:
+    #cost of reading one position off its block, in draws of the vector
+    jump_cost = 256
+
+    def __init__(self, key, counter, rows):
+        self._key = key
+        self._counter = counter
+        self._rows = np.asarray(rows, dtype=np.int64)
+
+    def _prefix(self, method, *args):
+        size = int(self._rows[-1]) + 1 if len(self._rows) else 0
+        generator = np.random.Generator(np.random.Philox(key=self._key, counter=self._counter))
+        return getattr(generator, method)(*args, size=size)[self._rows]
+
+    def uniform(self, low=0.0, high=1.0):
+        rows = self._rows
+        if len(rows) == 0 or len(rows) * self.jump_cost >= rows[-1]:
+            return self._prefix("uniform", low, high)
+        draws = np.empty(len(rows))
+        for k, i in enumerate(rows.tolist()):
+            raw = np.random.Philox(key=self._key, counter=self._counter + i // 4).random_raw(i % 4 + 1)[-1]
+            #numpy's uniform: low + (high - low) * (53 high bits of the output) / 2**53
+            draws[k] = (int(raw) >> 11) * 2.0**-53
+        return low + (high - low) * draws
+
+    def normal(self, loc=0.0, scale=1.0):
+        return self._prefix("normal", loc, scale)
+
+    def gamma(self, shape, scale=1.0):
+        return self._prefix("gamma", shape, scale)
+
+    def chisquare(self, df):
+        return self._prefix("chisquare", df)
+
+
+# Draws for one (phase, step) key. With `size` every call returns a vector, one
+# entry per agent (or per step for exogenous paths). With `seeds` the engine is
+# reseeded before each entry, which is how the legacy code drew vectors.
+class Stream:
+    def __init__(self, engine, size=None, seeds=None):
+        self._engine = engine
+        self._size = size
+        self._seeds = seeds
+
+    def _draw(self, method, *args):
+        if self._seeds is not None:
+            draws = np.empty(len(self._seeds))
+            for i, seed in enumerate(self._seeds):
+                self._engine.seed(seed)
+                draws[i] = getattr(self._engine, method)(*args)
+            return draws
+        if self._size is None:
+            return getattr(self._engine, method)(*args)
+        return getattr(self._engine, method)(*args, size=self._size)
+
+    def normal(self, loc=0.0, scale=1.0):
+        return self._draw("normal", loc, scale)
+
+    def uniform(self, low=0.0, high=1.0):
+        return self._draw("uniform", low, high)
+
+    def gamma(self, shape, scale=1.0):
+        return self._draw("gamma", shape, scale)
+
+    def chisquare(self, df):
+        return self._draw("chisquare", df)
+
+    # k distinct indices out of range(n)
+    def sample(self, n, k):
+        if self._size is not None or self._seeds is not None:
+            raise ValueError("sample() is only available on scalar streams")
+        return self._engine.sample(n, k)
+
+
+# Keyed random streams for the simulators.
+#
+# Every draw is addressed by (run, phase, step, agent) instead of by reseeding a
+# global generator: each (seed, run, phase) pair gets its own Philox key and the
+# step selects a disjoint block of the counter, so streams are independent of
+# each other and of call order, and a whole phase draws its vector in one call.
+# With legacy=True the streams replay the seed formulas in LEGACY_SEEDS instead,
+# reproducing the sequences of the reseeding code bit for bit.
+class RandomStreams:
+    def __init__(self, seed=0, run=0, legacy=False):
+        self.seed = seed
+        self.run = run
+        self.legacy = legacy
+        self._keys = {}
+
+    def _key(self, phase):
+        key = self._keys.get(phase)
+        if key is None:
+            words = np.random.SeedSequence(self.seed, spawn_key=(self.run, zlib.crc32(phase.encode()))).generate_state(2, np.uint64)
+            key = int(words[0]) << 64 | int(words[1])
+            self._keys[phase] = key
+        return key
+
+    def _generator(self, phase, step):
+        return np.random.Generator(np.random.Philox(key=self._key(phase), counter=step << 128))
+
+    def _legacy_engine(self, phase):
+        engine, _ = LEGACY_SEEDS[phase]
+        if engine == "random":
+            return _PythonEngine()
+        return _NumpyEngine(np.random.RandomState())
+
+    # Scalar draws for one phase at one step; successive calls continue the stream.
+    def stream(self, phase, step):
+        if self.legacy:
+            engine = self._legacy_engine(phase)
+            engine.seed(LEGACY_SEEDS[phase][1](step, 0))
+            return Stream(engine)
+        return Stream(_NumpyEngine(self._generator(phase, step)))
+
+    # One draw per agent 0..n-1 for a phase at one step. With `rows` (ascending agent
+    # numbers) only the draws of those agents, the same values they get in the full
+    # vector, at a cost that follows len(rows) rather than n where it can.
+    def agents(self, phase, step, n, rows=None):
+        if self.legacy:
+            seed = LEGACY_SEEDS[phase][1]
+            return Stream(self._legacy_engine(phase), seeds=[seed(step, int(i)) for i in (range(n) if rows is None else rows)])
+        if rows is not None:
+            return Stream(_PickedEngine(self._key(phase), step << 128, rows))
+        return Stream(_NumpyEngine(self._generator(phase, step)), size=n)
+
+    # One draw per step in [start, stop) for an exogenous path; with `lanes`, a
+    # (steps x lanes) block of draws for that many independent paths.
+    def path(self, phase, start, stop, lanes=None):
+        if self.legacy:
+            if lanes is not None:
+                raise ValueError("legacy streams draw a single path")
+            seed = LEGACY_SEEDS[phase][1]
+            return Stream(self._legacy_engine(phase), seeds=[seed(t, 0) for t in range(start, stop)])
+        size = max(0, stop - start)
+        return Stream(_NumpyEngine(self._generator(phase, start)), size=size if lanes is None else (size, lanes))
@@ -0,0 +1,100 @@
+import numpy as np
+
+# O(1) running sum over the last `window` values pushed.
+#
+# The values sit in a ring buffer; each push adds the new value and subtracts the one
+# falling out of the window, instead of re-summing the window every step.
+#
+# Window edges:
+# - inclusive=False keeps `window` values, i.e. `values[t - window:t]` once the value for
+#   step t-1 has been pushed (list-slice semantics, as in tests/simulation_helpers.py).
+# - inclusive=True keeps `window + 1` values, i.e. `data.loc[t - window:t]` once the value
+#   for step t itself has been pushed (pandas label slicing includes both ends).
+# Before the window has filled up the sum covers everything pushed so far, as slicing does.
+#
+# compensated=True carries a Neumaier correction term through every add and subtract,
+# so the running sum does not drift away from the exact window sum over long runs.
+#
+# With `lanes` every push is a vector of that length and the sums are kept per lane,
+# e.g. one per path of a lockstep simulation.
+class RollingSum:
+    def __init__(self, window, inclusive=False, compensated=False, lanes=None):
+        self.window = window
+        self.inclusive = inclusive
+        self.compensated = compensated
+        self.lanes = lanes
+        size = window + 1 if inclusive else window
+        if lanes is None:
+            self._values = [0.0] * size
+            self._sum = 0.0
+            self._compensation = 0.0
+        else:
+            self._values = np.zeros((size, lanes))
+            self._sum = np.zeros(lanes)
+            self._compensation = np.zeros(lanes)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _add(self, x):
+        if not self.compensated:
+            self._sum += x
+            return
+        s = self._sum
+        t = s + x
+        if self.lanes is not None:
+            self._compensation += np.where(np.abs(s) >= np.abs(x), (s - t) + x, (x - t) + s)
+        elif abs(s) >= abs(x):
+            self._compensation += (s - t) + x
+        else:
+            self._compensation += (x - t) + s
+        self._sum = t
+
+    def push(self, value):
+        value = float(value) if self.lanes is None else np.array(value, dtype=float)
+        values = self._values
+        size = len(values)
+        if size == 0:
+            return
+        if self._count == size:
+            self._add(-values[self._next])
+        else:
+            self._count += 1
+        values[self._next] = value
+        self._add(value)
+        self._next = (self._next + 1) % size
+
+    def total(self):
+        return self._sum + self._compensation
+
+    # Everything needed to carry on pushing: the settings, the ring buffer and the sums.
+    def state(self):
+        return {"window": self.window, "inclusive": self.inclusive, "compensated": self.compensated,
+                "lanes": self.lanes, "next": self._next, "count": self._count,
+                "values": np.array(self._values, dtype=float), "sum": np.array(self._sum, dtype=float),
+                "compensation": np.array(self._compensation, dtype=float)}
+
+    @classmethod
+    def from_state(cls, state):
+        rolling = cls(state["window"], state["inclusive"], state["compensated"], state["lanes"])
+        if rolling.lanes is None:
+            rolling._values = [float(v) for v in state["values"]]
+            rolling._sum = float(state["sum"])
+            rolling._compensation = float(state["compensation"])
+        else:
+            rolling._values = np.array(state["values"], dtype=float)
+            rolling._sum = np.array(state["sum"], dtype=float)
+            rolling._compensation = np.array(state["compensation"], dtype=float)
+        rolling._next = state["next"]
+        rolling._count = state["count"]
+        return rolling
+
+    # Re-sum the buffered values, dropping accumulated rounding error.
+    def resync(self):
+        self._sum = 0.0 if self.lanes is None else np.zeros(self.lanes)
+        self._compensation = 0.0 if self.lanes is None else np.zeros(self.lanes)
+        for i in range(self._count):
+            self._add(self._values[(self._next - self._count + i) % len(self._values)])
+        return self.total()
@@ -0,0 +1,594 @@
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+from exogenous import load_paths
+from kernels import load as load_kernels
+from result_buffer import ResultBuffer
+from rng_streams import RandomStreams
+from trove_book import TroveBook
+
+# Importable core of the macro model.
+# macro_model.py used to hold the parameters, the exogenous paths, the step functions and
+# the driver loop as module-level code, so one execution was one path. Here the parameters
+# are a ModelParams value and everything a path needs lives on a MacroModel, so any number
+# of independent (params, seed) runs can be made in one process or spread over several.
+
+
+@dataclass
+class ModelParams:
+    #policy functions
+    rate_issuance: float = 0.01
+    rate_redemption: float = 0.01
+    base_rate_initial: float = 0
+
+    #global variables
+    period: int = 24*365
+    month: int = 24*30
+    day: int = 24
+
+    #ibgt price
+    price_ibgt_initial: float = 1000
+    sd_ibgt: float = 0.02
+    drift_ibgt: float = 0
+    #(stop, drift, sd) stages of the iBGT price; None is one stage of drift_ibgt, sd_ibgt
+    ibgt_regimes: tuple = None
+
+    #POLLEN price & airdrop
+    price_POLLEN_initial: float = 1
+    sd_POLLEN: float = 0.005
+    drift_POLLEN: float = 0.0035
+    #reduced for now. otherwise the initial return too high
+    quantity_POLLEN_airdrop: float = 500
+    POLLEN_total_supply: float = 100000000
+
+    #PE ratio
+    PE_ratio: float = 50
+
+    #natural rate
+    natural_rate_initial: float = 0.2
+    sd_natural_rate: float = 0.002
+
+    #stability pool
+    initial_return: float = 0.2
+    sd_return: float = 0.001
+    sd_stability: float = 0.001
+    drift_stability: float = 1.002
+    theta: float = 0.001
+
+    #liquidity pool & redemption pool
+    sd_liquidity: float = 0.001
+    sd_redemption: float = 0.001
+    drift_liquidity: float = 1.0003
+    redemption_star: float = 0.8
+    delta: float = -20
+
+    #close troves
+    sd_closetroves: float = 0.5
+    #sensitivity to NECT price
+    beta: float = 0.2
+
+    #open troves
+    distribution_parameter1_ibgt_quantity: float = 10
+    distribution_parameter2_ibgt_quantity: float = 500
+    distribution_parameter1_CR: float = 1.1
+    distribution_parameter2_CR: float = 0.1
+    distribution_parameter3_CR: float = 16
+    distribution_parameter1_inattention: float = 4
+    distribution_parameter2_inattention: float = 0.08
+    sd_opentroves: float = 0.5
+    n_steady: float = 0.5
+    initial_open: int = 10
+
+    #sensitivity to NECT price & issuance fee
+    alpha: float = 0.3
+
+    #number of runs in simulation
+    n_sim: int = 8640
+
+
+# Methods of MacroModel timed as phases when a run is profiled.
+PHASES = ("step", "liquidate_troves", "close_troves", "adjust_troves", "open_troves", "stability_update",
+          "price_stabilizer", "POLLEN_market", "checkpoint")
+
+
+# Raised by MacroModel.run() when a run goes past its deadline.
+class RunTimeout(TimeoutError):
+    pass
+
+
+# State of a MacroModel run between two steps: the parameters and stream coordinates,
+# the fee rates, the trove book, the result buffer with its window sums, and the tails of
+# the exogenous series from step `index` - 1 on (the POLLEN price of the first month is
+# read one step behind). The keyed streams are addressed by (seed, run, phase, step), so
+# their positions are fixed by `index` and need no state of their own. A run resumed
+# from a checkpoint records the same values, bit for bit, as one that never stopped.
+#
+# save() writes one compressed .npz: the arrays, plus a JSON header with the rest.
+class Checkpoint:
+    def __init__(self, params, seed, run, legacy, index, finished, rates, price_ibgt_current, paths, data, troves):
+        self.params = params
+        self.seed = seed
+        self.run = run
+        self.legacy = legacy
+        #next step to run
+        self.index = index
+        #the run stopped, or went through n_sim steps
+        self.finished = finished
+        self.rates = rates
+        self.price_ibgt_current = price_ibgt_current
+        self.paths = paths
+        self.data = data
+        self.troves = troves
+
+    # Step of the first entry of the exogenous tails.
+    @property
+    def offset(self):
+        return max(0, self.index - 1)
+
+    def save(self, path):
+        arrays = {f"paths/{name}": tail for name, tail in self.paths.items()}
+        arrays.update({f"troves/{c}": values for c, values in self.troves.items()})
+        data = dict(self.data)
+        arrays.update({f"data/{c}": values for c, values in data.pop("data").items()})
+        windows = []
+        for k, (column, rolling) in enumerate(data.pop("windows")):
+            rolling = dict(rolling)
+            for field in ("values", "sum", "compensation"):
+                arrays[f"windows/{k}/{field}"] = rolling.pop(field)
+            windows.append((column, rolling))
+        header = {"params": asdict(self.params), "seed": self.seed, "run": self.run, "legacy": self.legacy,
+                  "index": self.index, "finished": self.finished, "rates": [float(r) for r in self.rates],
+                  "price_ibgt_current": float(self.price_ibgt_current), "data": data, "windows": windows,
+                  "paths": list(self.paths), "troves": list(self.troves)}
+        arrays["header"] = np.array(json.dumps(header))
+        #write aside and rename, so a crash never leaves a partial checkpoint behind
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as out:
+            np.savez_compressed(out, **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            arrays = {k: f[k] for k in f.files}
+        header = json.loads(str(arrays.pop("header")))
+        params = header["params"]
+        if params.get("ibgt_regimes") is not None:
+            params["ibgt_regimes"] = tuple(tuple(stage) for stage in params["ibgt_regimes"])
+        data = dict(header["data"])
+        data["data"] = {c: arrays[f"data/{c}"] for c in data["columns"]}
+        data["windows"] = [(column, dict(rolling, **{field: arrays[f"windows/{k}/{field}"] for field in ("values", "sum", "compensation")}))
+                           for k, (column, rolling) in enumerate(header["windows"])]
+        return cls(ModelParams(**params), header["seed"], header["run"], header["legacy"], header["index"],
+                   header["finished"], tuple(header["rates"]), header["price_ibgt_current"],
+                   {name: arrays[f"paths/{name}"] for name in header["paths"]}, data,
+                   {c: arrays[f"troves/{c}"] for c in header["troves"]})
+
+
+# One path of the macro model: the exogenous series for a seed and the step functions
+# that advance a trove book and a result buffer by one hour.
+# `paths` supplies the exogenous series ({name: array}, e.g. from a shared PathStore);
+# by default they are loaded from the disk cache of exogenous.py, or generated from the
+# seed and cached.
+class MacroModel:
+    def __init__(self, params=None, seed=2019375, run=0, legacy=False, paths=None, kernels=None):
+        self.params = params or ModelParams()
+        self.kernels = load_kernels(kernels)
+        self.streams = RandomStreams(seed=seed, run=run, legacy=legacy)
+        self.rate_issuance = self.params.rate_issuance
+        self.rate_redemption = self.params.rate_redemption
+        self.price_ibgt_current = self.params.price_ibgt_initial
+        paths = paths if paths is not None else load_paths(self.params, seed, run, legacy)
+        self.price_ibgt = paths["price_ibgt"]
+        self.natural_rate = paths["natural_rate"]
+        self.price_POLLEN = paths["price_POLLEN"]
+        self.finished = False
+
+    # Model, result buffer and trove book of a run restored from a Checkpoint; pass the
+    # buffer and the book to run(state=...) to carry on. Each call restores a fresh copy,
+    # so a checkpoint can be forked into any number of runs.
+    @classmethod
+    def from_checkpoint(cls, checkpoint):
+        paths = {}
+        for name, tail in checkpoint.paths.items():
+            series = np.full(checkpoint.offset + len(tail), np.nan)
+            series[checkpoint.offset:] = tail
+            paths[name] = series
+        model = cls(checkpoint.params, seed=checkpoint.seed, run=checkpoint.run, legacy=checkpoint.legacy, paths=paths)
+        model.rate_issuance, model.rate_redemption = checkpoint.rates
+        model.price_ibgt_current = checkpoint.price_ibgt_current
+        model.finished = checkpoint.finished
+        data = ResultBuffer.from_state(checkpoint.data)
+        troves = TroveBook.from_columns({c: values.copy() for c, values in checkpoint.troves.items()}, model.kernels)
+        return model, data, troves
+
+    #Troves
+
+    def liquidate_troves(self, troves, index, data):
+        p = self.params
+        price_NECT_previous = data.previous('Price_NECT')
+        price_POLLEN_previous = data.previous('price_POLLEN')
+        stability_pool_previous = data.previous('stability')
+
+        #only troves whose critical price is above the current iBGT price can be under 1.1
+        liquidated = troves.liquidatable(self.price_ibgt_current)
+        debt_liquidated = troves['Supply'][liquidated].sum()
+        ibgt_liquidated = troves['iBGT_Quantity'][liquidated].sum()
+        n_liquidate = len(liquidated)
+        troves.remove(liquidated)
+
+        liquidation_gain = ibgt_liquidated*self.price_ibgt_current - debt_liquidated*price_NECT_previous
+        airdrop_gain = price_POLLEN_previous * p.quantity_POLLEN_airdrop
+
+        shock_return = self.streams.stream('liquidate_troves', index).normal(0, p.sd_return)
+        if index <= p.day:
+            return_stability = p.initial_return*(1+shock_return)
+        elif index <= p.month:
+            #min function to rule out the large fluctuation caused by the large but temporary liquidation gain in a particular period
+            return_stability = min(0.5, 365*(data.window_sum('liquidation_gain', p.day)+data.window_sum('airdrop_gain', p.day))/(price_NECT_previous*stability_pool_previous))
+        else:
+            return_stability = (365/30)*(data.window_sum('liquidation_gain', p.month)+data.window_sum('airdrop_gain', p.month))/(price_NECT_previous*stability_pool_previous)
+
+        return[troves, return_stability, debt_liquidated, ibgt_liquidated, liquidation_gain, airdrop_gain, n_liquidate]
+
+    def close_troves(self, troves, index2, price_NECT_previous):
+        p = self.params
+        stream = self.streams.stream('close_troves', index2)
+        shock_closetroves = stream.normal(0, p.sd_closetroves)
+        n_troves = len(troves)
+
+        if index2 <= 240:
+            number_closetroves = stream.uniform(0, 1)
+        elif price_NECT_previous >= 1:
+            number_closetroves = max(0, p.n_steady * (1+shock_closetroves))
+        else:
+            number_closetroves = max(0, p.n_steady * (1+shock_closetroves)) + p.beta*(1-price_NECT_previous)*n_troves
+
+        number_closetroves = int(round(number_closetroves))
+
+        drops = self.streams.stream('close_troves_sample', index2).sample(len(troves), number_closetroves)
+        troves.remove(drops)
+        if len(troves) < number_closetroves:
+            number_closetroves = -999
+
+        return[troves, number_closetroves]
+
+    # Adjust the troves outside their inattention band. Each trove's band is a fixed
+    # iBGT price range until the trove changes, so the book hands out only the troves
+    # whose band the price has left, and only their draws are taken (`p`, if given,
+    # holds the draws of every trove). The other troves' CR_current follows the price
+    # in the book without being written here.
+    def adjust_troves(self, troves, index, p=None):
+        ratio = self.streams.stream('adjust_troves', index).uniform(0, 1)
+        rows = troves.outside_bands(self.price_ibgt_current)
+        if p is None:
+            p = self.streams.agents('adjust_troves_trove', index, len(troves), rows).uniform(0, 1) if len(rows) else np.empty(0)
+        else:
+            p = np.asarray(p)[rows]
+
+        issuance_NECT_adjust = 0
+        CR_current = np.empty(0)
+        if len(rows):
+            CR_current, by_debt, supply_new, by_collateral, quantity_new, issuance_NECT_adjust = self.kernels.adjust(
+                troves['iBGT_Price'][rows], troves['iBGT_Quantity'][rows], troves['Supply'][rows], troves['CR_initial'][rows],
+                troves['Rational_inattention'][rows], p, ratio, self.rate_issuance)
+        troves.set_ratios(self.price_ibgt_current, rows, CR_current)
+        if len(rows):
+            #A part of the troves are adjusted by adjusting debt
+            troves.update(rows[by_debt], Supply=supply_new)
+
+            #Another part of the troves are adjusted by adjusting collaterals
+            troves.update(rows[by_collateral], iBGT_Quantity=quantity_new)
+
+        return[troves, issuance_NECT_adjust]
+
+    def open_troves(self, troves, index1, price_NECT_previous):
+        p = self.params
+        streams = self.streams
+        shock_opentroves = streams.stream('open_troves', index1).normal(0, p.sd_opentroves)
+        n_troves = len(troves)
+
+        if index1 <= 0:
+            number_opentroves = p.initial_open
+        elif price_NECT_previous <= 1 + self.rate_issuance:
+            number_opentroves = max(0, p.n_steady * (1+shock_opentroves))
+        else:
+            number_opentroves = max(0, p.n_steady * (1+shock_opentroves)) + p.alpha*(price_NECT_previous-self.rate_issuance-1)*n_troves
+
+        number_opentroves = int(round(float(number_opentroves)))
+
+        price_ibgt_current = self.price_ibgt[index1]
+        CR_ratio = p.distribution_parameter1_CR + p.distribution_parameter2_CR * streams.agents('open_troves_CR', index1, number_opentroves).chisquare(p.distribution_parameter3_CR)
+        quantity_ibgt = streams.agents('open_troves_quantity', index1, number_opentroves).gamma(p.distribution_parameter1_ibgt_quantity, p.distribution_parameter2_ibgt_quantity)
+        rational_inattention = streams.agents('open_troves_inattention', index1, number_opentroves).gamma(p.distribution_parameter1_inattention, p.distribution_parameter2_inattention)
+
+        supply_trove, issuance_NECT_open = self.kernels.open_supply(float(price_ibgt_current), quantity_ibgt, CR_ratio, self.rate_issuance)
+
+        troves.append(iBGT_Price=price_ibgt_current, iBGT_Quantity=quantity_ibgt,
+                      CR_initial=CR_ratio, Supply=supply_trove,
+                      Rational_inattention=rational_inattention, CR_current=CR_ratio)
+
+        return[troves, number_opentroves, issuance_NECT_open]
+
+    #NECT Market
+
+    def stability_update(self, stability_pool_previous, return_previous, index):
+        p = self.params
+        shock_stability = self.streams.stream('stability_update', index).normal(0, p.sd_stability)
+        natural_rate_current = self.natural_rate[index]
+        if index <= p.month:
+            stability_pool = stability_pool_previous* (p.drift_stability+shock_stability)* (1+ return_previous- natural_rate_current)**p.theta
+        else:
+            stability_pool = stability_pool_previous* (1+shock_stability)* (1+ return_previous- natural_rate_current)**p.theta
+        return[stability_pool]
+
+    def price_stabilizer(self, troves, index, data, stability_pool, n_open):
+        p = self.params
+        rate_issuance = self.rate_issuance
+        rate_redemption = self.rate_redemption
+        price_ibgt_current = self.price_ibgt_current
+        issuance_NECT_stabilizer = 0
+        redemption_fee = 0
+        n_redempt = 0
+        redemption_pool = 0
+        #Calculating Price
+        supply = troves['Supply'].sum()
+        shock_liquidity = self.streams.stream('liquidity', index).normal(0, p.sd_liquidity)
+        liquidity_pool_previous = float(data.previous('liquidity'))
+        price_NECT_previous = float(data.previous('Price_NECT'))
+        price_NECT_current = price_NECT_previous*((supply-stability_pool)/(liquidity_pool_previous*(p.drift_liquidity+shock_liquidity)))**(1/p.delta)
+
+        #Liquidity Pool
+        liquidity_pool = supply-stability_pool
+
+        #Stabilizer
+        #Ceiling Arbitrageurs
+        if price_NECT_current > 1.1 + rate_issuance:
+            supply_wanted = stability_pool+liquidity_pool_previous*(p.drift_liquidity+shock_liquidity)*((1.1+rate_issuance)/price_NECT_previous)**p.delta
+            supply_trove = supply_wanted - supply
+
+            CR_ratio = 1.1
+            rational_inattention = 0.1
+            quantity_ibgt = supply_trove * CR_ratio / price_ibgt_current
+            issuance_NECT_stabilizer = rate_issuance * supply_trove
+
+            troves.append(iBGT_Price=price_ibgt_current, iBGT_Quantity=quantity_ibgt, CR_initial=CR_ratio,
+                          Supply=supply_trove, Rational_inattention=rational_inattention, CR_current=CR_ratio)
+            price_NECT_current = 1.1 + rate_issuance
+            liquidity_pool = supply_wanted-stability_pool
+            n_open = n_open+1
+
+        #Floor Arbitrageurs
+        if price_NECT_current < 1 - rate_redemption:
+            shock_redemption = self.streams.stream('redemption', index).normal(0, p.sd_redemption)
+            redemption_ratio = p.redemption_star * (1+shock_redemption)
+
+            supply_target = stability_pool+liquidity_pool_previous*(p.drift_liquidity+shock_liquidity)*((1-rate_redemption)/price_NECT_previous)**p.delta
+            supply_diff = supply - supply_target
+            if supply_diff < redemption_ratio * liquidity_pool:
+                redemption_pool = supply_diff
+                price_NECT_current = 1 - rate_redemption
+            else:
+                redemption_pool = redemption_ratio * liquidity_pool
+                price_NECT_current = price_NECT_previous * (liquidity_pool/(liquidity_pool_previous*(p.drift_liquidity+shock_liquidity)))**(1/p.delta)
+
+            #Shutting down the riskiest troves, residual taken from the next one
+            result_redemption = troves.redeem(redemption_pool, price_ibgt_current)
+            n_redempt = result_redemption[0]
+            #if the whole book was redeemed, only its outstanding supply could be
+            redemption_pool = redemption_pool - result_redemption[2]
+
+            #Redemption Fee
+            redemption_fee = rate_redemption * redemption_pool
+
+        return[price_NECT_current, liquidity_pool, troves, issuance_NECT_stabilizer, redemption_fee, n_redempt, redemption_pool, n_open]
+
+    #POLLEN Market
+
+    def POLLEN_market(self, index, data):
+        p = self.params
+        quantity_POLLEN = (100000000/3)*(1-0.5**(index/p.period))
+        if index <= p.month:
+            price_POLLEN_current = self.price_POLLEN[index-1]
+            annualized_earning = (index/p.month)**0.5*self.streams.stream('POLLEN_market', index).normal(200000000, 500000)
+        else:
+            revenue_issuance = data.window_sum('issuance_fee', p.month)
+            revenue_redemption = data.window_sum('redemption_fee', p.month)
+            annualized_earning = 365*(revenue_issuance+revenue_redemption)/30
+            #discountin factor to factor in the risk in early days
+            discount = index/p.period
+            price_POLLEN_current = discount*p.PE_ratio*annualized_earning/p.POLLEN_total_supply
+
+        MC_POLLEN_current = price_POLLEN_current * quantity_POLLEN
+        return[price_POLLEN_current, annualized_earning, MC_POLLEN_current]
+
+    #Simulation Program
+
+    #running window sums read by liquidate_troves and POLLEN_market
+    #row `index` is not recorded yet when they are read, so each window holds the previous `day`/`month` steps
+    def track_windows(self, data):
+        p = self.params
+        for column in ['liquidation_gain', 'airdrop_gain']:
+            data.track(column, p.day)
+            data.track(column, p.month)
+        for column in ['issuance_fee', 'redemption_fee']:
+            data.track(column, p.month)
+
+    # Result buffer and trove book after the initial troves are opened; `extra` adds
+    # columns with their initial values. With a `sink` (result_sink.ColumnSink) the
+    # buffer streams the steps out to it instead of holding the whole run.
+    def start(self, sink=None, **extra):
+        p = self.params
+        initials = {"Price_NECT":1.00, "Price_iBGT":p.price_ibgt_initial, "n_open":p.initial_open, "n_close":0, "n_liquidate": 0, "n_redempt":0,
+                    "n_troves":p.initial_open, "stability":0, "liquidity":0, "redemption_pool":0,
+                    "supply_NECT":0,  "return_stability":p.initial_return, "airdrop_gain":0, "liquidation_gain":0,  "issuance_fee":0, "redemption_fee":0,
+                    "price_POLLEN":p.price_POLLEN_initial, "MC_POLLEN":0, "annualized_earning":0}
+        initials.update(extra)
+        data = ResultBuffer(initials, p.n_sim, sink=sink)
+        self.track_windows(data)
+        troves = TroveBook(kernels=self.kernels)
+        result_open = self.open_troves(troves, 0, initials['Price_NECT'])
+        troves = result_open[0]
+        issuance_NECT_open = result_open[2]
+        initials['issuance_fee'] = issuance_NECT_open * initials["Price_NECT"]
+        initials['supply_NECT'] = troves["Supply"].sum()
+        initials['liquidity'] = 0.5*troves["Supply"].sum()
+        initials['stability'] = 0.5*troves["Supply"].sum()
+        data.record(initials)
+        return data, troves
+
+    # Advance the book by hour `index` and return the row to record, or None when the
+    # liquidity pool ran dry and the run stops without recording the step.
+    def step(self, troves, data, index):
+        #exogenous ibgt price input
+        price_ibgt_current = self.price_ibgt[index]
+        self.price_ibgt_current = price_ibgt_current
+        troves['iBGT_Price'] = price_ibgt_current
+        price_NECT_previous = data.previous('Price_NECT')
+
+        #trove liquidation & return of stability pool
+        result_liquidation = self.liquidate_troves(troves, index, data)
+        return_stability = result_liquidation[1]
+        airdrop_gain = result_liquidation[5]
+        liquidation_gain = result_liquidation[4]
+        n_liquidate = result_liquidation[6]
+
+        #close troves
+        result_close = self.close_troves(troves, index, price_NECT_previous)
+        n_close = result_close[1]
+
+        #adjust troves
+        result_adjustment = self.adjust_troves(troves, index)
+        issuance_NECT_adjust = result_adjustment[1]
+
+        #open troves
+        result_open = self.open_troves(troves, index, price_NECT_previous)
+        n_open = result_open[1]
+        issuance_NECT_open = result_open[2]
+
+        #Stability Pool
+        stability_pool = self.stability_update(data.previous('stability'), return_stability, index)[0]
+
+        #Calculating Price, Liquidity Pool, and Redemption
+        result_price = self.price_stabilizer(troves, index, data, stability_pool, n_open)
+        price_NECT_current = result_price[0]
+        liquidity_pool = result_price[1]
+        issuance_NECT_stabilizer = result_price[3]
+        redemption_fee = result_price[4]
+        n_redempt = result_price[5]
+        redemption_pool = result_price[6]
+        n_open = result_price[7]
+        if liquidity_pool < 0:
+            return None
+
+        #POLLEN Market
+        result_POLLEN = self.POLLEN_market(index, data)
+        price_POLLEN_current = result_POLLEN[0]
+        annualized_earning = result_POLLEN[1]
+        MC_POLLEN_current = result_POLLEN[2]
+
+        #Summary
+        issuance_fee = price_NECT_current * (issuance_NECT_adjust + issuance_NECT_open + issuance_NECT_stabilizer)
+        n_troves = len(troves)
+        supply_NECT = troves['Supply'].sum()
+
+        return {"Price_NECT":float(price_NECT_current), "Price_iBGT":float(price_ibgt_current), "n_open":float(n_open), "n_close":float(n_close),
+                "n_liquidate":float(n_liquidate), "n_redempt": float(n_redempt), "n_troves":float(n_troves),
+                "stability":float(stability_pool), "liquidity":float(liquidity_pool), "redemption_pool":float(redemption_pool), "supply_NECT":float(supply_NECT),
+                "issuance_fee":float(issuance_fee), "redemption_fee":float(redemption_fee),
+                "airdrop_gain":float(airdrop_gain), "liquidation_gain":float(liquidation_gain), "return_stability":float(return_stability),
+                "annualized_earning":float(annualized_earning), "MC_POLLEN":float(MC_POLLEN_current), "price_POLLEN":float(price_POLLEN_current)}
+
+    # Snapshot of the run that recorded `data` and `troves`, to carry on from step len(data).
+    def checkpoint(self, data, troves):
+        index = len(data)
+        offset = max(0, index - 1)
+        return Checkpoint(self.params, self.streams.seed, self.streams.run, self.streams.legacy, index, self.finished,
+                          (self.rate_issuance, self.rate_redemption), self.price_ibgt_current,
+                          {"price_ibgt": np.array(self.price_ibgt[offset:]), "natural_rate": np.array(self.natural_rate[offset:]),
+                           "price_POLLEN": np.array(self.price_POLLEN[offset:])},
+                          data.state(), {c: troves[c].copy() for c in troves.columns})
+
+    # Run the simulation under a fee policy (policies.py); without one the rates stay at
+    # the parameters' values, which is the baseline. Stops early, like the original loop,
+    # when the liquidity pool or the NECT price turns negative. With `timeout` (seconds)
+    # the run raises RunTimeout once it takes longer than that.
+    #
+    # `state` is a (data, troves) pair to carry on from, e.g. from from_checkpoint(); the
+    # rates then stay where they were, and the columns of a policy that was not on before
+    # are added with its initial values at the last recorded step. `stop` ends the run
+    # before that step. With `checkpoint` (a file path) the state is saved there every
+    # `every` steps, if given, and when the run ends, so a crashed run can be resumed.
+    # A `sink` receives the recorded steps of a new run (see start()); it cannot be
+    # combined with checkpoints. A `profiler` (profiling.py) times the phases of every
+    # step while the run lasts.
+    def run(self, policy=None, timeout=None, state=None, stop=None, checkpoint=None, every=None, sink=None, profiler=None):
+        if sink is not None and (checkpoint is not None or state is not None):
+            raise ValueError("a result sink streams a new run and cannot be checkpointed")
+        if profiler is None:
+            return self._run(policy, timeout, state, stop, checkpoint, every, sink)
+        profiler.attach(self, PHASES)
+        if policy is not None:
+            profiler.attach(policy, ("apply",))
+        try:
+            return self._run(policy, timeout, state, stop, checkpoint, every, sink, profiler)
+        finally:
+            profiler.detach()
+
+    def _run(self, policy, timeout, state, stop, checkpoint, every, sink, profiler=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if state is None:
+            self.rate_issuance = self.params.rate_issuance
+            self.rate_redemption = self.params.rate_redemption
+            self.finished = False
+            if policy is not None:
+                policy.start(self)
+            data, troves = self.start(sink, **(policy.initials(self) if policy is not None else {}))
+        else:
+            data, troves = state
+            if policy is not None:
+                for column, value in policy.initials(self).items():
+                    if column not in data.columns:
+                        data.add_column(column, value)
+        if profiler is not None:
+            profiler.attach(data, ("record",))
+            profiler.attach(troves, ("liquidatable", "outside_bands", "redeem"))
+        stop = self.params.n_sim if stop is None else min(stop, self.params.n_sim)
+        first = stop if self.finished else len(data)
+        for index in range(first, stop):
+            if deadline is not None and time.monotonic() > deadline:
+                raise RunTimeout(f"run stopped at step {index} after {timeout}s")
+            extra = policy.apply(self, troves, data, index) if policy is not None else {}
+            new_row = self.step(troves, data, index)
+            if new_row is None:
+                self.finished = True
+                break
+            new_row.update(extra)
+            data.record(new_row)
+            if new_row["Price_NECT"] < 0:
+                self.finished = True
+                break
+            if checkpoint is not None and every and (index + 1) % every == 0 and index + 1 < stop:
+                self.checkpoint(data, troves).save(checkpoint)
+        self.finished = self.finished or len(data) >= self.params.n_sim
+        if checkpoint is not None:
+            self.checkpoint(data, troves).save(checkpoint)
+        return data, troves
+
+
+# One run, under `policy` or the baseline; returns the ResultBuffer and the final TroveBook.
+def run_simulation(params=None, seed=2019375, run=0, timeout=None, paths=None, policy=None, checkpoint=None, every=None, sink=None,
+                   profiler=None):
+    return MacroModel(params, seed=seed, run=run, paths=paths).run(policy, timeout=timeout, checkpoint=checkpoint, every=every, sink=sink,
+                                                                   profiler=profiler)
+
+
+# Carry on the run saved in the checkpoint file `path` (MacroModel.run(checkpoint=...)),
+# saving to the same file as it goes.
+def resume_simulation(path, policy=None, timeout=None, every=None):
+    model, data, troves = MacroModel.from_checkpoint(Checkpoint.load(path))
+    return model.run(policy, timeout=timeout, state=(data, troves), checkpoint=path, every=every)
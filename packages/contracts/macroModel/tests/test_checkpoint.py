@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from exogenous import generate_paths
+from policies import DecayingBaseRate, FixedRates, fork_policies
+from rng_streams import RandomStreams
+from simulation import Checkpoint, MacroModel, ModelParams
+
+SEED = 2019375
+
+#past the first day and month, where the stability return and POLLEN price switch formulas
+PARAMS = ModelParams(n_sim=24*33)
+
+
+@pytest.fixture(scope="module")
+def paths():
+    return generate_paths(PARAMS, RandomStreams(seed=SEED))
+
+
+def run_frame(paths, policy=None, **kwargs):
+    data, troves = MacroModel(PARAMS, seed=SEED, paths=paths).run(policy, **kwargs)
+    return data.to_frame(), troves.to_frame()
+
+
+@pytest.mark.parametrize("stop", [1, 23, 24*30 + 5])
+@pytest.mark.parametrize("policy", [None, DecayingBaseRate()], ids=["baseline", "decaying"])
+def test_resumed_run_equals_uninterrupted_run(tmp_path, paths, policy, stop):
+    expected_data, expected_troves = run_frame(paths, policy)
+
+    path = tmp_path / "run.npz"
+    model = MacroModel(PARAMS, seed=SEED, paths=paths)
+    data, troves = model.run(policy, stop=stop)
+    model.checkpoint(data, troves).save(path)
+    checkpoint = Checkpoint.load(path)
+    assert checkpoint.index == stop and not checkpoint.finished
+
+    model, data, troves = MacroModel.from_checkpoint(checkpoint)
+    data, troves = model.run(policy, state=(data, troves))
+    pd.testing.assert_frame_equal(data.to_frame(), expected_data, check_exact=True)
+    pd.testing.assert_frame_equal(troves.to_frame(), expected_troves, check_exact=True)
+
+
+def test_periodic_checkpoints_resume_to_the_same_run(tmp_path, paths):
+    expected_data, _ = run_frame(paths)
+    path = tmp_path / "run.npz"
+    #a run that stopped at step 250, having saved at 100 and 200 on the way
+    MacroModel(PARAMS, seed=SEED, paths=paths).run(stop=250, checkpoint=str(path), every=100)
+    assert Checkpoint.load(path).index == 250
+
+    model, data, troves = MacroModel.from_checkpoint(Checkpoint.load(path))
+    data, _ = model.run(state=(data, troves), checkpoint=str(path), every=100)
+    pd.testing.assert_frame_equal(data.to_frame(), expected_data, check_exact=True)
+    assert Checkpoint.load(path).finished
+
+
+# A fork carries on the prefix it was made from, so each branch equals a run of its
+# policy from scratch when the prefix ran under the same rates.
+def test_fork_branches_equal_runs_from_scratch(tmp_path, paths):
+    for name, policy in (("baseline", FixedRates), ("decaying", DecayingBaseRate)):
+        path = tmp_path / f"{name}.npz"
+        model = MacroModel(PARAMS, seed=SEED, paths=paths)
+        data, troves = model.run(policy(), stop=300)
+        model.checkpoint(data, troves).save(path)
+
+        table, failed = fork_policies(str(path), {name: policy()}, workers=1)
+        assert failed == {}
+        expected, _ = run_frame(paths, policy())
+        pd.testing.assert_frame_equal(table.loc[name], expected, check_exact=True, check_names=False)
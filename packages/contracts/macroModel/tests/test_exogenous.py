@@ -0,0 +1,32 @@
+import numpy as np
+
+import exogenous
+from exogenous import clear_path_cache, exogenous_key, generate_paths, load_paths
+from rng_streams import RandomStreams
+from simulation import ModelParams
+
+PARAMS = ModelParams(period=24*20, month=24*5)
+
+
+def test_load_paths_caches_under_the_versioned_key(tmp_path, monkeypatch):
+    expected = generate_paths(PARAMS, RandomStreams(seed=5))
+    for _ in range(2):
+        paths = load_paths(PARAMS, 5, cache_dir=str(tmp_path))
+        for name, series in expected.items():
+            np.testing.assert_array_equal(paths[name], series)
+    key = exogenous_key(PARAMS, 5)
+    assert [p.name for p in tmp_path.iterdir()] == [key]
+
+    monkeypatch.setattr(exogenous, "PATH_CACHE_VERSION", exogenous.PATH_CACHE_VERSION + 1)
+    assert exogenous_key(PARAMS, 5) != key
+
+
+def test_clear_path_cache(tmp_path):
+    for seed in (1, 2, 3):
+        load_paths(PARAMS, seed, cache_dir=str(tmp_path))
+    assert clear_path_cache([exogenous_key(PARAMS, 2), "missing"], cache_dir=str(tmp_path)) == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(exogenous_key(PARAMS, s) for s in (1, 3))
+    assert clear_path_cache(cache_dir=str(tmp_path)) == 2
+    assert list(tmp_path.iterdir()) == []
+    assert clear_path_cache(cache_dir=str(tmp_path / "none")) == 0
+    assert clear_path_cache(cache_dir="") == 0
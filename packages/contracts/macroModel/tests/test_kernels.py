@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import kernels
+from kernels import TOLERANCE, Kernels
+
+
+def assert_close(actual, expected):
+    np.testing.assert_allclose(actual, expected, rtol=TOLERANCE, atol=0)
+
+
+# The loop kernels, uncompiled (checked without Numba installed) and compiled by Numba.
+@pytest.fixture(params=["loops", "numba"])
+def loop_kernels(request):
+    if request.param == "numba":
+        pytest.importorskip("numba")
+        return kernels.load("numba")
+    return Kernels("loops", kernels._adjust_loop, kernels._open_supply_loop, kernels._redeem_walk_loop, kernels._below_ratio_loop)
+
+
+@pytest.fixture
+def troves():
+    rng = np.random.default_rng(17)
+    n = 2000
+    quantity = rng.gamma(10, 500, n)
+    CR_initial = 1.1 + rng.chisquare(16, n) * 0.1
+    supply = 1000 * quantity / CR_initial
+    price = np.full(n, 1000.0) * rng.uniform(0.6, 1.6, n)
+    return rng, price, quantity, supply, CR_initial, rng.gamma(4, 0.08, n)
+
+
+def test_adjust(loop_kernels, troves):
+    rng, price, quantity, supply, CR_initial, inattention = troves
+    p = rng.uniform(0, 1, len(price))
+    numpy = kernels.load("numpy")
+    for ratio in (0.0, 0.3, 1.0):
+        expected = numpy.adjust(price, quantity, supply, CR_initial, inattention, p, ratio, 0.01)
+        actual = loop_kernels.adjust(price, quantity, supply, CR_initial, inattention, p, ratio, 0.01)
+        for a, e in zip(actual[:-1], expected[:-1]):
+            if e.dtype == bool:
+                np.testing.assert_array_equal(a, e)
+            else:
+                assert_close(a, e)
+        assert_close(actual[-1], expected[-1])
+
+
+def test_open_supply(loop_kernels, troves):
+    _, _, quantity, _, CR_initial, _ = troves
+    numpy = kernels.load("numpy")
+    for n in (0, 1, len(quantity)):
+        supply, issuance = loop_kernels.open_supply(1234.5, quantity[:n], CR_initial[:n], 0.005)
+        expected_supply, expected_issuance = numpy.open_supply(1234.5, quantity[:n], CR_initial[:n], 0.005)
+        assert_close(supply, expected_supply)
+        assert_close(issuance, expected_issuance)
+
+
+def test_redeem_walk(loop_kernels, troves):
+    supply = troves[3]
+    numpy = kernels.load("numpy")
+    for amount in (0.0, supply[0] / 2, supply[0], 0.4 * supply.sum(), supply.sum() * 2):
+        n, redempted = loop_kernels.redeem_walk(supply, amount)
+        expected_n, expected_redempted = numpy.redeem_walk(supply, amount)
+        assert n == expected_n
+        assert_close(redempted, expected_redempted)
+    assert loop_kernels.redeem_walk(np.empty(0), 5.0)[0] == 0
+
+
+def test_below_ratio(loop_kernels, troves):
+    _, _, quantity, supply, _, _ = troves
+    rows = np.flatnonzero(np.random.default_rng(3).random(len(supply)) < 0.4)
+    numpy = kernels.load("numpy")
+    for price in (500.0, 1000.0, 1300.0):
+        np.testing.assert_array_equal(loop_kernels.below_ratio(rows, price, quantity, supply, 1.1),
+                                      numpy.below_ratio(rows, price, quantity, supply, 1.1))
+
+
+# The blocked walk against one cumsum over the whole book, exactly.
+@pytest.mark.parametrize("block", [1, 7, 64, 4096])
+def test_redeem_walk_blocks(monkeypatch, troves, block):
+    supply = troves[3][:1000]
+    monkeypatch.setattr(kernels, "REDEEM_BLOCK", block)
+    cumulative = np.cumsum(supply)
+    for amount in (0.0, supply[0], cumulative[63], cumulative[64], 0.37 * cumulative[-1], cumulative[-1], 2 * cumulative[-1]):
+        n = int(np.searchsorted(cumulative, amount, side="right"))
+        expected = (n, cumulative[n] - supply[n]) if n < len(supply) else (n, cumulative[-1])
+        assert kernels._redeem_walk(supply, amount) == expected
@@ -0,0 +1,85 @@
+import random
+
+import numpy as np
+import pytest
+
+from rng_streams import RandomStreams, _PickedEngine
+
+STEPS = range(1, 300)
+
+
+# The draws of the original simulators, reseeding the global generators before each.
+def test_legacy_scalar_streams_replay_the_reseeding_code():
+    streams = RandomStreams(legacy=True)
+    for step in STEPS:
+        random.seed(2019375 + 10000*step)
+        assert streams.stream("ibgt_price", step).normal(0, 0.02) == random.normalvariate(0, 0.02)
+        random.seed(57984 - 3*step)
+        assert streams.stream("adjust_troves", step).uniform(0, 1) == random.uniform(0, 1)
+        random.seed(293 + 100*step)
+        assert streams.stream("close_troves_sample", step).sample(500, 7) == random.sample(range(500), 7)
+        np.random.seed(208 + step)
+        assert streams.stream("close_troves", step).normal(0, 0.5) == np.random.normal(0, 0.5)
+        np.random.seed(2 + 3*step)
+        assert streams.stream("POLLEN_market", step).normal(200000000, 500000) == np.random.normal(200000000, 500000)
+
+
+def test_legacy_agent_and_path_streams_replay_the_reseeding_code():
+    streams = RandomStreams(legacy=True)
+    for step in STEPS:
+        expected = []
+        for i in range(12):
+            np.random.seed(2033 + step + i*i)
+            expected.append(np.random.chisquare(df=7))
+        np.testing.assert_array_equal(streams.agents("open_troves_CR", step, 12).chisquare(7), expected)
+        expected = []
+        for i in range(12):
+            np.random.seed(20 + 10*i + step)
+            expected.append(np.random.gamma(10, scale=500))
+        np.testing.assert_array_equal(streams.agents("open_troves_quantity", step, 12).gamma(10, 500), expected)
+        expected = []
+        for i in (0, 4, 11):
+            random.seed(187*step + 3*i)
+            expected.append(random.uniform(0, 1))
+        np.testing.assert_array_equal(streams.agents("adjust_troves_trove", step, 12, rows=[0, 4, 11]).uniform(0, 1), expected)
+
+    expected = []
+    for step in STEPS:
+        random.seed(201597 + 10*step)
+        expected.append(random.normalvariate(0, 0.001))
+    np.testing.assert_array_equal(streams.path("natural_rate", STEPS.start, STEPS.stop).normal(0, 0.001), expected)
+
+
+@pytest.mark.parametrize("rows", [[0], [3, 17, 1000, 65537, 99999], [5, 6, 7, 8, 9, 4097], list(range(0, 2000, 3))])
+def test_picked_draws_match_the_full_vector(rows):
+    streams = RandomStreams(seed=7, run=2)
+    for step in (0, 1, 365):
+        full = streams.agents("adjust_troves_trove", step, 100000)
+        picked = streams.agents("adjust_troves_trove", step, 100000, rows=rows)
+        np.testing.assert_array_equal(picked.uniform(0, 1), full.uniform(0, 1)[rows])
+        np.testing.assert_array_equal(
+            streams.agents("open_troves_CR", step, 100000, rows=rows).chisquare(7),
+            streams.agents("open_troves_CR", step, 100000).chisquare(7)[rows])
+
+
+# Reading a position off its counter block and drawing the vector up to it and
+# discarding the prefix are the same draw.
+def test_block_jump_matches_drawing_the_prefix():
+    key = RandomStreams(seed=11)._key("redemption")
+    rows = [1, 2, 3, 4, 5000, 5001, 5003, 80000]
+    jumped = _PickedEngine(key, 9 << 128, rows)
+    jumped.jump_cost = 0
+    prefix = _PickedEngine(key, 9 << 128, rows)
+    prefix.jump_cost = np.inf
+    np.testing.assert_array_equal(jumped.uniform(-2.0, 3.0), prefix.uniform(-2.0, 3.0))
+    np.testing.assert_array_equal(jumped.uniform(), prefix.uniform())
+
+
+def test_streams_are_keyed_not_ordered():
+    first = RandomStreams(seed=3, run=1)
+    second = RandomStreams(seed=3, run=1)
+    second.stream("liquidity", 4).normal()
+    np.testing.assert_array_equal(first.agents("open_troves_CR", 9, 50).chisquare(7),
+                                  second.agents("open_troves_CR", 9, 50).chisquare(7))
+    assert first.stream("liquidity", 4).normal() != first.stream("liquidity", 5).normal()
+    assert RandomStreams(seed=3, run=2).stream("liquidity", 4).normal() != first.stream("liquidity", 4).normal()
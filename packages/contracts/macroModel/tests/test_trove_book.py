@@ -0,0 +1,216 @@
+import numpy as np
+import pytest
+
+from trove_book import TROVE_COLUMNS, TroveBook
+
+
+def random_columns(rng, n):
+    quantity = rng.gamma(10, 500, n)
+    CR_initial = 1.1 + rng.chisquare(7, n) * 0.1
+    price = np.full(n, 1000.0)
+    supply = price * quantity / CR_initial
+    return {"iBGT_Price": price, "iBGT_Quantity": quantity, "CR_initial": CR_initial, "Supply": supply,
+            "Rational_inattention": rng.gamma(4, 0.02, n), "CR_current": CR_initial.copy()}
+
+
+def random_book(seed, n):
+    rng = np.random.default_rng(seed)
+    columns = random_columns(rng, n)
+    return rng, TroveBook.from_columns(columns), {c: v.copy() for c, v in columns.items()}
+
+
+# Redemption against a plain copy of the columns, trove by trove: sort by CR_current,
+# redeem whole troves until the running supply passes `amount`, take the residual from
+# the trove that passes it.
+def reference_redeem(columns, amount, price):
+    order = np.argsort(columns["CR_current"], kind="stable")
+    columns = {c: v[order] for c, v in columns.items()}
+    cumulative, redempted, n = 0.0, 0.0, 0
+    while n < len(order):
+        cumulative = cumulative + columns["Supply"][n]
+        if cumulative > amount:
+            redempted = cumulative - columns["Supply"][n]
+            break
+        redempted = cumulative
+        n += 1
+    if n == len(order):
+        return [n, 0, amount - redempted if n else amount], {c: v[:0] for c, v in columns.items()}
+    residual = amount - redempted
+    columns = {c: v[n:].copy() for c, v in columns.items()}
+    columns["Supply"][0] -= residual
+    columns["iBGT_Quantity"][0] -= residual / price
+    columns["CR_current"][0] = price * columns["iBGT_Quantity"][0] / columns["Supply"][0]
+    return [n, residual, 0], columns
+
+
+def assert_book_equals(book, columns):
+    assert len(book) == len(columns["Supply"])
+    for c in TROVE_COLUMNS:
+        np.testing.assert_array_equal(book[c], columns[c], err_msg=c)
+
+
+def test_append_remove_swap_remove_keep_columns_aligned():
+    rng, book, columns = random_book(1, 300)
+    extra = random_columns(rng, 50)
+    book.append(**extra)
+    columns = {c: np.concatenate((columns[c], extra[c])) for c in TROVE_COLUMNS}
+    assert_book_equals(book, columns)
+
+    drop = rng.random(len(book)) < 0.3
+    assert book.remove(drop) == drop.sum()
+    columns = {c: v[~drop] for c, v in columns.items()}
+    assert_book_equals(book, columns)
+
+    book.swap_remove(3)
+    for c in TROVE_COLUMNS:
+        columns[c][3] = columns[c][-1]
+    columns = {c: v[:-1] for c, v in columns.items()}
+    assert_book_equals(book, columns)
+
+    book.append(**{c: float(v[0]) for c, v in extra.items()})
+    assert book.row(len(book) - 1) == {c: float(extra[c][0]) for c in TROVE_COLUMNS}
+
+
+@pytest.mark.parametrize("fraction", [0.0, 0.01, 0.3, 0.999])
+def test_redeem_matches_reference(fraction):
+    _, book, columns = random_book(2, 400)
+    amount = fraction * columns["Supply"].sum()
+    expected, remaining = reference_redeem(columns, amount, 1000.0)
+    assert book.redeem(amount, 1000.0) == expected
+    assert_book_equals(book, remaining)
+
+
+@pytest.mark.parametrize("excess", [0.0, 1.0, 1e6])
+def test_redeem_exhausting_the_book(excess):
+    rng, book, columns = random_book(3, 200)
+    total = np.cumsum(columns["Supply"][np.argsort(columns["CR_current"], kind="stable")])[-1]
+    n_redempt, residual, unfilled = book.redeem(total + excess, 1000.0)
+    assert (n_redempt, residual) == (200, 0)
+    assert unfilled == pytest.approx(excess, abs=1e-6)
+    assert len(book) == 0 and book.liquidatable(1.0).size == 0
+
+    #an empty book redeems nothing, and takes troves again afterwards
+    assert book.redeem(5.0, 1000.0) == [0, 0, 5.0]
+    book.append(**random_columns(rng, 10))
+    assert len(book) == 10
+    assert book.redeem(0.0, 1000.0)[0] == 0
+
+
+def full_scan_liquidatable(book, price):
+    return np.flatnonzero(price * book["iBGT_Quantity"] / book["Supply"] < book.liquidation_ratio)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_liquidatable_matches_full_scan(seed):
+    rng, book, _ = random_book(10 + seed, 500)
+    prices = rng.uniform(200, 1200, 8)
+    for price in prices:
+        np.testing.assert_array_equal(book.liquidatable(price), full_scan_liquidatable(book, price))
+
+    #removals, swaps, moved troves and new troves, through enough rounds that the
+    #index compacts and renumbers the troves several times
+    for _ in range(30):
+        book.remove(rng.random(len(book)) < 0.05)
+        if len(book):
+            book.swap_remove(int(rng.integers(len(book))))
+        rows = rng.choice(len(book), size=min(40, len(book)), replace=False)
+        book.update(rows, Supply=book["Supply"][rows] * rng.uniform(0.5, 1.5, len(rows)))
+        book.append(**random_columns(rng, int(rng.integers(0, 30))))
+        for price in prices:
+            np.testing.assert_array_equal(book.liquidatable(price), full_scan_liquidatable(book, price))
+
+
+def test_liquidatable_after_whole_column_assignment_and_sort():
+    rng, book, _ = random_book(20, 300)
+    book["iBGT_Quantity"] = book["iBGT_Quantity"] * rng.uniform(0.7, 1.0, len(book))
+    np.testing.assert_array_equal(book.liquidatable(800.0), full_scan_liquidatable(book, 800.0))
+    book.sort_by("Supply", ascending=False)
+    np.testing.assert_array_equal(book.liquidatable(800.0), full_scan_liquidatable(book, 800.0))
+
+    #troves without a critical price are always examined
+    book.update([0, 5], Supply=[-1.0, 0.0])
+    with np.errstate(divide="ignore"):
+        assert 0 in book.liquidatable(1e9)
+        np.testing.assert_array_equal(book.liquidatable(1e9), full_scan_liquidatable(book, 1e9))
+
+
+def adjustment_check(book, price):
+    CR_current = price * book["iBGT_Quantity"] / book["Supply"]
+    return (CR_current - book["CR_initial"]) / (book["CR_initial"] * book["Rational_inattention"])
+
+
+def full_scan_outside_bands(book, price):
+    check = adjustment_check(book, price)
+    return np.flatnonzero((check < -1) | (check > 2))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_outside_bands_matches_full_scan(seed):
+    rng, book, _ = random_book(30 + seed, 500)
+    prices = rng.uniform(500, 2000, 8)
+    for _ in range(30):
+        for price in prices:
+            candidates = book.outside_bands(price)
+            check = adjustment_check(book, price)[candidates]
+            np.testing.assert_array_equal(candidates[(check < -1) | (check > 2)], full_scan_outside_bands(book, price))
+            assert np.all(np.diff(candidates) > 0)
+        book.remove(rng.random(len(book)) < 0.05)
+        rows = rng.choice(len(book), size=min(40, len(book)), replace=False)
+        book.update(rows, CR_initial=book["CR_initial"][rows] * rng.uniform(0.9, 1.1, len(rows)),
+                    iBGT_Quantity=book["iBGT_Quantity"][rows] * rng.uniform(0.8, 1.2, len(rows)))
+        book.append(**random_columns(rng, int(rng.integers(0, 30))))
+
+
+# A book whose adjustment step wrote CR_current at `price` for every trove.
+def eager_ratios(columns, price, rows, values):
+    columns = {c: v.copy() for c, v in columns.items()}
+    columns["CR_current"] = price * columns["iBGT_Quantity"] / columns["Supply"]
+    columns["CR_current"][rows] = values
+    return columns
+
+
+def test_deferred_ratios_match_eager_ones():
+    rng, book, columns = random_book(40, 400)
+    rows = np.sort(rng.choice(400, size=50, replace=False))
+    values = rng.uniform(1.0, 3.0, 50)
+    book.set_ratios(900.0, rows, values)
+    columns = eager_ratios(columns, 900.0, rows, values)
+    assert_book_equals(book, columns)
+
+    #update: moved troves settle their ratio first, CR_current writes win
+    book.set_ratios(900.0, rows, values)
+    moved = np.array([0, int(rows[0]), 399])
+    quantity = book._data["iBGT_Quantity"][moved] * 1.5
+    book.update(moved, iBGT_Quantity=quantity)
+    columns["iBGT_Quantity"][moved] = quantity
+    book.update([1, 2], CR_current=[7.0, 8.0])
+    columns["CR_current"][[1, 2]] = [7.0, 8.0]
+    assert_book_equals(book, columns)
+
+    #remove
+    book.set_ratios(900.0, rows, values)
+    columns = eager_ratios(columns, 900.0, rows, values)
+    drop = rng.random(400) < 0.2
+    book.remove(drop)
+    columns = {c: v[~drop] for c, v in columns.items()}
+    assert_book_equals(book, columns)
+
+    #redeem: the book is ordered by the filled-in ratios before the walk
+    rows = np.sort(rng.choice(len(book), size=30, replace=False))
+    values = rng.uniform(1.0, 3.0, 30)
+    book.set_ratios(1100.0, rows, values)
+    columns = eager_ratios(columns, 1100.0, rows, values)
+    amount = 0.2 * columns["Supply"].sum()
+    expected, remaining = reference_redeem(columns, amount, 1100.0)
+    assert book.redeem(amount, 1100.0) == expected
+    assert_book_equals(book, remaining)
+
+
+def test_redeem_keeps_a_book_in_order_as_it_is():
+    _, book, columns = random_book(5, 300)
+    book.sort_by("CR_current")
+    order = np.argsort(columns["CR_current"], kind="stable")
+    columns = {c: v[order] for c, v in columns.items()}
+    expected, remaining = reference_redeem(columns, 0.1 * columns["Supply"].sum(), 1000.0)
+    assert book.redeem(0.1 * columns["Supply"].sum(), 1000.0) == expected
+    assert_book_equals(book, remaining)
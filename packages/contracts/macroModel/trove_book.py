@@ -0,0 +1,429 @@
+import numpy as np
+
+from kernels import load as load_kernels
+
+TROVE_COLUMNS = ("iBGT_Price", "iBGT_Quantity", "CR_initial", "Supply", "Rational_inattention", "CR_current")
+
+# Collateral ratio below which a trove is liquidated.
+LIQUIDATION_RATIO = 1.1
+
+# Columns the critical-price and band indexes are computed from.
+INDEXED_COLUMNS = frozenset(("Supply", "iBGT_Quantity", "CR_initial", "Rational_inattention"))
+
+# Critical iBGT price of each trove: the price below which its collateral ratio drops
+# under `ratio`. Troves whose ratio is negative or undefined at every price
+# (non-positive Supply or iBGT_Quantity) get +inf, so they are always checked.
+def critical_price(supply, quantity, ratio=LIQUIDATION_RATIO):
+    supply = np.asarray(supply, dtype=float)
+    quantity = np.asarray(quantity, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        critical = ratio * supply / quantity
+    return np.where((supply > 0) & (quantity > 0) & np.isfinite(critical), critical, np.inf)
+
+
+# Trigger prices of each trove's inattention band: the adjustment check
+# (CR_current - CR_initial)/(CR_initial*Rational_inattention) leaves [-1, 2] exactly
+# when the iBGT price drops below `lower` or rises above `upper`. Troves whose check
+# does not grow with the price (non-positive Supply, iBGT_Quantity or band width) get
+# lower=+inf and upper=-inf, so they are always checked.
+def band_prices(supply, quantity, CR_initial, inattention):
+    supply = np.asarray(supply, dtype=float)
+    quantity = np.asarray(quantity, dtype=float)
+    CR_initial = np.asarray(CR_initial, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        width = CR_initial * np.asarray(inattention, dtype=float)
+        scale = supply / quantity
+        lower = (CR_initial - width) * scale
+        upper = (CR_initial + 2 * width) * scale
+    regular = (supply > 0) & (quantity > 0) & (width > 0) & np.isfinite(lower) & np.isfinite(upper)
+    return np.where(regular, lower, np.inf), np.where(regular, upper, -np.inf)
+
+
+# Troves ordered by a price key (critical price, band trigger price), keyed by trove id.
+# A trove's key only moves when the columns it is computed from do, so the sorted
+# entries are built once and kept up to date incrementally: changed and new troves go
+# to a small pending batch, and the entry they replace is invalidated by bumping the
+# trove's version rather than being searched for. compact() drops the invalid entries
+# and merges the pending batch back into the sorted arrays.
+class PriceIndex:
+    # relative slack on the search, so no trove is missed because 1.1*S/Q and P*Q/S
+    # round differently; candidates are confirmed on their exact collateral ratio
+    margin = 1e-9
+
+    def __init__(self):
+        self.reset(np.empty(0))
+
+    # Index troves 0..n-1 with the given critical prices.
+    def reset(self, critical):
+        critical = np.asarray(critical, dtype=float)
+        order = np.argsort(critical, kind="stable")
+        self._critical = critical[order]
+        self._ids = order.astype(np.int64)
+        self._versions = np.zeros(len(order), dtype=np.int64)
+        self._version = np.zeros(len(order), dtype=np.int64)
+        self._pending = []
+        self._n_pending = 0
+        self._stale = 0
+
+    # Entries that are invalid or not yet merged, relative to the sorted ones.
+    def crowded(self):
+        return self._stale + self._n_pending > max(64, len(self._critical) // 2)
+
+    def _push(self, ids, critical):
+        self._pending.append((np.asarray(critical, dtype=float), ids, self._version[ids]))
+        self._n_pending += len(ids)
+
+    # New troves; their ids are the next unused ones.
+    def add(self, ids, critical):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        top = int(ids.max()) + 1
+        if top > len(self._version):
+            grown = np.zeros(max(top, 2 * len(self._version)), dtype=np.int64)
+            grown[:len(self._version)] = self._version
+            self._version = grown
+        self._push(ids, critical)
+
+    # Troves whose key changed.
+    def update(self, ids, critical):
+        ids = np.asarray(ids, dtype=np.int64)
+        self._version[ids] += 1
+        self._stale += len(ids)
+        self._push(ids, critical)
+
+    def discard(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        self._version[ids] += 1
+        self._stale += len(ids)
+
+    # The pending batch as one (critical, ids, versions) triple.
+    def _pending_entries(self):
+        if len(self._pending) > 1:
+            self._pending = [tuple(np.concatenate(part) for part in zip(*self._pending))]
+        return self._pending[0]
+
+    # Drop invalid entries, merge the pending ones and renumber the troves through
+    # `renumber` (old id -> new id); versions start over.
+    def compact(self, renumber):
+        critical, ids, versions = self._critical, self._ids, self._versions
+        if self._pending:
+            critical, ids, versions = (np.concatenate(pair) for pair in zip((critical, ids, versions), self._pending_entries()))
+        valid = self._version[ids] == versions
+        critical, ids = critical[valid], ids[valid]
+        order = np.argsort(critical, kind="stable")
+        self._critical = critical[order]
+        self._ids = np.asarray(renumber, dtype=np.int64)[ids[order]]
+        self._versions = np.zeros(len(order), dtype=np.int64)
+        self._version = np.zeros(len(order), dtype=np.int64)
+        self._pending = []
+        self._n_pending = 0
+        self._stale = 0
+
+    # Ids of the troves whose key may be above `price`.
+    def above(self, price):
+        threshold = price - abs(price) * self.margin
+        start = np.searchsorted(self._critical, threshold, side="left")
+        ids, versions = self._ids[start:], self._versions[start:]
+        if self._pending:
+            critical, pending_ids, pending_versions = self._pending_entries()
+            hit = critical >= threshold
+            ids = np.concatenate((ids, pending_ids[hit]))
+            versions = np.concatenate((versions, pending_versions[hit]))
+        return ids[self._version[ids] == versions]
+
+
+# Structure-of-arrays trove book.
+# Every column lives in its own preallocated float array; only the first `len(book)`
+# entries are live. Appends grow the arrays geometrically (amortized O(1) per trove),
+# removals either compact the live rows in order (one O(n) pass per batch) or swap
+# the last row into the hole (O(1), order not preserved).
+#
+# Each trove also carries a hidden id, and PriceIndexes over the ids find with a binary
+# search the liquidatable troves (see liquidatable()) and, when the book has the
+# CR_initial and Rational_inattention columns, the troves whose inattention band the
+# iBGT price has left (see outside_bands()). The indexes follow Supply, iBGT_Quantity,
+# CR_initial and Rational_inattention through append/remove/update/redeem and
+# whole-column assignment; after writing those columns in place through a view, call
+# reindex().
+#
+# set_ratios() leaves the CR_current of the troves that did not move to be computed
+# from the price when the column is next read (or rows move), so an adjustment step
+# only writes the troves it visits.
+# The per-trove passes of liquidatable() and redeem() run on `kernels` (kernels.py).
+class TroveBook:
+    growth_factor = 2
+
+    def __init__(self, capacity=1024, columns=TROVE_COLUMNS, liquidation_ratio=LIQUIDATION_RATIO, kernels=None):
+        self.columns = tuple(columns)
+        self.liquidation_ratio = liquidation_ratio
+        self.kernels = load_kernels(kernels)
+        self._size = 0
+        self._data = {c: np.empty(max(1, capacity)) for c in self.columns}
+        self._ids = np.empty(max(1, capacity), dtype=np.int64)
+        self._positions = np.empty(max(1, capacity), dtype=np.int64)
+        self._next_id = 0
+        #critical price, then with the band columns the lower trigger and minus the upper one
+        banded = {"CR_initial", "Rational_inattention"} <= set(self.columns)
+        self._indexes = [PriceIndex() for _ in range(3 if banded else 1)]
+        #(price, rows, exact rows) of CR_current still to be filled in, see set_ratios()
+        self._deferred = None
+
+    @classmethod
+    def from_frame(cls, frame, kernels=None):
+        return cls.from_columns({c: frame[c].to_numpy(dtype=float) for c in TROVE_COLUMNS}, kernels)
+
+    # A book holding the troves given as {column: array}, in that row order.
+    @classmethod
+    def from_columns(cls, columns, kernels=None):
+        book = cls(capacity=len(next(iter(columns.values()))), columns=tuple(columns), kernels=kernels)
+        book.append(**columns)
+        return book
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def shape(self):
+        return (self._size, len(self.columns))
+
+    @property
+    def capacity(self):
+        return len(self._data[self.columns[0]])
+
+    # Column access returns a view on the live rows, so in-place writes reach the book.
+    def __getitem__(self, column):
+        if column == "CR_current" and self._deferred is not None:
+            self._fill_ratios()
+        return self._data[column][:self._size]
+
+    def __setitem__(self, column, value):
+        if column == "CR_current":
+            self._deferred = None
+        elif column in INDEXED_COLUMNS:
+            self._fill_ratios()
+        self._data[column][:self._size] = value
+        if column in INDEXED_COLUMNS:
+            self.reindex()
+
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(capacity, self.growth_factor * self.capacity)
+        for c in self.columns:
+            grown = np.empty(new_capacity)
+            grown[:self._size] = self._data[c][:self._size]
+            self._data[c] = grown
+        ids = np.empty(new_capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._ids = ids
+
+    # Keys of `rows` in each of the indexes.
+    def _keys(self, rows=slice(None)):
+        supply, quantity = self._data["Supply"][:self._size][rows], self._data["iBGT_Quantity"][:self._size][rows]
+        keys = [critical_price(supply, quantity, self.liquidation_ratio)]
+        if len(self._indexes) > 1:
+            lower, upper = band_prices(supply, quantity, self["CR_initial"][rows], self["Rational_inattention"][rows])
+            keys += [lower, -upper]
+        return keys
+
+    def _compact(self):
+        if any(index.crowded() for index in self._indexes):
+            for index in self._indexes:
+                index.compact(self._positions)
+            self._renumber()
+
+    def _place(self, ids, rows):
+        top = int(ids.max()) + 1 if len(ids) else 0
+        if top > len(self._positions):
+            grown = np.empty(max(top, self.growth_factor * len(self._positions)), dtype=np.int64)
+            grown[:len(self._positions)] = self._positions
+            self._positions = grown
+        self._positions[ids] = rows
+
+    # Renumber the troves 0..n-1 in row order, compacting the id space.
+    def _renumber(self):
+        self._ids[:self._size] = np.arange(self._size)
+        self._next_id = self._size
+        self._place(self._ids[:self._size], np.arange(self._size))
+
+    # Rebuild the indexes from the Supply, iBGT_Quantity and band columns.
+    def reindex(self):
+        for index, keys in zip(self._indexes, self._keys()):
+            index.reset(keys)
+        self._renumber()
+
+    # Append one trove (scalars) or a batch of troves (equal-length arrays).
+    def append(self, **row):
+        missing = set(self.columns) - set(row)
+        if missing:
+            raise KeyError(f"missing trove columns: {sorted(missing)}")
+        sizes = [np.size(v) for v in row.values() if np.ndim(v) > 0]
+        n = int(sizes[0]) if sizes else 1
+        start = self._size
+        self.reserve(start + n)
+        for c in self.columns:
+            self._data[c][start:start + n] = row[c]
+        self._size = start + n
+        rows = np.arange(start, start + n)
+        ids = np.arange(self._next_id, self._next_id + n)
+        self._next_id += n
+        self._ids[rows] = ids
+        self._place(ids, rows)
+        for index, keys in zip(self._indexes, self._keys(rows)):
+            index.add(ids, keys)
+        return rows
+
+    # Write columns for the given rows (positions or a boolean mask); the indexes
+    # follow changes to Supply, iBGT_Quantity and the band columns.
+    def update(self, rows, **columns):
+        indexed = not INDEXED_COLUMNS.isdisjoint(columns)
+        if self._deferred is not None and (indexed or "CR_current" in columns):
+            self._settle_ratios(rows)
+        for c, value in columns.items():
+            self._data[c][:self._size][rows] = value
+        if indexed:
+            ids = self._ids[:self._size][rows]
+            for index, keys in zip(self._indexes, self._keys(rows)):
+                index.update(ids, keys)
+
+    # Rows whose collateral ratio at iBGT price `price` is below the liquidation ratio,
+    # in row order. Only the troves with a critical price above `price` are examined.
+    def liquidatable(self, price):
+        self._compact()
+        rows = np.sort(self._positions[self._indexes[0].above(price)])
+        return self.kernels.below_ratio(rows, float(price), self["iBGT_Quantity"], self["Supply"], self.liquidation_ratio)
+
+    # Rows whose adjustment check may be outside [-1, 2] at iBGT price `price`, in row
+    # order: the troves whose inattention band the price has left, found by two binary
+    # searches instead of a pass over the book. Confirm them on their exact check
+    # (kernels adjust). Without the band columns every row is returned.
+    def outside_bands(self, price):
+        if len(self._indexes) == 1:
+            return np.arange(self._size)
+        self._compact()
+        ids = np.concatenate((self._indexes[1].above(price), self._indexes[2].above(-price)))
+        return np.unique(self._positions[ids])
+
+    # CR_current of the adjustment check at iBGT price `price`: `values` for `rows`, and
+    # price*iBGT_Quantity/Supply for every other trove in the book now. The other troves
+    # are only filled in when CR_current is read, rows move or their Supply or
+    # iBGT_Quantity change, so this costs O(len(rows)) rather than O(n).
+    def set_ratios(self, price, rows, values):
+        rows = np.asarray(rows, dtype=np.int64)
+        self._data["CR_current"][rows] = values
+        self._deferred = (float(price), self._size, np.unique(rows))
+
+    # Fill in the deferred CR_current of `rows` that are not exact yet, and mark them exact.
+    def _settle_ratios(self, rows):
+        price, n, exact = self._deferred
+        rows = np.asarray(rows)
+        rows = np.flatnonzero(rows) if rows.dtype == bool else rows.astype(np.int64).ravel()
+        rows = rows[(rows >= 0) & (rows < n)]
+        found = np.minimum(np.searchsorted(exact, rows), max(len(exact) - 1, 0))
+        if len(exact):
+            rows = rows[exact[found] != rows]
+        if len(rows):
+            self._data["CR_current"][rows] = price * self._data["iBGT_Quantity"][rows] / self._data["Supply"][rows]
+            self._deferred = (price, n, np.union1d(exact, rows))
+
+    def _fill_ratios(self):
+        if self._deferred is None:
+            return
+        price, n, exact = self._deferred
+        self._deferred = None
+        CR_current = self._data["CR_current"]
+        kept = CR_current[exact]
+        CR_current[:n] = price * self._data["iBGT_Quantity"][:n] / self._data["Supply"][:n]
+        CR_current[exact] = kept
+
+    # Remove rows given as positions or a boolean mask, keeping the survivors in order.
+    def remove(self, rows):
+        keep = np.ones(self._size, dtype=bool)
+        keep[rows] = False
+        n = int(keep.sum())
+        if n == self._size:
+            return 0
+        self._fill_ratios()
+        for c in self.columns:
+            live = self._data[c][:self._size]
+            self._data[c][:n] = live[keep]
+        ids = self._ids[:self._size]
+        for index in self._indexes:
+            index.discard(ids[~keep])
+        self._ids[:n] = ids[keep]
+        self._positions[self._ids[:n]] = np.arange(n)
+        removed = self._size - n
+        self._size = n
+        return removed
+
+    # O(1) removal of a single row; the last row takes its place.
+    def swap_remove(self, row):
+        if row < 0:
+            row += self._size
+        if not 0 <= row < self._size:
+            raise IndexError(f"trove {row} out of range")
+        last = self._size - 1
+        self._fill_ratios()
+        for c in self.columns:
+            self._data[c][row] = self._data[c][last]
+        for index in self._indexes:
+            index.discard(self._ids[row:row + 1])
+        self._ids[row] = self._ids[last]
+        self._positions[self._ids[row]] = row
+        self._size = last
+
+    def clear(self):
+        self._size = 0
+        self._deferred = None
+        self.reindex()
+
+    # Reorder the live rows in place by `column` (stable for ties).
+    def sort_by(self, column, ascending=True):
+        self._fill_ratios()
+        order = np.argsort(self[column], kind="stable")
+        if not ascending:
+            order = order[::-1]
+        for c in self.columns:
+            self._data[c][:self._size] = self._data[c][:self._size][order]
+        self._ids[:self._size] = self._ids[:self._size][order]
+        self._positions[self._ids[:self._size]] = np.arange(self._size)
+        return order
+
+    # Redeem `amount` of NECT against the riskiest troves at iBGT price `price`.
+    # The book is ordered by CR_current and one walk over the cumulative supply finds
+    # the prefix of troves that is fully redeemed; those are removed in bulk and the
+    # residual is taken from the next trove, which ends up in row 0.
+    # The rows are put in CR order, not just indexed by it: the model's draws follow the
+    # row order, and the original model kept the sorted frame. A book still in order is
+    # not rewritten, and the stable sort runs in about linear time on one that is
+    # mostly in order.
+    # Returns [n_redempt, residual, unfilled], where `unfilled` is the part of `amount`
+    # left over when the whole book is redeemed.
+    def redeem(self, amount, price):
+        CR_current = self["CR_current"]
+        if not (CR_current[1:] >= CR_current[:-1]).all():
+            self.sort_by("CR_current")
+        n_redempt, redempted = self.kernels.redeem_walk(self["Supply"], amount)
+        n_redempt = int(n_redempt)
+        if n_redempt == self._size:
+            unfilled = amount - redempted if self._size else amount
+            self.clear()
+            return [n_redempt, 0, unfilled]
+
+        residual = amount - redempted
+        self.remove(np.arange(n_redempt))
+
+        supply = self["Supply"][0] - residual
+        quantity = self["iBGT_Quantity"][0] - residual/price
+        self.update([0], Supply=supply, iBGT_Quantity=quantity, CR_current=price * quantity / supply)
+        return [n_redempt, residual, 0]
+
+    def row(self, i):
+        self._fill_ratios()
+        return {c: float(self._data[c][i]) for c in self.columns}
+
+    def to_frame(self):
+        import pandas as pd
+
+        return pd.DataFrame({c: self[c].copy() for c in self.columns})
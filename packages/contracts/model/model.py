@@ -1,5 +1,6 @@
+import argparse
+
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 
@@ -69,7 +70,7 @@ def get_new_redeemed_amount(data, params):
         return max(redeemed, max_redeemable)
 
 # Decay base fee correctly
-def get_new_base_fee(data, redeemed_amount):
+def get_new_base_fee(data, params, redeemed_amount):
     if data.token_supply[-1] == 0:
         return 0
 
@@ -91,7 +92,6 @@ def get_new_token_price(data, params, redeemed_amount, momentum):
     T = params.T
 
     factor = - 1 /(A + T)
-    print(f'factor: {factor}')
     # price = (data.trove_issuance[-1] - data.token_demand[-1] - ((A + T) * data.token_price[-1]) + ((B + F) * momentum) - redeemed_amount) * factor 
     price = (data.trove_issuance[-1] - data.innate_token_demand - (A * data.token_price[-1] )  -T + ((B + F) * momentum) - redeemed_amount) * factor 
 
@@ -159,89 +159,111 @@ def quadratic_iBGT_price(scale, i):
 
 def sublinear_iBGT_price(last_price, steepness, i):
     return last_price + 1/(2*np.sqrt(steepness*(i+1)))
-    
-
-# ### Script
-
-params = ModelParams() 
-data = Data() # initialize data timeseries
 
-for i in range(1, 100):
-    # update exogenous iBGT price
-    last_iBGT_price =  data.iBGT_price[-1]
 
-    # iBGT_price = last_iBGT_price
-    # iBGT_price = randomwalk_iBGT_price(last_iBGT_price)
-    # iBGT_price = oscillating_iBGT_price(500, 10, i)
-    # iBGT_price = quadratic_iBGT_price(10, i)
-    # iBGT_price = linear_increasing_iBGT_price(last_iBGT_price, 100)
-    # iBGT_price = linear_decreasing_iBGT_price(last_iBGT_price, 1)
-    iBGT_price = sublinear_iBGT_price(last_iBGT_price, 10, i)
-    
-    # print(iBGT_price)
-
-    momentum = get_new_momentum(data, params, iBGT_price)
-    redeemed_amount = get_new_redeemed_amount(data, params)
-    base_fee = get_new_base_fee(data, redeemed_amount)
-
-    data.innate_token_demand = get_innate_token_demand()
+# iBGT price paths to run the model on, as functions of (last price, step)
+PRICE_PATHS = {
+    "constant": lambda last_price, i: constant_iBGT_price(last_price),
+    "randomwalk": lambda last_price, i: randomwalk_iBGT_price(last_price),
+    "oscillating": lambda last_price, i: oscillating_iBGT_price(500, 10, i),
+    "quadratic": lambda last_price, i: quadratic_iBGT_price(10, i),
+    "linear_increasing": lambda last_price, i: linear_increasing_iBGT_price(last_price, 100),
+    "linear_decreasing": lambda last_price, i: linear_decreasing_iBGT_price(last_price, 1),
+    "sublinear": lambda last_price, i: sublinear_iBGT_price(last_price, 10, i),
+}
 
-    # clear the market
-    token_price = get_new_token_price(data, params, redeemed_amount, momentum)
+# ### Script
 
-    token_demand = get_new_token_demand(data, params, token_price, momentum)
-    trove_issuance = get_new_trove_issuance(data, params, token_price, momentum)
-    token_supply = get_new_token_supply(trove_issuance, redeemed_amount)
-    
-    # display all new data
-    print(f'step: {i}')
-    print(f'iBGT price: {iBGT_price}')
-    print(f'momentum: {momentum}')
-    print(f'redeemed amount: {redeemed_amount}')
-    print(f'base fee: {base_fee}')
-    print(f'token price: {token_price}')
-    print(f'token demand: {token_demand}')
-    print(f'trove_issuance: {trove_issuance}')
-    print(f'token_supply: {token_supply}')
-
-    # update all time series
-    data.iBGT_price.append(iBGT_price)
-    data.momentum.append(momentum)
-    data.redeemed_amount.append(redeemed_amount)
-    data.base_fee.append(base_fee)
-    data.token_price.append(token_price)
-    data.token_demand.append(token_demand)
-    data.trove_issuance.append(trove_issuance)
-    data.token_supply.append(token_supply)
-
-# print(f'length redeemed amt is  + {len(data.redeemed_amount)}')
-# print(*data.redeemed_amount)
-# print(*data.base_fee)
-# print(*data.token_price)
-# print(*data.momentum)
-
-# Plot results
-
-fig = plt.figure()
-ax1 = fig.add_subplot(221)
-ax1.set_title('Token price')
-plt.plot(data.token_price)
-
-ax2 = fig.add_subplot(222)
-ax2.set_title('Redeemed amount')
-plt.plot(data.redeemed_amount)
-
-ax3 = fig.add_subplot(223)
-ax3.set_title('iBGT Price')
-plt.plot(data.iBGT_price)
-
-ax4 = fig.add_subplot(224)
-ax4.set_title('Base Fee')
-plt.plot(data.base_fee)
-
-
-# plt.plot(data.momentum)
-# plt.plot(data.token_demand)
-
-
-plt.show()
\ No newline at end of file
+# Run the model on the iBGT price path `price` (a key of PRICE_PATHS) until the time
+# series hold `steps` values; importing this module runs nothing.
+def simulate(params=None, steps=100, price="sublinear", verbose=True):
+    params = params or ModelParams()
+    data = Data() # initialize data timeseries
+    iBGT_price_path = PRICE_PATHS[price]
+
+    for i in range(1, steps):
+        # update exogenous iBGT price
+        last_iBGT_price =  data.iBGT_price[-1]
+        iBGT_price = iBGT_price_path(last_iBGT_price, i)
+
+        momentum = get_new_momentum(data, params, iBGT_price)
+        redeemed_amount = get_new_redeemed_amount(data, params)
+        base_fee = get_new_base_fee(data, params, redeemed_amount)
+
+        data.innate_token_demand = get_innate_token_demand()
+
+        # clear the market
+        token_price = get_new_token_price(data, params, redeemed_amount, momentum)
+
+        token_demand = get_new_token_demand(data, params, token_price, momentum)
+        trove_issuance = get_new_trove_issuance(data, params, token_price, momentum)
+        token_supply = get_new_token_supply(trove_issuance, redeemed_amount)
+
+        # display all new data
+        if verbose:
+            print(f'factor: {- 1 /(params.A + params.T)}')
+            print(f'step: {i}')
+            print(f'iBGT price: {iBGT_price}')
+            print(f'momentum: {momentum}')
+            print(f'redeemed amount: {redeemed_amount}')
+            print(f'base fee: {base_fee}')
+            print(f'token price: {token_price}')
+            print(f'token demand: {token_demand}')
+            print(f'trove_issuance: {trove_issuance}')
+            print(f'token_supply: {token_supply}')
+
+        # update all time series
+        data.iBGT_price.append(iBGT_price)
+        data.momentum.append(momentum)
+        data.redeemed_amount.append(redeemed_amount)
+        data.base_fee.append(base_fee)
+        data.token_price.append(token_price)
+        data.token_demand.append(token_demand)
+        data.trove_issuance.append(trove_issuance)
+        data.token_supply.append(token_supply)
+
+    return data
+
+# Plot results; matplotlib is imported here so the model itself imports without it
+def plot(data):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    ax1 = fig.add_subplot(221)
+    ax1.set_title('Token price')
+    plt.plot(data.token_price)
+
+    ax2 = fig.add_subplot(222)
+    ax2.set_title('Redeemed amount')
+    plt.plot(data.redeemed_amount)
+
+    ax3 = fig.add_subplot(223)
+    ax3.set_title('iBGT Price')
+    plt.plot(data.iBGT_price)
+
+    ax4 = fig.add_subplot(224)
+    ax4.set_title('Base Fee')
+    plt.plot(data.base_fee)
+
+    # plt.plot(data.momentum)
+    # plt.plot(data.token_demand)
+
+    plt.show()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the token price model on an iBGT price path")
+    parser.add_argument("--steps", type=int, default=100, help="length of the time series")
+    parser.add_argument("--price", choices=list(PRICE_PATHS), default="sublinear", help="iBGT price path")
+    parser.add_argument("--seed", type=int, default=None, help="numpy seed for the random walk")
+    parser.add_argument("--quiet", action="store_true", help="do not print every step")
+    parser.add_argument("--no-plot", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        np.random.seed(args.seed)
+    data = simulate(ModelParams(), args.steps, args.price, verbose=not args.quiet)
+    if not args.no_plot:
+        plot(data)
+
+if __name__ == "__main__":
+    main()
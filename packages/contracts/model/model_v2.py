@@ -1,5 +1,6 @@
+import argparse
+
 import numpy as np
-import matplotlib.pyplot as plt
 
 # model parameters
 class ModelParams:
@@ -64,7 +65,7 @@ def get_new_redeemed_amount(data, params):
        
 
 # Decay base fee correctly
-def get_new_base_fee(data, redeemed_amount):
+def get_new_base_fee(data, params, redeemed_amount):
     if data.token_supply[-1] == 0:
         return 0
 
@@ -83,7 +84,6 @@ def get_new_token_price(data, params, redeemed_amount, momentum):
     F = params.F
 
     factor =  1/T
-    print(f'factor: {factor}')
     price = (((data.token_demand  - redeemed_amount) / (data.trove_issuance[-1])) - (F * momentum)) * factor 
 
     if price < 0:
@@ -164,97 +164,132 @@ def quadratic_iBGT_price(min, scale, i):
 
 def sublinear_iBGT_price(last_price, steepness, i):
     return last_price + 1/(2*np.sqrt(steepness*(i+1)))
-    
-# ### Script
-
-# Initialize model parameters and data timeseries
-params = ModelParams() 
-data = Data()
-
-# Run the model
-for i in range(1, 250):
-    last_iBGT_price =  data.iBGT_price[-1]
 
-    # update exogenous iBGT price
 
-    # iBGT_price = last_iBGT_price
-    iBGT_price = randomwalk_iBGT_price(last_iBGT_price)
-    # iBGT_price = oscillating_iBGT_price(500, 100, i)
-    # iBGT_price = quadratic_iBGT_price(500, 10, i)
-    # iBGT_price = linear_increasing_iBGT_price(last_iBGT_price, 3)
-    # iBGT_price = linear_decreasing_iBGT_price(800, 1, i)
-    # iBGT_price = one_over_i_iBGT_price(1000, i)
-    # iBGT_price = sublinear_iBGT_price(last_iBGT_price, 10, i)
-    
-    momentum = get_new_momentum(data, params, iBGT_price)
-    redeemed_amount = get_new_redeemed_amount(data, params)
-    base_fee = get_new_base_fee(data, redeemed_amount)
-
-    data.token_demand = get_token_demand()
+# iBGT price paths to run the model on, as functions of (last price, step)
+PRICE_PATHS = {
+    "constant": lambda last_price, i: constant_iBGT_price(last_price),
+    "randomwalk": lambda last_price, i: randomwalk_iBGT_price(last_price),
+    "oscillating": lambda last_price, i: oscillating_iBGT_price(500, 100, i),
+    "quadratic": lambda last_price, i: quadratic_iBGT_price(500, 10, i),
+    "linear_increasing": lambda last_price, i: linear_increasing_iBGT_price(last_price, 3),
+    "linear_decreasing": lambda last_price, i: linear_decreasing_iBGT_price(800, 1, i),
+    "one_over_i": lambda last_price, i: one_over_i_iBGT_price(1000, i),
+    "sublinear": lambda last_price, i: sublinear_iBGT_price(last_price, 10, i),
+}
 
-    # clear the market
-    token_price = get_new_token_price(data, params, redeemed_amount, momentum)
-    token_demand = get_new_token_demand(data, params, token_price, momentum)
-    trove_issuance = get_new_trove_issuance(data, params, token_price, momentum)
-    token_supply = get_new_token_supply(trove_issuance, redeemed_amount)
-    
-    # if price > 1.1, correct it via the price ceiling and QTM
-    excess_issuance = get_excess_issuance(token_price, token_supply)
-    
-    if token_price > 1.1:
-        token_price = 1.1
+# ### Script
 
-    trove_issuance = trove_issuance + excess_issuance
-    token_supply = get_new_token_supply(trove_issuance, 0)
-    
-    # Log all new values
-    print(f'step: {i}')
-    print(f'iBGT price: {iBGT_price}')
-    print(f'momentum: {momentum}')
-    print(f'redeemed amount: {redeemed_amount}')
-    print(f'base fee: {base_fee}')
-    print(f'token price: {token_price}')
-    print(f'token demand: {token_demand}')
-    print(f'trove_issuance: {trove_issuance}')
-    print(f'token_supply: {token_supply}')
-
-    # update all timeseries arrays
-    data.iBGT_price.append(iBGT_price)
-    data.momentum.append(momentum)
-    data.redeemed_amount.append(redeemed_amount)
-    data.base_fee.append(base_fee)
-    data.token_price.append(token_price)
-    data.token_demand = token_demand
-    data.trove_issuance.append(trove_issuance)
-    data.token_supply.append(token_supply)
+# Run the model on the iBGT price path `price` (a key of PRICE_PATHS) until the time
+# series hold `steps` values; importing this module runs nothing.
+def simulate(params=None, steps=250, price="randomwalk", verbose=True):
+    # Initialize model parameters and data timeseries
+    params = params or ModelParams()
+    data = Data()
+    iBGT_price_path = PRICE_PATHS[price]
+
+    # Run the model
+    for i in range(1, steps):
+        last_iBGT_price =  data.iBGT_price[-1]
+
+        # update exogenous iBGT price
+        iBGT_price = iBGT_price_path(last_iBGT_price, i)
+
+        momentum = get_new_momentum(data, params, iBGT_price)
+        redeemed_amount = get_new_redeemed_amount(data, params)
+        base_fee = get_new_base_fee(data, params, redeemed_amount)
+
+        data.token_demand = get_token_demand()
+
+        # clear the market
+        token_price = get_new_token_price(data, params, redeemed_amount, momentum)
+        token_demand = get_new_token_demand(data, params, token_price, momentum)
+        trove_issuance = get_new_trove_issuance(data, params, token_price, momentum)
+        token_supply = get_new_token_supply(trove_issuance, redeemed_amount)
+
+        # if price > 1.1, correct it via the price ceiling and QTM
+        excess_issuance = get_excess_issuance(token_price, token_supply)
+
+        if token_price > 1.1:
+            token_price = 1.1
+
+        trove_issuance = trove_issuance + excess_issuance
+        token_supply = get_new_token_supply(trove_issuance, 0)
+
+        # Log all new values
+        if verbose:
+            print(f'factor: {1/params.T}')
+            print(f'step: {i}')
+            print(f'iBGT price: {iBGT_price}')
+            print(f'momentum: {momentum}')
+            print(f'redeemed amount: {redeemed_amount}')
+            print(f'base fee: {base_fee}')
+            print(f'token price: {token_price}')
+            print(f'token demand: {token_demand}')
+            print(f'trove_issuance: {trove_issuance}')
+            print(f'token_supply: {token_supply}')
+
+        # update all timeseries arrays
+        data.iBGT_price.append(iBGT_price)
+        data.momentum.append(momentum)
+        data.redeemed_amount.append(redeemed_amount)
+        data.base_fee.append(base_fee)
+        data.token_price.append(token_price)
+        data.token_demand = token_demand
+        data.trove_issuance.append(trove_issuance)
+        data.token_supply.append(token_supply)
+
+    return data
 
 ### Graph the results
-
-fig = plt.figure()
-ax1 = fig.add_subplot(221)
-ax1.set_title('Token price')
-plt.ylim(0.0, 1.5)
-plt.plot(data.token_price)
-
-ax2 = fig.add_subplot(222)
-ax2.set_title('Redeemed amount')
-plt.ylim(0.0, 10)
-plt.plot(data.redeemed_amount)
-
-ax3 = fig.add_subplot(223)
-ax3.set_title('iBGT Price')
-plt.ylim(0, 1000)
-plt.plot(data.iBGT_price)
-
-ax4 = fig.add_subplot(224)
-ax4.set_title('Base fee')
-plt.ylim(0.0, 0.05)
-plt.plot(data.base_fee)
-
-# plt.plot(data.momentum)
-# plt.plot(data.token_demand)
-
-params_string = f'Parameters:  D={params.D}  T={params.T}  F={params.F}  L={params.lookback}  r_max={params.max_redemption_fraction}'
-plt.figtext(0.5, 0.05, params_string, ha="center", fontsize=10)
-
-plt.show()
\ No newline at end of file
+# matplotlib is imported here so the model itself imports without it
+def plot(data, params):
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    ax1 = fig.add_subplot(221)
+    ax1.set_title('Token price')
+    plt.ylim(0.0, 1.5)
+    plt.plot(data.token_price)
+
+    ax2 = fig.add_subplot(222)
+    ax2.set_title('Redeemed amount')
+    plt.ylim(0.0, 10)
+    plt.plot(data.redeemed_amount)
+
+    ax3 = fig.add_subplot(223)
+    ax3.set_title('iBGT Price')
+    plt.ylim(0, 1000)
+    plt.plot(data.iBGT_price)
+
+    ax4 = fig.add_subplot(224)
+    ax4.set_title('Base fee')
+    plt.ylim(0.0, 0.05)
+    plt.plot(data.base_fee)
+
+    # plt.plot(data.momentum)
+    # plt.plot(data.token_demand)
+
+    params_string = f'Parameters:  D={params.D}  T={params.T}  F={params.F}  L={params.lookback}  r_max={params.max_redemption_fraction}'
+    plt.figtext(0.5, 0.05, params_string, ha="center", fontsize=10)
+
+    plt.show()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the token price model on an iBGT price path")
+    parser.add_argument("--steps", type=int, default=250, help="length of the time series")
+    parser.add_argument("--price", choices=list(PRICE_PATHS), default="randomwalk", help="iBGT price path")
+    parser.add_argument("--seed", type=int, default=None, help="numpy seed for the random walk")
+    parser.add_argument("--quiet", action="store_true", help="do not print every step")
+    parser.add_argument("--no-plot", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        np.random.seed(args.seed)
+    params = ModelParams()
+    data = simulate(params, args.steps, args.price, verbose=not args.quiet)
+    if not args.no_plot:
+        plot(data, params)
+
+if __name__ == "__main__":
+    main()
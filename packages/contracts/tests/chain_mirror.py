@@ -0,0 +1,499 @@
+import heapq
+from bisect import bisect_left, bisect_right
+
+from brownie import Wei
+from brownie.network.transaction import TransactionReceipt
+
+from helpers import GLOBAL_STATE, ZERO_ADDRESS, read_global_state
+
+# troves read per MultiTroveGetter call
+TROVE_PAGE_SIZE = 200
+DECIMAL_PRECISION = 10**18
+NICR_PRECISION = 10**20
+ICR_MAX = 2**256 - 1
+# critical system collateral ratio: below it the system is in recovery mode
+CCR = 15 * 10**17
+# minimum collateral ratio, and the debt rules of BeraBorrowBase, in wei
+MCR = 11 * 10**17
+NECT_GAS_COMPENSATION = 200 * 10**18
+MIN_NET_DEBT = 1800 * 10**18
+# TroveManagerOperation.applyPendingRewards, the TroveUpdated that leaves SortedTroves as it is
+APPLY_PENDING_REWARDS = 0
+
+
+# Troves in sorted-list order (highest NICR first, or with from_tail=True lowest first) as
+# MultiTroveGetter returns them: (owner, debt, coll, stake, snapshot iBGT, snapshot NECT
+# debt), recorded amounts without pending rewards, read in pages of `page_size`.
+# Without `count`, the whole list.
+def _read_pages(contracts, count=None, from_tail=False, page_size=TROVE_PAGE_SIZE):
+    if count is None:
+        count = contracts.sortedTroves.getSize()
+    troves = []
+    for start in range(0, count, page_size):
+        #MultiTroveGetter counts negative start indices from the tail: -1 is the last trove
+        page = contracts.multiTroveGetter.getMultipleSortedTroves(-start - 1 if from_tail else start, min(page_size, count - start))
+        troves.extend(tuple(int(v) if k > 0 else v for k, v in enumerate(trove)) for trove in page)
+        if len(page) < page_size:
+            break
+    return troves
+
+# Pending redistribution reward of a stake, as TroveManager.getPendingiBGTReward and
+# getPendingNECTDebtReward compute it.
+def _pending(stake, L, snapshot):
+    return stake * (L - snapshot) // DECIMAL_PRECISION
+
+# Troves in sorted-list order (highest NICR first, or with from_tail=True lowest first) as
+# (owner, debt, coll) in wei, read through MultiTroveGetter in pages of `page_size`.
+# Debt and coll include the pending redistribution rewards, computed from the reward
+# snapshots as TroveManager.getEntireDebtAndColl does, so a read of n troves costs
+# 2 + n / page_size calls instead of one or two per trove. Without `count`, the whole list.
+def read_troves(contracts, count=None, from_tail=False, page_size=TROVE_PAGE_SIZE):
+    L_iBGT = int(contracts.troveManager.L_iBGT())
+    L_NECTDebt = int(contracts.troveManager.L_NECTDebt())
+    return [(owner, debt + _pending(stake, L_NECTDebt, snapshot_debt), coll + _pending(stake, L_iBGT, snapshot_ibgt))
+            for owner, debt, coll, stake, snapshot_ibgt, snapshot_debt in _read_pages(contracts, count, from_tail, page_size)]
+
+# {owner: (debt, coll)} of every trove, in wei.
+def read_trove_book(contracts, page_size=TROVE_PAGE_SIZE):
+    mirror = getattr(contracts, 'mirror', None)
+    if mirror is not None:
+        return mirror.trove_book()
+    return {owner: (debt, coll) for owner, debt, coll in read_troves(contracts, page_size=page_size)}
+
+# The `count` troves with the lowest NICR, lowest first, as (owner, debt, coll).
+def read_lowest_troves(contracts, count):
+    mirror = getattr(contracts, 'mirror', None)
+    if mirror is not None:
+        return mirror.lowest(count)
+    return read_troves(contracts, count, from_tail=True)
+
+# TroveManager.getCurrentICR from entire debt and coll (wei) and a price in wei.
+def compute_ICR(coll, debt, price):
+    return coll * price // debt if debt > 0 else ICR_MAX
+
+# TroveManager.getNominalICR, the key of the sorted list, from entire debt and coll (wei).
+def compute_NICR(coll, debt):
+    return coll * NICR_PRECISION // debt if debt > 0 else ICR_MAX
+
+# Reads the simulation makes every step, answered by `contracts.mirror` when the
+# contracts are watched (ChainMirror.watch) and by the contracts otherwise. All in wei.
+
+def trove_count(contracts):
+    mirror = getattr(contracts, 'mirror', None)
+    return mirror.size() if mirror is not None else contracts.sortedTroves.getSize()
+
+def nect_balance_of(contracts, account):
+    mirror = getattr(contracts, 'mirror', None)
+    return mirror.balance(account) if mirror is not None else contracts.nectToken.balanceOf(account)
+
+def nect_supply(contracts):
+    mirror = getattr(contracts, 'mirror', None)
+    return mirror.total_supply if mirror is not None else contracts.nectToken.totalSupply()
+
+def stability_pool_deposits(contracts):
+    mirror = getattr(contracts, 'mirror', None)
+    return mirror.pools["sp_deposits"] if mirror is not None else contracts.stabilityPool.getTotalNECTDeposits()
+
+def stability_pool_ibgt(contracts):
+    mirror = getattr(contracts, 'mirror', None)
+    return mirror.pools["sp_ibgt"] if mirror is not None else contracts.stabilityPool.getiBGT()
+
+# Initial value of an account's stability pool deposit (StabilityPool.deposits), not compounded.
+def stability_deposit(contracts, account):
+    mirror = getattr(contracts, 'mirror', None)
+    return mirror.deposit(account) if mirror is not None else contracts.stabilityPool.deposits(account)[0]
+
+def check_recovery_mode(contracts, price):
+    mirror = getattr(contracts, 'mirror', None)
+    return mirror.recovery_mode(int(price)) if mirror is not None else contracts.troveManager.checkRecoveryMode(price)
+
+def new_TCR(contracts, coll_change, is_coll_increase, debt_change, is_debt_increase, price):
+    mirror = getattr(contracts, 'mirror', None)
+    if mirror is not None:
+        return mirror.new_TCR(int(coll_change), is_coll_increase, int(debt_change), is_debt_increase, int(price))
+    return contracts.borrowerOperations.getNewTCRFromTroveChange(coll_change, is_coll_increase, debt_change, is_debt_increase, price)
+
+
+# Calls of a watched contract function: a transaction's events go to the mirror.
+class _WatchedCall:
+    def __init__(self, mirror, function):
+        self._mirror = mirror
+        self._function = function
+
+    def __call__(self, *args, **kwargs):
+        result = self._function(*args, **kwargs)
+        if isinstance(result, TransactionReceipt):
+            self._mirror.apply(result)
+        return result
+
+    def __getattr__(self, attribute):
+        return getattr(self._function, attribute)
+
+
+class _WatchedContract:
+    def __init__(self, mirror, contract):
+        self._mirror = mirror
+        self._contract = contract
+
+    def __getattr__(self, attribute):
+        value = getattr(self._contract, attribute)
+        if callable(value):
+            return _WatchedCall(self._mirror, value)
+        return value
+
+
+class _Watched:
+    pass
+
+
+# The mirror's sorted list as an ascending sequence of -NICR, for bisect: the NICRs
+# include the pending rewards, so they are computed when looked up rather than stored.
+class _NegatedNICRs:
+    __slots__ = ("mirror",)
+
+    def __init__(self, mirror):
+        self.mirror = mirror
+
+    def __len__(self):
+        return len(self.mirror.order)
+
+    def __getitem__(self, i):
+        return -self.mirror.NICR(self.mirror.order[i])
+
+
+# Python-side copy of the chain state the simulation reads: troves (recorded debt, coll,
+# stake and reward snapshots), the L terms and system snapshots, the active, default and
+# stability pool totals, NECT balances and supply, and stability pool deposits.
+# It follows the events of every transaction sent through the contracts returned by
+# watch() (TroveUpdated, LTermsUpdated, the pools' balance updates, NECT Transfer,
+# UserDepositChanged, ...), so the simulation answers its reads from memory: the TCR and
+# recovery mode, a trove's entire debt and coll, the lowest troves by NICR, balances. A
+# mirror made before the first transaction needs no reads at all; otherwise sync() loads
+# the current state. check() compares the mirror with the chain, a periodic consistency
+# check.
+#
+# It also keeps the order of SortedTroves (`order`, highest NICR first), so insert_hints()
+# and redemption_hints() give the exact hints HintHelpers and findInsertPosition would,
+# without calls. A trove goes where valid hints put it on chain, the last position among
+# equal NICRs: SortedTroves.reInsert takes the trove out and inserts it again on every
+# adjustment and partial redemption, even when its NICR is unchanged, and so does the
+# mirror. Only applying pending rewards, which moves nothing in SortedTroves, leaves a
+# trove in place.
+#
+# The NECT balances of `holders` (the accounts the simulation signs for) are also kept in a
+# max-heap, so donors() finds the largest holders for a transfer or a deposit in
+# O(log n) each instead of a balanceOf per account.
+#
+# Transactions sent some other way are not seen; call sync() after them.
+class ChainMirror:
+    def __init__(self, contracts, holders=()):
+        self.holders = {account.address: account for account in holders}
+        self.addresses = {name: getattr(contracts, name).address
+                          for name in ("troveManager", "nectToken", "stabilityPool", "activePool", "defaultPool")}
+        self._handlers = {
+            "TroveUpdated": self._trove_updated,
+            "LTermsUpdated": self._L_terms_updated,
+            "SystemSnapshotsUpdated": self._system_snapshots_updated,
+            "ActivePoolNECTDebtUpdated": lambda e: self._set_pool("active_debt", e["_NECTDebt"]),
+            "ActivePooliBGTBalanceUpdated": lambda e: self._set_pool("active_coll", e["_iBGT"]),
+            "DefaultPoolNECTDebtUpdated": lambda e: self._set_pool("default_debt", e["_NECTDebt"]),
+            "DefaultPooliBGTBalanceUpdated": lambda e: self._set_pool("default_coll", e["_iBGT"]),
+            "StabilityPoolNECTBalanceUpdated": lambda e: self._set_pool("sp_deposits", e["_newBalance"]),
+            "StabilityPooliBGTBalanceUpdated": lambda e: self._set_pool("sp_ibgt", e["_newBalance"]),
+            "UserDepositChanged": self._deposit_changed,
+            "Transfer": self._transfer,
+        }
+        self._keys = _NegatedNICRs(self)
+        self.reset()
+
+    def reset(self):
+        #owner: [debt, coll, stake, snapshot iBGT, snapshot NECT debt], recorded without pending rewards
+        self.troves = {}
+        #owners in the order of SortedTroves, highest NICR first
+        self.order = []
+        self.L_iBGT = 0
+        self.L_NECTDebt = 0
+        self.total_stakes_snapshot = 0
+        self.total_collateral_snapshot = 0
+        self.pools = dict.fromkeys(("active_debt", "active_coll", "default_debt", "default_coll", "sp_deposits", "sp_ibgt"), 0)
+        self.balances = {}
+        #(-balance, address) of the holders, with stale entries left in until they reach the top
+        self._heap = []
+        self.total_supply = 0
+        self.deposits = {}
+
+    # `contracts` with every transaction sent through it applied to this mirror, which
+    # the simulation finds as `contracts.mirror`.
+    def watch(self, contracts):
+        watched = _Watched()
+        for name, contract in vars(contracts).items():
+            setattr(watched, name, _WatchedContract(self, contract))
+        watched.mirror = self
+        return watched
+
+    # Apply the events of a mined transaction, in log order.
+    def apply(self, tx):
+        if tx.status != 1:
+            return
+        for event in tx.events:
+            handler = self._handlers.get(event.name)
+            if handler is not None:
+                handler(event)
+
+    # BorrowerOperations names the stake field `stake`, TroveManager (liquidations,
+    # redemptions, applyPendingRewards) `_stake`.
+    def _trove_updated(self, event):
+        borrower = event["_borrower"]
+        debt, coll = int(event["_debt"]), int(event["_coll"])
+        stake = int(event["_stake"] if "_stake" in event else event["stake"])
+        listed = borrower in self.troves
+        if debt == 0 and coll == 0:
+            if listed:
+                del self.order[self._position(borrower)]
+                del self.troves[borrower]
+            return
+        reinserted = not (event.address == self.addresses["troveManager"] and int(event["_operation"]) == APPLY_PENDING_REWARDS)
+        if listed and reinserted:
+            del self.order[self._position(borrower)]
+            listed = False
+        #every update applies the pending rewards first, so the snapshots are the current L terms
+        self.troves[borrower] = [debt, coll, stake, self.L_iBGT, self.L_NECTDebt]
+        if not listed:
+            self.order.insert(bisect_right(self._keys, -compute_NICR(coll, debt)), borrower)
+
+    def _L_terms_updated(self, event):
+        self.L_iBGT = int(event["_L_iBGT"])
+        self.L_NECTDebt = int(event["_L_NECTDebt"])
+
+    def _system_snapshots_updated(self, event):
+        self.total_stakes_snapshot = int(event["_totalStakesSnapshot"])
+        self.total_collateral_snapshot = int(event["_totalCollateralSnapshot"])
+
+    def _set_pool(self, pool, value):
+        self.pools[pool] = int(value)
+
+    def _deposit_changed(self, event):
+        deposit = int(event["_newDeposit"])
+        if deposit == 0:
+            self.deposits.pop(event["_depositor"], None)
+        else:
+            self.deposits[event["_depositor"]] = deposit
+
+    def _transfer(self, event):
+        if event.address != self.addresses["nectToken"]:
+            return
+        sender, recipient, value = event["from"], event["to"], int(event["value"])
+        if sender == ZERO_ADDRESS:
+            self.total_supply += value
+        else:
+            self._set_balance(sender, self.balances.get(sender, 0) - value)
+        if recipient == ZERO_ADDRESS:
+            self.total_supply -= value
+        else:
+            self._set_balance(recipient, self.balances.get(recipient, 0) + value)
+
+    def _set_balance(self, address, balance):
+        self.balances[address] = balance
+        if address in self.holders and balance > 0:
+            heapq.heappush(self._heap, (-balance, address))
+            #every transfer leaves a stale entry behind; rebuild once they outnumber the holders
+            if len(self._heap) > 2 * len(self.holders) + 64:
+                self._heap = [(-self.balances[a], a) for a in self.holders if self.balances.get(a, 0) > 0]
+                heapq.heapify(self._heap)
+
+    # Load the state from the chain: the troves in pages, the pool totals, the NECT
+    # balances of the holders and of `accounts`, and the SP deposits of `accounts` (other
+    # balances and deposits read as 0 afterwards).
+    def sync(self, contracts, accounts=()):
+        self.reset()
+        self.L_iBGT = int(contracts.troveManager.L_iBGT())
+        self.L_NECTDebt = int(contracts.troveManager.L_NECTDebt())
+        self.total_stakes_snapshot = int(contracts.troveManager.totalStakesSnapshot())
+        self.total_collateral_snapshot = int(contracts.troveManager.totalCollateralSnapshot())
+        for owner, *trove in _read_pages(contracts):
+            self.troves[owner] = list(trove)
+            self.order.append(owner)
+        self.pools = self._chain_pools(contracts)
+        self.total_supply = int(contracts.nectToken.totalSupply())
+        for address in {getattr(account, "address", account) for account in accounts} | set(self.holders) | {self.addresses["stabilityPool"]}:
+            self._set_balance(address, int(contracts.nectToken.balanceOf(address)))
+        for account in accounts:
+            deposit = int(contracts.stabilityPool.deposits(account)[0])
+            if deposit > 0:
+                self.deposits[getattr(account, "address", account)] = deposit
+
+    def _chain_pools(self, contracts):
+        return {"active_debt": int(contracts.activePool.getNECTDebt()), "active_coll": int(contracts.activePool.getiBGT()),
+                "default_debt": int(contracts.defaultPool.getNECTDebt()), "default_coll": int(contracts.defaultPool.getiBGT()),
+                "sp_deposits": int(contracts.stabilityPool.getTotalNECTDeposits()), "sp_ibgt": int(contracts.stabilityPool.getiBGT())}
+
+    # Differences between the mirror and the chain, as readable lines; empty when they
+    # agree. Balances and deposits are compared for `accounts`.
+    def check(self, contracts, accounts=()):
+        problems = []
+
+        def compare(name, mirrored, chain):
+            if mirrored != chain:
+                problems.append(f"{name}: mirror {mirrored}, chain {chain}")
+
+        compare("L_iBGT", self.L_iBGT, int(contracts.troveManager.L_iBGT()))
+        compare("L_NECTDebt", self.L_NECTDebt, int(contracts.troveManager.L_NECTDebt()))
+        compare("totalStakesSnapshot", self.total_stakes_snapshot, int(contracts.troveManager.totalStakesSnapshot()))
+        compare("totalCollateralSnapshot", self.total_collateral_snapshot, int(contracts.troveManager.totalCollateralSnapshot()))
+        for pool, value in self._chain_pools(contracts).items():
+            compare(pool, self.pools[pool], value)
+        compare("NECT supply", self.total_supply, int(contracts.nectToken.totalSupply()))
+        if hasattr(contracts, "systemStateGetter"):
+            chain_state = read_global_state(contracts)
+            for name, mirrored, chain in zip(GLOBAL_STATE, self.global_state(int(chain_state[0] * DECIMAL_PRECISION)), chain_state):
+                compare(name.strip(), mirrored, chain)
+        chain_troves = {owner: (debt, coll) for owner, debt, coll in read_troves(contracts)}
+        compare("troves", len(self.troves), len(chain_troves))
+        for i, (mirrored, chain) in enumerate(zip(self.order, chain_troves)):
+            if mirrored != chain:
+                compare(f"sorted troves at {i}", mirrored, chain)
+                break
+        for owner in set(chain_troves) | set(self.troves):
+            compare(f"trove {owner}", self.trove(owner), chain_troves.get(owner, (0, 0)))
+        for account in accounts:
+            address = getattr(account, "address", account)
+            compare(f"NECT balance {address}", self.balance(address), int(contracts.nectToken.balanceOf(address)))
+            compare(f"SP deposit {address}", self.deposit(address), int(contracts.stabilityPool.deposits(address)[0]))
+        return problems
+
+    # Reads, as the contracts would return them (wei).
+
+    def size(self):
+        return len(self.troves)
+
+    # Entire (debt, coll) of a trove, pending rewards included; (0, 0) without a trove.
+    def trove(self, owner):
+        trove = self.troves.get(getattr(owner, "address", owner))
+        if trove is None:
+            return (0, 0)
+        debt, coll, stake, snapshot_ibgt, snapshot_debt = trove
+        return (debt + _pending(stake, self.L_NECTDebt, snapshot_debt), coll + _pending(stake, self.L_iBGT, snapshot_ibgt))
+
+    def trove_book(self):
+        return {owner: self.trove(owner) for owner in self.troves}
+
+    def ICR(self, owner, price):
+        debt, coll = self.trove(owner)
+        return compute_ICR(coll, debt, price)
+
+    def NICR(self, owner):
+        debt, coll = self.trove(owner)
+        return compute_NICR(coll, debt)
+
+    # The `count` troves with the lowest NICR, lowest first, as (owner, debt, coll): the
+    # tail of the sorted list.
+    def lowest(self, count):
+        return [(owner, *self.trove(owner)) for owner in self.order[:-count - 1:-1]] if count > 0 else []
+
+    # Index of a listed trove in `order`: past the troves of higher NICR, then along the
+    # ones of equal NICR.
+    def _position(self, owner):
+        NICR = self.NICR(owner)
+        i = bisect_left(self._keys, -NICR)
+        while i < len(self.order) and self.NICR(self.order[i]) == NICR:
+            if self.order[i] == owner:
+                return i
+            i += 1
+        #the pending rewards round differently per trove, so the order can be off by a wei
+        return self.order.index(owner)
+
+    # (upper hint, lower hint) at which SortedTroves inserts a trove of nominal ICR `NICR`
+    # without searching: the troves it goes between. `owner` is the trove being
+    # re-inserted, which the contract takes out of the list first.
+    def insert_hints(self, NICR, owner=None):
+        order = self.order
+        i = bisect_right(self._keys, -NICR)
+        upper, lower = i - 1, i
+        if owner is not None:
+            if upper >= 0 and order[upper] == owner:
+                upper -= 1
+            if lower < len(order) and order[lower] == owner:
+                lower += 1
+        return (order[upper] if upper >= 0 else ZERO_ADDRESS, order[lower] if lower < len(order) else ZERO_ADDRESS)
+
+    # HintHelpers.getRedemptionHints(amount, price, max_iterations), plus the trove that
+    # would be redeemed partially (None without one), which redeemCollateral re-inserts:
+    # (first redemption hint, partial redemption hint NICR, truncated amount, partial trove).
+    def redemption_hints(self, amount, price, max_iterations=0):
+        position = len(self.order) - 1
+        while position >= 0 and self.ICR(self.order[position], price) < MCR:
+            position -= 1
+        first = self.order[position] if position >= 0 else ZERO_ADDRESS
+        remaining = amount
+        partial_NICR, partial = 0, None
+        iterations = max_iterations or ICR_MAX
+        while position >= 0 and remaining > 0 and iterations > 0:
+            iterations -= 1
+            owner = self.order[position]
+            debt, coll = self.trove(owner)
+            net_debt = debt - NECT_GAS_COMPENSATION
+            if net_debt > remaining:
+                if net_debt > MIN_NET_DEBT:
+                    redeemable = min(remaining, net_debt - MIN_NET_DEBT)
+                    partial_NICR = compute_NICR(coll - redeemable * DECIMAL_PRECISION // price,
+                                                net_debt - redeemable + NECT_GAS_COMPENSATION)
+                    partial = owner
+                    remaining -= redeemable
+                break
+            remaining -= net_debt
+            position -= 1
+        return (first, partial_NICR, amount - remaining, partial)
+
+    def entire_system_debt(self):
+        return self.pools["active_debt"] + self.pools["default_debt"]
+
+    def entire_system_coll(self):
+        return self.pools["active_coll"] + self.pools["default_coll"]
+
+    def TCR(self, price):
+        return compute_ICR(self.entire_system_coll(), self.entire_system_debt(), price)
+
+    def recovery_mode(self, price):
+        return self.TCR(price) < CCR
+
+    # BorrowerOperations.getNewTCRFromTroveChange
+    def new_TCR(self, coll_change, is_coll_increase, debt_change, is_debt_increase, price):
+        coll = self.entire_system_coll() + (coll_change if is_coll_increase else -coll_change)
+        debt = self.entire_system_debt() + (debt_change if is_debt_increase else -debt_change)
+        return compute_ICR(coll, debt, price)
+
+    def balance(self, owner):
+        return self.balances.get(getattr(owner, "address", owner), 0)
+
+    def deposit(self, owner):
+        return self.deposits.get(getattr(owner, "address", owner), 0)
+
+    # Holders to raise `amount` NECT (wei) from, largest balance first, as (account,
+    # amount) with each amount the holder's whole balance except for the last: the fewest
+    # transactions that cover it. Leaves out the addresses in `exclude`; falls short when
+    # the holders do not hold enough. The balances only change as the transfers are seen.
+    def donors(self, amount, exclude=()):
+        heap = self._heap
+        taken, chosen = set(), []
+        while amount > 0 and heap:
+            entry = heapq.heappop(heap)
+            balance, address = -entry[0], entry[1]
+            if balance != self.balances.get(address, 0) or address in taken:
+                continue
+            taken.add(address)
+            if address in exclude:
+                continue
+            chosen.append((self.holders[address], min(balance, amount)))
+            amount -= chosen[-1][1]
+        for address in taken:
+            heapq.heappush(heap, (-self.balances[address], address))
+        return chosen
+
+    # The values of helpers.logGlobalState at `price` (wei), in the same order and units.
+    def global_state(self, price):
+        ether = lambda value: Wei(value).to("ether")
+        debt, coll = self.trove(self.order[-1]) if self.order else (0, 0)
+        last_ICR = compute_ICR(coll, debt, price)
+        return [ether(price), self.size(), ether(self.entire_system_coll()), ether(self.entire_system_debt()),
+                ether(self.TCR(price)), self.recovery_mode(price), ether(last_ICR),
+                ether(self.pools["sp_deposits"]), ether(self.pools["sp_ibgt"])]
@@ -0,0 +1,346 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from chain_mirror import (DECIMAL_PRECISION, MCR, MIN_NET_DEBT, NECT_GAS_COMPENSATION, ChainMirror, compute_NICR)
+from helpers import ZERO_ADDRESS, logGlobalState
+
+CONTRACTS = ("troveManager", "nectToken", "stabilityPool", "activePool", "defaultPool", "borrowerOperations")
+
+
+# An event as brownie hands it out: the fields by name, plus the event name and emitter.
+class Event(dict):
+    def __init__(self, name, address, **fields):
+        super().__init__(fields)
+        self.name = name
+        self.address = address
+
+
+def make_mirror():
+    contracts = SimpleNamespace(**{name: SimpleNamespace(address=f"0x{name}") for name in CONTRACTS})
+    return ChainMirror(contracts), contracts
+
+
+def receipt(*events):
+    return SimpleNamespace(status=1, events=list(events))
+
+
+# BorrowerOperations.TroveUpdated(_borrower, _debt, _coll, stake, operation)
+def borrower_operations_update(contracts, borrower, debt, coll, stake):
+    return Event("TroveUpdated", contracts.borrowerOperations.address, _borrower=borrower, _debt=debt, _coll=coll, stake=stake, operation=0)
+
+
+# TroveManager.TroveUpdated(_borrower, _debt, _coll, _stake, _operation), by default
+# from redeemCollateral
+def trove_manager_update(contracts, borrower, debt, coll, stake, operation=3):
+    return Event("TroveUpdated", contracts.troveManager.address, _borrower=borrower, _debt=debt, _coll=coll, _stake=stake, _operation=operation)
+
+
+def test_trove_updated_from_both_emitters():
+    mirror, contracts = make_mirror()
+    mirror.apply(receipt(borrower_operations_update(contracts, "0xa", 2000 * 10**18, 3 * 10**18, 3 * 10**18),
+                         borrower_operations_update(contracts, "0xb", 2000 * 10**18, 5 * 10**18, 5 * 10**18),
+                         borrower_operations_update(contracts, "0xc", 4000 * 10**18, 5 * 10**18, 5 * 10**18)))
+    assert mirror.order == ["0xb", "0xa", "0xc"]
+    assert mirror.troves["0xa"][:3] == [2000 * 10**18, 3 * 10**18, 3 * 10**18]
+
+    #a redemption through TroveManager: less debt and coll, a new stake, a new position
+    mirror.apply(receipt(trove_manager_update(contracts, "0xc", 1000 * 10**18, 4 * 10**18, 4 * 10**18)))
+    assert mirror.troves["0xc"][:3] == [1000 * 10**18, 4 * 10**18, 4 * 10**18]
+    assert mirror.NICR("0xc") == compute_NICR(4 * 10**18, 1000 * 10**18)
+    assert mirror.order == ["0xc", "0xb", "0xa"]
+
+    #a liquidation through TroveManager closes the trove
+    mirror.apply(receipt(trove_manager_update(contracts, "0xb", 0, 0, 0)))
+    assert "0xb" not in mirror.troves and mirror.order == ["0xc", "0xa"]
+    assert mirror.size() == 2
+
+
+# SortedTroves.reInsert moves a trove behind its equal NICRs even when its own NICR is
+# unchanged; applying pending rewards leaves it where it is.
+def test_unchanged_NICR_is_reinserted_after_its_ties():
+    mirror, contracts = make_mirror()
+    mirror.apply(receipt(*(borrower_operations_update(contracts, owner, 2000 * 10**18, 3 * 10**18, 3 * 10**18) for owner in ("0xa", "0xb", "0xc"))))
+    assert mirror.order == ["0xa", "0xb", "0xc"]
+
+    mirror.apply(receipt(borrower_operations_update(contracts, "0xa", 4000 * 10**18, 6 * 10**18, 6 * 10**18)))
+    assert mirror.order == ["0xb", "0xc", "0xa"]
+    mirror.apply(receipt(trove_manager_update(contracts, "0xb", 1000 * 10**18, 3 * 10**18 // 2, 3 * 10**18 // 2)))
+    assert mirror.order == ["0xc", "0xa", "0xb"]
+    mirror.apply(receipt(trove_manager_update(contracts, "0xc", 2000 * 10**18, 3 * 10**18, 3 * 10**18, operation=0)))
+    assert mirror.order == ["0xc", "0xa", "0xb"]
+    assert mirror.insert_hints(mirror.NICR("0xc"), "0xc") == ("0xb", ZERO_ADDRESS)
+
+
+def test_failed_transactions_are_not_applied():
+    mirror, contracts = make_mirror()
+    tx = receipt(trove_manager_update(contracts, "0xa", 2000 * 10**18, 3 * 10**18, 3 * 10**18))
+    tx.status = 0
+    mirror.apply(tx)
+    assert mirror.troves == {} and mirror.order == []
+
+
+def test_log_global_state_prints_the_snapshots(capsys):
+    mirror, contracts = make_mirror()
+    mirror.apply(receipt(Event("SystemSnapshotsUpdated", contracts.troveManager.address,
+                               _totalStakesSnapshot=4 * 10**18, _totalCollateralSnapshot=6 * 10**18)))
+    watched = SimpleNamespace(mirror=mirror, priceFeedTestnet=SimpleNamespace(getPrice=lambda: 1000 * 10**18))
+    logGlobalState(watched)
+    lines = capsys.readouterr().out.splitlines()
+    assert 'Stake snapshot   4' in lines and 'Coll snapshot    6' in lines and 'Snapshot ratio   1.5' in lines
+
+
+# A mirror holding `troves` ({owner: (debt, coll)} in wei, recorded with stake = coll and
+# no reward snapshots) under the L terms `L`, listed by NICR with ties in dict order.
+def mirror_with(troves, L=(0, 0)):
+    mirror, contracts = make_mirror()
+    mirror.L_iBGT, mirror.L_NECTDebt = L
+    for owner, (debt, coll) in troves.items():
+        mirror.troves[owner] = [debt, coll, coll, 0, 0]
+    mirror.order = sorted(mirror.troves, key=lambda owner: -mirror.NICR(owner))
+    return mirror, contracts
+
+
+def random_troves(rng, n):
+    #few distinct debts and colls, so there are many equal NICRs
+    return {f"0x{i:040x}": (rng.choice((2000, 2500, 4000, 10000)) * 10**18, rng.choice((2, 3, 5, 8)) * 10**18)
+            for i in range(1, n + 1)}
+
+
+# SortedTroves over a plain list: _validInsertPosition, _findInsertPosition and _insert,
+# ported line by line, with the NICRs read from the mirror as TroveManager.getNominalICR.
+class SortedList:
+    def __init__(self, mirror, order):
+        self.nicr = mirror.NICR
+        self.order = list(order)
+
+    def _next(self, owner):
+        i = self.order.index(owner) + 1
+        return self.order[i] if i < len(self.order) else ZERO_ADDRESS
+
+    def _prev(self, owner):
+        i = self.order.index(owner) - 1
+        return self.order[i] if i >= 0 else ZERO_ADDRESS
+
+    def valid(self, NICR, prev, next):
+        if prev == ZERO_ADDRESS and next == ZERO_ADDRESS:
+            return not self.order
+        if prev == ZERO_ADDRESS:
+            return self.order[0] == next and NICR >= self.nicr(next)
+        if next == ZERO_ADDRESS:
+            return self.order[-1] == prev and NICR <= self.nicr(prev)
+        return self._next(prev) == next and self.nicr(prev) >= NICR >= self.nicr(next)
+
+    def _descend(self, NICR, start):
+        if self.order and self.order[0] == start and NICR >= self.nicr(start):
+            return ZERO_ADDRESS, start
+        prev = start
+        next = self._next(prev) if prev != ZERO_ADDRESS else ZERO_ADDRESS
+        while prev != ZERO_ADDRESS and not self.valid(NICR, prev, next):
+            prev = next
+            next = self._next(prev) if prev != ZERO_ADDRESS else ZERO_ADDRESS
+        return prev, next
+
+    def _ascend(self, NICR, start):
+        if self.order[-1] == start and NICR <= self.nicr(start):
+            return start, ZERO_ADDRESS
+        next = start
+        prev = self._prev(next)
+        while next != ZERO_ADDRESS and not self.valid(NICR, prev, next):
+            next = prev
+            prev = self._prev(next) if next != ZERO_ADDRESS else ZERO_ADDRESS
+        return prev, next
+
+    def find(self, NICR, prev, next):
+        if prev != ZERO_ADDRESS and (prev not in self.order or NICR > self.nicr(prev)):
+            prev = ZERO_ADDRESS
+        if next != ZERO_ADDRESS and (next not in self.order or NICR < self.nicr(next)):
+            next = ZERO_ADDRESS
+        if prev == ZERO_ADDRESS and next == ZERO_ADDRESS:
+            return self._descend(NICR, self.order[0] if self.order else ZERO_ADDRESS)
+        if prev == ZERO_ADDRESS:
+            return self._ascend(NICR, next)
+        return self._descend(NICR, prev)
+
+    # insert (reInsert when `owner` is listed) at the hints, as the contract does
+    def insert(self, owner, NICR, prev, next):
+        if owner in self.order:
+            self.order.remove(owner)
+        if not self.valid(NICR, prev, next):
+            prev, next = self.find(NICR, prev, next)
+        self.order.insert(self.order.index(next) if next != ZERO_ADDRESS else len(self.order), owner)
+
+    # every position the contract accepts without searching, as indexes into `order`
+    def valid_positions(self, NICR):
+        order = [ZERO_ADDRESS] + self.order + [ZERO_ADDRESS]
+        return [i for i in range(len(order) - 1) if self.valid(NICR, order[i], order[i + 1])]
+
+
+# HintHelpers.getRedemptionHints, ported line by line over the mirror's list.
+def redemption_hints_reference(mirror, amount, price, max_iterations=0):
+    i = len(mirror.order) - 1
+    while i >= 0 and mirror.ICR(mirror.order[i], price) < MCR:
+        i -= 1
+    first = mirror.order[i] if i >= 0 else ZERO_ADDRESS
+    remaining, partial_NICR = amount, 0
+    iterations = max_iterations or 2**256 - 1
+    while i >= 0 and remaining > 0 and iterations > 0:
+        iterations -= 1
+        debt, coll = mirror.trove(mirror.order[i])
+        net_debt = debt - NECT_GAS_COMPENSATION
+        if net_debt > remaining:
+            if net_debt > MIN_NET_DEBT:
+                redeemable = min(remaining, net_debt - MIN_NET_DEBT)
+                new_coll = coll - redeemable * DECIMAL_PRECISION // price
+                partial_NICR = compute_NICR(new_coll, net_debt - redeemable + NECT_GAS_COMPENSATION)
+                remaining -= redeemable
+            break
+        remaining -= net_debt
+        i -= 1
+    return first, partial_NICR, amount - remaining
+
+
+# Index in `order` at which (prev, next) insert a trove.
+def position(order, hints):
+    return order.index(hints[1]) if hints[1] != ZERO_ADDRESS else len(order)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_insert_hints_put_troves_where_the_contract_does(seed):
+    rng = random.Random(seed)
+    #with pending rewards on half of the seeds
+    L = (rng.randrange(0, 10**17), rng.randrange(0, 10**20)) if seed % 2 else (0, 0)
+    mirror, contracts = mirror_with(random_troves(rng, rng.randrange(0, 30)), L)
+    #at the NICR of a listed trove (ties), in between, and past both ends
+    NICRs = [mirror.NICR(owner) for owner in mirror.order] + [compute_NICR(3 * 10**18, 2600 * 10**18), 1, 2**200]
+
+    #new troves: the hints are valid, and the last valid position, after the equal NICRs
+    listed = SortedList(mirror, mirror.order)
+    for NICR in NICRs:
+        hints = mirror.insert_hints(NICR)
+        assert listed.valid(NICR, *hints)
+        assert position(listed.order, hints) == listed.valid_positions(NICR)[-1]
+        #without valid hints _findInsertPosition searches from the head or the hints, and
+        #may stop before the equal NICRs: a different place, which is why the hints matter
+        for stale in [(ZERO_ADDRESS, ZERO_ADDRESS)] + [(owner, ZERO_ADDRESS) for owner in listed.order[:3]]:
+            assert position(listed.order, listed.find(NICR, *stale)) in listed.valid_positions(NICR)
+
+    #re-inserted troves, the head and the tail among them: the same, with the trove taken out
+    for owner in list(mirror.order):
+        debt, coll = 2000 * 10**18, rng.choice((2, 3, 5, 8)) * 10**18 + rng.choice((0, 1))
+        NICR = compute_NICR(coll, debt)
+        hints = mirror.insert_hints(NICR, owner)
+        chain = SortedList(mirror, [o for o in mirror.order if o != owner])
+        assert chain.valid(NICR, *hints)
+        assert position(chain.order, hints) == chain.valid_positions(NICR)[-1]
+
+        #and the mirror follows the contract once the update is applied
+        chain.insert(owner, NICR, *hints)
+        mirror.apply(receipt(borrower_operations_update(contracts, owner, debt, coll, coll)))
+        assert mirror.order == chain.order
+
+
+def test_insert_hints_at_the_edges():
+    assert mirror_with({})[0].insert_hints(10**20) == (ZERO_ADDRESS, ZERO_ADDRESS)
+    #a lone trove re-inserted into a list of one
+    assert mirror_with({"0xa": (2000 * 10**18, 5 * 10**18)})[0].insert_hints(10**18, "0xa") == (ZERO_ADDRESS, ZERO_ADDRESS)
+    mirror, _ = mirror_with({"0xa": (2000 * 10**18, 5 * 10**18), "0xb": (2000 * 10**18, 3 * 10**18),
+                             "0xc": (2000 * 10**18, 2 * 10**18)})
+    assert mirror.order == ["0xa", "0xb", "0xc"]
+    #the head staying at the head, and moving to the tail
+    assert mirror.insert_hints(mirror.NICR("0xa"), "0xa") == (ZERO_ADDRESS, "0xb")
+    assert mirror.insert_hints(1, "0xa") == ("0xc", ZERO_ADDRESS)
+    #the tail staying at the tail, and moving to the head
+    assert mirror.insert_hints(mirror.NICR("0xc"), "0xc") == ("0xb", ZERO_ADDRESS)
+    assert mirror.insert_hints(2**200, "0xc") == (ZERO_ADDRESS, "0xa")
+    #ties go after the troves of equal NICR
+    assert mirror.insert_hints(mirror.NICR("0xb")) == ("0xb", "0xc")
+    assert mirror.insert_hints(mirror.NICR("0xb"), "0xb") == ("0xa", "0xc")
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_redemption_hints_match_hint_helpers(seed):
+    rng = random.Random(seed)
+    troves = random_troves(rng, rng.randrange(0, 30))
+    mirror, _ = mirror_with(troves, L=(rng.randrange(0, 10**17), rng.randrange(0, 10**20)))
+    total = sum(debt for debt, _ in troves.values())
+    for _ in range(20):
+        #some prices put part of the tail under MCR
+        price = rng.choice((500, 800, 1000, 2000, 5000)) * 10**18
+        amount = rng.randrange(0, total + 10**21)
+        max_iterations = rng.choice((0, 0, 1, 3))
+        first, partial_NICR, truncated, partial = mirror.redemption_hints(amount, price, max_iterations)
+        assert (first, partial_NICR, truncated) == redemption_hints_reference(mirror, amount, price, max_iterations)
+        assert (partial is None) == (partial_NICR == 0)
+
+
+def test_redemption_hints_cases():
+    assert mirror_with({})[0].redemption_hints(10**21, 1000 * 10**18) == (ZERO_ADDRESS, 0, 0, None)
+    price = 1000 * 10**18
+    mirror, _ = mirror_with({"0xa": (10000 * 10**18, 30 * 10**18), "0xb": (2000 * 10**18, 3 * 10**18),
+                             "0xc": (3000 * 10**18, 3 * 10**18)})
+    assert mirror.order == ["0xa", "0xb", "0xc"]
+    #0xc is under MCR and skipped; 0xb's net debt (1800) is not above MIN_NET_DEBT, so the
+    #walk stops at it without a partial redemption
+    assert mirror.ICR("0xc", price) < MCR
+    assert mirror.redemption_hints(1000 * 10**18, price) == ("0xb", 0, 0, None)
+    #0xb redeemed whole, 0xa partially
+    assert mirror.redemption_hints(5000 * 10**18, price) == (
+        "0xb", compute_NICR(30 * 10**18 - 3200 * 10**18 * DECIMAL_PRECISION // price, 6800 * 10**18), 5000 * 10**18, "0xa")
+    #0xa down to MIN_NET_DEBT at most
+    first, partial_NICR, truncated, partial = mirror.redemption_hints(10000 * 10**18, price)
+    assert (truncated, partial) == (1800 * 10**18 + 9800 * 10**18 - MIN_NET_DEBT, "0xa")
+    assert partial_NICR == compute_NICR(30 * 10**18 - 8000 * 10**18 * DECIMAL_PRECISION // price, MIN_NET_DEBT + NECT_GAS_COMPENSATION)
+    #the whole list redeemed
+    assert mirror.redemption_hints(20000 * 10**18, price) == ("0xb", 0, 11600 * 10**18, None)
+    #max_iterations stops the walk
+    assert mirror.redemption_hints(5000 * 10**18, price, max_iterations=1) == ("0xb", 0, 1800 * 10**18, None)
+    for amount in (1000 * 10**18, 5000 * 10**18, 10000 * 10**18, 20000 * 10**18):
+        assert mirror.redemption_hints(amount, price)[:3] == redemption_hints_reference(mirror, amount, price)
+
+
+def transfer(contracts, sender, recipient, value):
+    return Event("Transfer", contracts.nectToken.address, **{"from": sender, "to": recipient, "value": value})
+
+
+# donors() by sorting every holder: largest balance first, ties by address as in the heap.
+def donors_reference(mirror, amount, exclude=()):
+    chosen = []
+    for balance, address in sorted((-mirror.balance(a), a) for a in mirror.holders if a not in exclude and mirror.balance(a) > 0):
+        if amount <= 0:
+            break
+        chosen.append((mirror.holders[address], min(-balance, amount)))
+        amount -= chosen[-1][1]
+    return chosen
+
+
+def test_donors_match_a_full_sort_over_random_transfers():
+    rng = random.Random(25)
+    holders = [SimpleNamespace(address=f"0x{i:040x}") for i in range(1, 41)]
+    addresses = [h.address for h in holders] + [f"0x{i:040x}" for i in range(100, 105)]
+    contracts = make_mirror()[1]
+    mirror = ChainMirror(contracts, holders=holders)
+    mirror.apply(receipt(*(transfer(contracts, ZERO_ADDRESS, h.address, rng.randrange(1, 10**6)) for h in holders[::2])))
+    for step in range(5000):
+        sender, recipient = rng.choice(addresses), rng.choice(addresses + [ZERO_ADDRESS])
+        value = rng.choice((0, rng.randrange(0, mirror.balance(sender) + 1), mirror.balance(sender)))
+        if rng.random() < 0.1:
+            #a mint, or a burn of the whole balance
+            sender, value = (ZERO_ADDRESS, rng.randrange(1, 10**6)) if rng.random() < 0.5 else (sender, mirror.balance(sender))
+            recipient = recipient if sender == ZERO_ADDRESS else ZERO_ADDRESS
+        mirror.apply(receipt(transfer(contracts, sender, recipient, value)))
+        #the stale entries stay bounded
+        assert len(mirror._heap) <= 2 * len(holders) + 64 + 1
+
+        total = sum(mirror.balance(h) for h in holders)
+        amount = rng.choice((0, 1, rng.randrange(1, total + 2), total, total + 10**6))
+        exclude = tuple(rng.sample(addresses, rng.randrange(0, 4)))
+        expected = donors_reference(mirror, amount, exclude)
+        assert mirror.donors(amount, exclude) == expected
+        #the taken entries are pushed back, so asking again gives the same donors
+        assert mirror.donors(amount, exclude) == expected
+        if amount > total:
+            #a shortfall: every holder outside `exclude` gives its whole balance
+            assert sum(value for _, value in expected) == sum(mirror.balance(h) for h in holders if h.address not in exclude)
+    assert mirror.donors(10**30) == donors_reference(mirror, 10**30)
@@ -6,44 +6,80 @@ MAX_BYTES_32 = '0x' + 'F' * 64
 def floatToWei(amount):
     return Wei(amount * 1e18)
 
-# Subtracts the borrowing fee
-def get_nect_amount_from_net_debt(contracts, net_debt):
-    borrowing_rate = contracts.troveManager.getBorrowingRateWithDecay()
+# Subtracts the borrowing fee, at `borrowing_rate` if given (wei) or the current rate
+def get_nect_amount_from_net_debt(contracts, net_debt, borrowing_rate=None):
+    if borrowing_rate is None:
+        borrowing_rate = contracts.troveManager.getBorrowingRateWithDecay()
     return Wei(net_debt * Wei(1e18) / (Wei(1e18) + borrowing_rate))
 
-def logGlobalState(contracts):
-    print('\n ---- Global state ----')
+#labels of the values logGlobalState returns, as it prints them
+GLOBAL_STATE = ('iBGT price       ', 'Num troves      ', 'Total Coll      ', 'Total Debt      ', 'TCR             ',
+                'Rec. Mode       ', 'Last trove’s ICR', 'SP NECT         ', 'SP iBGT          ')
+
+# The values of logGlobalState from one SystemStateGetter call, in the same order and units,
+# and the (totalStakesSnapshot, totalCollateralSnapshot) pair in wei
+def read_system_state(contracts):
+    state = contracts.systemStateGetter.getSystemState()
+    ether = lambda value: Wei(value).to("ether")
+    return ([ether(state['price']), state['numTroves'], ether(state['totalColl']), ether(state['totalDebt']),
+             ether(state['TCR']), state['recoveryMode'], ether(state['lastICR']),
+             ether(state['stabilityPoolNECT']), ether(state['stabilityPooliBGT'])],
+            (int(state['totalStakesSnapshot']), int(state['totalCollateralSnapshot'])))
+
+def read_global_state(contracts):
+    return read_system_state(contracts)[0]
+
+# The snapshot lines of logGlobalState, from the wei values
+def log_snapshots(log, stakes_snapshot, coll_snapshot):
+    log('Stake snapshot  ', Wei(stakes_snapshot).to("ether"))
+    log('Coll snapshot   ', Wei(coll_snapshot).to("ether"))
+    if stakes_snapshot > 0:
+        log('Snapshot ratio  ', coll_snapshot / stakes_snapshot)
+
+# The system totals, read from `contracts.mirror` (chain_mirror.py) when the contracts are
+# watched, or else in one call when they include a SystemStateGetter
+def logGlobalState(contracts, verbose=True):
+    log = print if verbose else (lambda *args, **kwargs: None)
+    mirror = getattr(contracts, 'mirror', None)
+    if mirror is not None or hasattr(contracts, 'systemStateGetter'):
+        if mirror is not None:
+            state = mirror.global_state(int(contracts.priceFeedTestnet.getPrice()))
+            snapshots = (mirror.total_stakes_snapshot, mirror.total_collateral_snapshot)
+        else:
+            state, snapshots = read_system_state(contracts)
+        log('\n ---- Global state ----')
+        for name, value in zip(GLOBAL_STATE, state):
+            log(name, value)
+        log_snapshots(log, *snapshots)
+        log(' ----------------------\n')
+        return state
+    log('\n ---- Global state ----')
     num_troves = contracts.sortedTroves.getSize()
-    print('Num troves      ', num_troves)
+    log('Num troves      ', num_troves)
     activePoolColl = contracts.activePool.getiBGT()
     activePoolDebt = contracts.activePool.getNECTDebt()
     defaultPoolColl = contracts.defaultPool.getiBGT()
     defaultPoolDebt = contracts.defaultPool.getNECTDebt()
     total_debt = (activePoolDebt + defaultPoolDebt).to("ether")
     total_coll = (activePoolColl + defaultPoolColl).to("ether")
-    print('Total Debt      ', total_debt)
-    print('Total Coll      ', total_coll)
+    log('Total Debt      ', total_debt)
+    log('Total Coll      ', total_coll)
     SP_NECT = contracts.stabilityPool.getTotalNECTDeposits().to("ether")
     SP_iBGT = contracts.stabilityPool.getiBGT().to("ether")
-    print('SP NECT         ', SP_NECT)
-    print('SP iBGT          ', SP_iBGT)
+    log('SP NECT         ', SP_NECT)
+    log('SP iBGT          ', SP_iBGT)
     price_ether_current = contracts.priceFeedTestnet.getPrice()
     iBGT_price = price_ether_current.to("ether")
-    print('iBGT price       ', iBGT_price)
+    log('iBGT price       ', iBGT_price)
     TCR = contracts.troveManager.getTCR(price_ether_current).to("ether")
-    print('TCR             ', TCR)
+    log('TCR             ', TCR)
     recovery_mode = contracts.troveManager.checkRecoveryMode(price_ether_current)
-    print('Rec. Mode       ', recovery_mode)
-    stakes_snapshot = contracts.troveManager.totalStakesSnapshot()
-    coll_snapshot = contracts.troveManager.totalCollateralSnapshot()
-    print('Stake snapshot  ', stakes_snapshot.to("ether"))
-    print('Coll snapshot   ', coll_snapshot.to("ether"))
-    if stakes_snapshot > 0:
-        print('Snapshot ratio  ', coll_snapshot / stakes_snapshot)
+    log('Rec. Mode       ', recovery_mode)
+    log_snapshots(log, contracts.troveManager.totalStakesSnapshot(), contracts.troveManager.totalCollateralSnapshot())
     last_trove = contracts.sortedTroves.getLast()
     last_ICR = contracts.troveManager.getCurrentICR(last_trove, price_ether_current).to("ether")
     #print('Last trove      ', last_trove)
-    print('Last trove’s ICR', last_ICR)
-    print(' ----------------------\n')
+    log('Last trove’s ICR', last_ICR)
+    log(' ----------------------\n')
 
     return [iBGT_price, num_troves, total_coll, total_debt, TCR, recovery_mode, last_ICR, SP_NECT, SP_iBGT]
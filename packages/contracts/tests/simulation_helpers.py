@@ -1,9 +1,18 @@
 from brownie import *
-import random
-import numpy as np
+import os
+import sys
 from bisect import bisect_left
 
 from helpers import *
+from chain_mirror import (DECIMAL_PRECISION, read_trove_book, read_lowest_troves, compute_ICR, compute_NICR,
+                          trove_count, nect_balance_of, nect_supply, stability_pool_deposits, stability_pool_ibgt,
+                          stability_deposit, check_recovery_mode, new_TCR)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'macroModel'))
+from exogenous import airdrop_schedule, load_paths
+from rng_streams import RandomStreams
+from rolling import RollingSum
+from simulation import ModelParams
 
 #global variables
 day = 24
@@ -22,6 +31,11 @@ NECT_GAS_COMPENSATION = 200.0
 MIN_NET_DEBT = 1800.0
 MAX_FEE = Wei(1e18)
 
+# random streams keyed by run, phase, step and trove
+# legacy=True replays the per-draw reseeding of earlier versions for regression checks
+rng_seed = 2019375
+streams = RandomStreams(seed=rng_seed, legacy=False)
+
 """# iBGT price (exogenous)
 
 iBGT is the collateral for NECT. The ibgt price $P_t^e$ follows 
@@ -34,7 +48,6 @@ where $\zeta_t^e \sim N(0, $ sd_ibgt$)$ represents ibgt price shock and $\sigma_
 
 #ibgt price
 price_ibgt_initial = 2000
-price_ibgt = [price_ibgt_initial]
 sd_ibgt=0.02
 #drift_ibgt = 0.001
 # 4 stages:
@@ -64,7 +77,6 @@ The POLLEN price from the second month on is endogenously determined.
 
 #POLLEN price & airdrop
 price_POLLEN_initial = 0.4
-price_POLLEN = [price_POLLEN_initial]
 sd_POLLEN=0.005
 drift_POLLEN = 0.0035
 supply_POLLEN=[0]
@@ -158,7 +170,6 @@ theta = 0.001
 
 #natural rate
 natural_rate_initial = 0.2
-natural_rate = [natural_rate_initial]
 sd_natural_rate = 0.002
 
 """# Trove pool
@@ -298,51 +309,32 @@ where:
 iBGT Price
 """
 
+#exogenous series, one cumulative product per series over its regime schedule,
+#cached on disk by exogenous.py
+exogenous_params = ModelParams(period=period, month=month, day=day,
+                               price_ibgt_initial=price_ibgt_initial, sd_ibgt=sd_ibgt,
+                               ibgt_regimes=((period1, drift_ibgt1, sd_ibgt), (period2, drift_ibgt2, sd_ibgt),
+                                             (period3, drift_ibgt3, sd_ibgt), (period4, drift_ibgt4, sd_ibgt)),
+                               natural_rate_initial=natural_rate_initial, sd_natural_rate=sd_natural_rate,
+                               price_POLLEN_initial=price_POLLEN_initial, sd_POLLEN=sd_POLLEN, drift_POLLEN=drift_POLLEN)
+exogenous = load_paths(exogenous_params, rng_seed, legacy=streams.legacy)
+
 #ibgt price
-for i in range(1, period1):
-    random.seed(2019375+10000*i)
-    shock_ibgt = random.normalvariate(0, sd_ibgt)
-    price_ibgt.append(price_ibgt[i-1] * (1 + shock_ibgt) * (1 + drift_ibgt1))
-print(" - iBGT period 1 -")
-print(f"Min iBGT price: {min(price_ibgt[1:period1])}")
-print(f"Max iBGT price: {max(price_ibgt[1:period1])}")
-for i in range(period1, period2):
-    random.seed(2019375+10000*i)
-    shock_ibgt = random.normalvariate(0, sd_ibgt)
-    price_ibgt.append(price_ibgt[i-1] * (1 + shock_ibgt) * (1 + drift_ibgt2))
-print(" - iBGT period 2 -")
-print(f"Min iBGT price: {min(price_ibgt[period1:period2])}")
-print(f"Max iBGT price: {max(price_ibgt[period1:period2])}")
-for i in range(period2, period3):
-    random.seed(2019375+10000*i)
-    shock_ibgt = random.normalvariate(0, sd_ibgt)
-    price_ibgt.append(price_ibgt[i-1] * (1 + shock_ibgt) * (1 + drift_ibgt3))
-print(" - iBGT period 3 -")
-print(f"Min iBGT price: {min(price_ibgt[period2:period3])}")
-print(f"Max iBGT price: {max(price_ibgt[period2:period3])}")
-for i in range(period3, period4):
-    random.seed(2019375+10000*i)
-    shock_ibgt = random.normalvariate(0, sd_ibgt)
-    price_ibgt.append(price_ibgt[i-1] * (1 + shock_ibgt) * (1 + drift_ibgt4))
-print(" - iBGT period 4 -")
-print(f"Min iBGT price: {min(price_ibgt[period3:period4])}")
-print(f"Max iBGT price: {max(price_ibgt[period3:period4])}")
+price_ibgt = exogenous['price_ibgt'].tolist()
+for stage, (start, stop) in enumerate([(1, period1), (period1, period2), (period2, period3), (period3, period4)], 1):
+    print(f" - iBGT period {stage} -")
+    print(f"Min iBGT price: {min(price_ibgt[start:stop])}")
+    print(f"Max iBGT price: {max(price_ibgt[start:stop])}")
 
 """Natural Rate"""
 
 #natural rate
-for i in range(1, period):
-    random.seed(201597+10*i)
-    shock_natural = random.normalvariate(0,sd_natural_rate)
-    natural_rate.append(natural_rate[i-1]*(1+shock_natural))
+natural_rate = exogenous['natural_rate'].tolist()
 
 """POLLEN Price - First Month"""
 
 #POLLEN price
-for i in range(1, month):
-    random.seed(2+13*i)
-    shock_POLLEN = random.normalvariate(0,sd_POLLEN)  
-    price_POLLEN.append(price_POLLEN[i-1]*(1+shock_POLLEN)*(1+drift_POLLEN))
+price_POLLEN = exogenous['price_POLLEN'].tolist()
 
 """# Troves
 
@@ -351,14 +343,17 @@ Liquidate Troves
 
 def is_recovery_mode(contracts, price_ibgt_current):
     price = Wei(price_ibgt_current * 1e18)
-    return contracts.troveManager.checkRecoveryMode(price)
+    return check_recovery_mode(contracts, price)
 
 def pending_liquidations(contracts, price_ibgt_current):
-    last_trove = contracts.sortedTroves.getLast()
-    last_ICR = contracts.troveManager.getCurrentICR(last_trove, Wei(price_ibgt_current * 1e18))
-
-    if last_trove == ZERO_ADDRESS:
+    price = int(Wei(price_ibgt_current * 1e18))
+    #the troves a liquidateTroves call can reach, and the one after them
+    tail = read_lowest_troves(contracts, NUM_LIQUIDATIONS + 1)
+    if len(tail) == 0:
         return False
+    _, last_debt, last_coll = tail[0]
+    last_ICR = compute_ICR(last_coll, last_debt, price)
+
     if last_ICR >= Wei(15e17):
         return False
     if last_ICR < Wei(11e17):
@@ -366,14 +361,16 @@ def pending_liquidations(contracts, price_ibgt_current):
     if not is_recovery_mode(contracts, price_ibgt_current):
         return False
 
-    stability_pool_balance = contracts.stabilityPool.getTotalNECTDeposits()
-    trove = last_trove
+    stability_pool_balance = stability_pool_deposits(contracts)
     for i in range(NUM_LIQUIDATIONS):
-        debt = contracts.troveManager.getEntireDebtAndColl(trove)[0]
+        debt = tail[i][1]
         if stability_pool_balance >= debt:
             return True
-        trove = contracts.sortedTroves.getPrev(trove)
-        ICR = contracts.troveManager.getCurrentICR(trove, Wei(price_ibgt_current * 1e18))
+        #past the head of the list the contract reads the zero address, a trove without debt
+        if i + 1 >= len(tail):
+            return False
+        _, debt, coll = tail[i + 1]
+        ICR = compute_ICR(coll, debt, price)
         if ICR >= Wei(15e17):
             return False
 
@@ -398,18 +395,19 @@ def remove_accounts_from_events(accounts, active_accounts, inactive_accounts, ev
 # Re-arranging:
 # F = 0.5 ** (1/8760)
 # F = 0.99992087674
+POLLEN_airdrop = airdrop_schedule(period + 1, 32e6, 0.99992087674)
+
 def quantity_POLLEN_airdrop(index):
-    F = 0.99992087674
     if index <= 0:
         return 0
-    return 32e6 * (F ** (index-1) - F ** index)
+    return float(POLLEN_airdrop[index])
 
-def liquidate_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, price_POLLEN_current, data, index):
+def liquidate_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, price_POLLEN_current, data, windows, index):
     if len(active_accounts) == 0:
         return [0, 0]
 
-    stability_pool_previous = contracts.stabilityPool.getTotalNECTDeposits() / 1e18
-    stability_pool_ibgt_previous = contracts.stabilityPool.getiBGT() / 1e18
+    stability_pool_previous = stability_pool_deposits(contracts) / 1e18
+    stability_pool_ibgt_previous = stability_pool_ibgt(contracts) / 1e18
 
     while pending_liquidations(contracts, price_ibgt_current):
         try:
@@ -430,8 +428,8 @@ def liquidate_troves(accounts, contracts, active_accounts, inactive_accounts, pr
                 trove = contracts.sortedTroves.getPrev(trove)
                 ICR = contracts.troveManager.getCurrentICR(trove, Wei(price_ibgt_current * 1e18))
                 print(f"ICR: {ICR}")
-    stability_pool_current = contracts.stabilityPool.getTotalNECTDeposits() / 1e18
-    stability_pool_ibgt_current = contracts.stabilityPool.getiBGT() / 1e18
+    stability_pool_current = stability_pool_deposits(contracts) / 1e18
+    stability_pool_ibgt_current = stability_pool_ibgt(contracts) / 1e18
 
     debt_liquidated = stability_pool_current - stability_pool_previous
     ibgt_liquidated = stability_pool_ibgt_current - stability_pool_ibgt_previous
@@ -441,62 +439,76 @@ def liquidate_troves(accounts, contracts, active_accounts, inactive_accounts, pr
     data['liquidation_gain'][index] = liquidation_gain
     data['airdrop_gain'][index] = airdrop_gain
 
-    return_stability = calculate_stability_return(contracts, price_NECT, data, index)
+    return_stability = calculate_stability_return(contracts, price_NECT, windows, index)
 
     return [ibgt_liquidated, return_stability]
 
-def calculate_stability_return(contracts, price_NECT, data, index):
-    stability_pool_previous = contracts.stabilityPool.getTotalNECTDeposits() / 1e18
+def calculate_stability_return(contracts, price_NECT, windows, index):
+    stability_pool_previous = stability_pool_deposits(contracts) / 1e18
     if index == 0:
         return_stability = initial_return
     elif stability_pool_previous == 0:
         return_stability = initial_return * 2
     elif index < month:
         return_stability = (year/index) * \
-            (sum(data['liquidation_gain'][0:index]) +
-             sum(data['airdrop_gain'][0:index])
+            (windows['liquidation_gain'].total() +
+             windows['airdrop_gain'].total()
              ) / (price_NECT * stability_pool_previous)
     else:
         return_stability = (year/month) * \
-            (sum(data['liquidation_gain'][index - month:index]) +
-             sum(data['airdrop_gain'][index - month:index])
+            (windows['liquidation_gain'].total() +
+             windows['airdrop_gain'].total()
              ) / (price_NECT * stability_pool_previous)
 
     return return_stability
 
+# Running sums of the per-step revenue columns over the last month.
+# They are fed at the end of each step, so during step `index` they cover
+# data[column][index - month:index] (or data[column][0:index] in the first month).
+def revenue_windows(data):
+    windows = {column: RollingSum(month, compensated=True) for column in data}
+    push_windows(windows, data, 0)
+    return windows
+
+def push_windows(windows, data, index):
+    for column, window in windows.items():
+        window.push(data[column][index])
+
 def isNewTCRAboveCCR(contracts, collChange, isCollIncrease, debtChange, isDebtIncrease, price):
-    newTCR = contracts.borrowerOperations.getNewTCRFromTroveChange(collChange, isCollIncrease, debtChange, isDebtIncrease, price)
+    newTCR = new_TCR(contracts, collChange, isCollIncrease, debtChange, isDebtIncrease, price)
     return newTCR >= Wei(1.5 * 1e18)
 
 """Close Troves"""
 
-def close_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index):
+# `troves` is the trove book read after the liquidations (read_trove_book), shared with
+# adjust_troves; closing a trove does not change the others' debt or coll.
+def close_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index, troves=None):
     if len(active_accounts) == 0:
         return [0]
 
     if is_recovery_mode(contracts, price_ibgt_current):
         return [0]
 
-    np.random.seed(208+index)
-    shock_closetroves = np.random.normal(0,sd_closetroves)
-    n_troves = contracts.sortedTroves.getSize()
+    stream = streams.stream('close_troves', index)
+    shock_closetroves = stream.normal(0,sd_closetroves)
+    n_troves = trove_count(contracts)
 
     if index <= 240:
-        number_closetroves = np.random.uniform(0,1)
+        number_closetroves = stream.uniform(0,1)
     elif price_NECT >=1:
         number_closetroves = max(0, n_steady * (1+shock_closetroves))
     else:
         number_closetroves = max(0, n_steady * (1+shock_closetroves)) + beta*(1-price_NECT)*n_troves
 
     number_closetroves = min(int(round(number_closetroves)), len(active_accounts) - 1)
-    random.seed(293+100*index)
-    drops = list(random.sample(range(len(active_accounts)), number_closetroves))
+    drops = streams.stream('close_troves_sample', index).sample(len(active_accounts), number_closetroves)
+    if len(drops) > 0 and troves is None:
+        troves = read_trove_book(contracts)
     for i in range(0, len(drops)):
         account_index = active_accounts[drops[i]]['index']
         account = accounts[account_index]
-        amounts = contracts.troveManager.getEntireDebtAndColl(account)
-        coll = amounts['coll']
-        debt = amounts['debt']
+        #a trove missing from the list reads as empty, as it does on chain
+        debt, coll = troves.get(account.address, (0, 0))
         pending = get_nect_to_repay(accounts, contracts, active_accounts, inactive_accounts, account, debt)
         if pending == 0:
             if isNewTCRAboveCCR(contracts, coll, False, debt, False, floatToWei(price_ibgt_current)):
@@ -511,7 +523,7 @@ def close_troves(accounts, contracts, active_accounts, inactive_accounts, price_
 """Adjust Troves"""
 
 def transfer_from_to(contracts, from_account, to_account, amount):
-    balance = contracts.nectToken.balanceOf(from_account)
+    balance = nect_balance_of(contracts, from_account)
     transfer_amount = min(balance, amount)
     if transfer_amount == 0:
         return amount
@@ -523,29 +535,36 @@ def transfer_from_to(contracts, from_account, to_account, amount):
     return pending
 
 def get_nect_to_repay(accounts, contracts, active_accounts, inactive_accounts, account, debt):
-    nectBalance = contracts.nectToken.balanceOf(account)
+    nectBalance = nect_balance_of(contracts, account)
     if debt > nectBalance:
         pending = debt - nectBalance
         # first try to withdraw from SP
-        initial_deposit = contracts.stabilityPool.deposits(account)[0]
+        initial_deposit = stability_deposit(contracts, account)
         if initial_deposit > 0:
             contracts.stabilityPool.withdrawFromSP(pending, { 'from': account, 'gas_limit': 8000000, 'allow_revert': True })
             # it can only withdraw up to the deposit, so we check the balance again
-            nectBalance = contracts.nectToken.balanceOf(account)
+            nectBalance = nect_balance_of(contracts, account)
             pending = debt - nectBalance
-        # try with whale
-        pending = transfer_from_to(contracts, accounts[0], account, pending)
-        # try with active accounts, which are more likely to hold NECT
-        for a in active_accounts:
-            if pending <= 0:
-                break
-            a_address = accounts[a['index']]
-            pending = transfer_from_to(contracts, a_address, account, pending)
-        for i in inactive_accounts:
-            if pending <= 0:
-                break
-            i_address = accounts[i]
-            pending = transfer_from_to(contracts, i_address, account, pending)
+        mirror = getattr(contracts, 'mirror', None)
+        if mirror is not None:
+            # the largest holders first, the fewest transfers
+            for donor, amount in mirror.donors(pending, exclude=(account.address,)):
+                contracts.nectToken.transfer(account, amount, { 'from': donor })
+                pending = pending - amount
+        else:
+            # try with whale
+            pending = transfer_from_to(contracts, accounts[0], account, pending)
+            # try with active accounts, which are more likely to hold NECT
+            for a in active_accounts:
+                if pending <= 0:
+                    break
+                a_address = accounts[a['index']]
+                pending = transfer_from_to(contracts, a_address, account, pending)
+            for i in inactive_accounts:
+                if pending <= 0:
+                    break
+                i_address = accounts[i]
+                pending = transfer_from_to(contracts, i_address, account, pending)
 
         if pending > 0:
             print(f"\n ***Error: not enough NECT to repay! {debt / 1e18} NECT for {account}")
@@ -554,28 +573,46 @@ def get_nect_to_repay(accounts, contracts, active_accounts, inactive_accounts, a
 
     return 0
 
-def get_hints(contracts, coll, debt):
-    NICR = contracts.hintHelpers.computeNominalCR(floatToWei(coll), floatToWei(debt))
-    approxHint = contracts.hintHelpers.getApproxHint(NICR, 100, 0)
-    #print("approx hint", approxHint)
-    return contracts.sortedTroves.findInsertPosition(NICR, approxHint[0], approxHint[0])
-
-def get_hints_from_amounts(accounts, contracts, active_accounts, coll, debt, price_ibgt_current):
-    ICR = coll * price_ibgt_current / debt
-    NICR = contracts.hintHelpers.computeNominalCR(floatToWei(coll), floatToWei(debt))
+# Insert hints (upper, lower) for a trove of `coll` iBGT and `debt` NECT, in wei, and the
+# position of its ICR (`ICR` if given) among the active accounts, which are kept in
+# CR_initial order. With `contracts.mirror` the hints are the exact neighbours in its copy
+# of the sorted list, with no calls; `owner` is the trove being re-inserted, if any, which
+# they skip. Otherwise findInsertPosition searches from the active accounts around that
+# position.
+def get_hints_from_amounts(accounts, contracts, active_accounts, coll, debt, price_ibgt_current, owner=None, ICR=None):
+    if ICR is None:
+        ICR = int(coll) * price_ibgt_current / int(debt)
+    NICR = compute_NICR(int(coll), int(debt))
+    mirror = getattr(contracts, 'mirror', None)
+    if mirror is not None:
+        hints = mirror.insert_hints(NICR, getattr(owner, 'address', owner))
+        return [hints[0], hints[1], active_position(active_accounts, ICR)]
     return get_hints_from_ICR(accounts, contracts, active_accounts, ICR, NICR)
 
 #def get_address_from_active_index(accounts, active_accounts, index):
 def index2address(accounts, active_accounts, index):
     return accounts[active_accounts[index]['index']]
 
+# CR_initial of the active accounts as a sequence, to bisect without copying it out.
+class _CRInitials:
+    def __init__(self, active_accounts):
+        self.active_accounts = active_accounts
+
+    def __len__(self):
+        return len(self.active_accounts)
+
+    def __getitem__(self, i):
+        return self.active_accounts[i]['CR_initial']
+
+def active_position(active_accounts, ICR):
+    return bisect_left(_CRInitials(active_accounts), ICR)
+
 def get_hints_from_ICR(accounts, contracts, active_accounts, ICR, NICR):
     l = len(active_accounts)
     if l == 0:
         return [ZERO_ADDRESS, ZERO_ADDRESS, 0]
     else:
-        keys = [a['CR_initial'] for a in active_accounts]
-        i = bisect_left(keys, ICR)
+        i = active_position(active_accounts, ICR)
         #return [index2address(accounts, active_accounts, min(i, l-1)), index2address(accounts, active_accounts, max(i-1, 0)), i]
         hints = contracts.sortedTroves.findInsertPosition(
             NICR,
@@ -585,21 +622,26 @@ def get_hints_from_ICR(accounts, contracts, active_accounts, ICR, NICR):
         return [hints[0], hints[1], i]
 
 
-def adjust_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, index):
-    random.seed(57984-3*index)
-    ratio = random.uniform(0,1)
+# The debt, coll and ICR of every trove come from one paged read of the trove book
+# (`troves`, read here if not given) instead of two calls per trove; adjusting a trove
+# does not change the others' debt or coll.
+def adjust_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, index, troves=None):
+    ratio = streams.stream('adjust_troves', index).uniform(0,1)
+    p_troves = streams.agents('adjust_troves_trove', index, len(active_accounts)).uniform(0,1)
     coll_added_float = 0
     issuance_NECT_adjust = 0
+    if troves is None:
+        troves = read_trove_book(contracts)
+    price = int(floatToWei(price_ibgt_current))
 
     for i, working_trove in enumerate(active_accounts):
         account = accounts[working_trove['index']]
-        currentICR = contracts.troveManager.getCurrentICR(account, floatToWei(price_ibgt_current)) / 1e18
-        amounts = contracts.troveManager.getEntireDebtAndColl(account)
-        coll = amounts['coll'] / 1e18
-        debt = amounts['debt'] / 1e18
+        debt_wei, coll_wei = troves.get(account.address, (0, 0))
+        currentICR = compute_ICR(coll_wei, debt_wei, price) / 1e18
+        coll = coll_wei / 1e18
+        debt = debt_wei / 1e18
 
-        random.seed(187*index + 3*i)
-        p = random.uniform(0,1)
+        p = p_troves[i]
         check = (currentICR - working_trove['CR_initial']) / (working_trove['CR_initial'] * working_trove['Rational_inattention'])
 
         if check >= -1 and check <= 2:
@@ -608,7 +650,6 @@ def adjust_troves(accounts, contracts, active_accounts, inactive_accounts, price
         #A part of the troves are adjusted by adjusting debt
         if p >= ratio:
             debt_new = price_ibgt_current * coll / working_trove['CR_initial']
-            hints = get_hints_from_amounts(accounts, contracts, active_accounts, coll, debt_new, price_ibgt_current)
             if debt_new < MIN_NET_DEBT:
                 continue
             if check < -1:
@@ -616,28 +657,34 @@ def adjust_troves(accounts, contracts, active_accounts, inactive_accounts, price
                 repay_amount = floatToWei(debt - debt_new)
                 pending = get_nect_to_repay(accounts, contracts, active_accounts, inactive_accounts, account, repay_amount)
                 if pending == 0:
+                    hints = get_hints_from_amounts(accounts, contracts, active_accounts, coll_wei, debt_wei - repay_amount, price_ibgt_current, account)
                     contracts.borrowerOperations.repayNECT(repay_amount, hints[0], hints[1], { 'from': account })
             elif check > 2 and not is_recovery_mode(contracts, price_ibgt_current):
                 # withdraw NECT
                 withdraw_amount = debt_new - debt
                 withdraw_amount_wei = floatToWei(withdraw_amount)
                 if isNewTCRAboveCCR(contracts, 0, False, withdraw_amount_wei, True, floatToWei(price_ibgt_current)):
+                    #the fee is added to the debt, at the rate the withdrawal pays
+                    borrowing_rate = contracts.troveManager.getBorrowingRateWithDecay()
+                    fee = int(withdraw_amount_wei) * int(borrowing_rate) // DECIMAL_PRECISION
+                    hints = get_hints_from_amounts(accounts, contracts, active_accounts, coll_wei, debt_wei + withdraw_amount_wei + fee, price_ibgt_current, account)
                     contracts.borrowerOperations.withdrawNECT(MAX_FEE, withdraw_amount_wei, hints[0], hints[1], { 'from': account })
-                    rate_issuance = contracts.troveManager.getBorrowingRateWithDecay() / 1e18
+                    rate_issuance = borrowing_rate / 1e18
                     issuance_NECT_adjust = issuance_NECT_adjust + rate_issuance * withdraw_amount
         #Another part of the troves are adjusted by adjusting collaterals
         elif p < ratio:
             coll_new = working_trove['CR_initial'] * debt / price_ibgt_current
-            hints = get_hints_from_amounts(accounts, contracts, active_accounts, coll_new, debt, price_ibgt_current)
             if check < -1:
                 # add coll
                 coll_added_float = coll_new - coll
                 coll_added = floatToWei(coll_added_float)
+                hints = get_hints_from_amounts(accounts, contracts, active_accounts, coll_wei + coll_added, debt_wei, price_ibgt_current, account)
                 contracts.borrowerOperations.addColl(hints[0], hints[1], { 'from': account, 'value': coll_added })
             elif check > 2 and not is_recovery_mode(contracts, price_ibgt_current):
                 # withdraw iBGT
                 coll_withdrawn = floatToWei(coll - coll_new)
                 if isNewTCRAboveCCR(contracts, coll_withdrawn, False, 0, False, floatToWei(price_ibgt_current)):
+                    hints = get_hints_from_amounts(accounts, contracts, active_accounts, coll_wei - coll_withdrawn, debt_wei, price_ibgt_current, account)
                     contracts.borrowerOperations.withdrawColl(coll_withdrawn, hints[0], hints[1], { 'from': account })
 
     return [coll_added_float, issuance_NECT_adjust]
@@ -650,11 +697,15 @@ def open_trove(accounts, contracts, active_accounts, inactive_accounts, supply_t
     if is_recovery_mode(contracts, price_ibgt_current) and CR_ratio < 1.5:
         return
 
-    #hints = get_hints_from_ICR(accounts, active_accounts, CR_ratio)
-    hints = get_hints_from_amounts(accounts, contracts, active_accounts, quantity_ibgt, supply_trove, price_ibgt_current)
     coll = floatToWei(quantity_ibgt)
     debtChange = floatToWei(supply_trove) + NECT_GAS_COMPENSATION
-    nect = get_nect_amount_from_net_debt(contracts, floatToWei(supply_trove))
+    borrowing_rate = contracts.troveManager.getBorrowingRateWithDecay()
+    nect = get_nect_amount_from_net_debt(contracts, floatToWei(supply_trove), borrowing_rate)
+    #the trove's debt: the NECT drawn, its fee and the gas compensation
+    debt = int(nect) + int(nect) * int(borrowing_rate) // DECIMAL_PRECISION + int(floatToWei(NECT_GAS_COMPENSATION))
+    #hints = get_hints_from_ICR(accounts, active_accounts, CR_ratio)
+    hints = get_hints_from_amounts(accounts, contracts, active_accounts, coll, debt, price_ibgt_current,
+                                   ICR=quantity_ibgt * price_ibgt_current / supply_trove)
     if isNewTCRAboveCCR(contracts, coll, True, debtChange, True, floatToWei(price_ibgt_current)):
         contracts.borrowerOperations.openTrove(MAX_FEE, nect, hints[0], hints[1],
                                                { 'from': accounts[inactive_accounts[0]], 'value': coll })
@@ -666,8 +717,7 @@ def open_trove(accounts, contracts, active_accounts, inactive_accounts, supply_t
     return False
 
 def open_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index):
-    random.seed(2019*index)
-    shock_opentroves = random.normalvariate(0,sd_opentroves)
+    shock_opentroves = streams.stream('open_troves', index).normal(0,sd_opentroves)
     n_troves = len(active_accounts)
     rate_issuance = contracts.troveManager.getBorrowingRateWithDecay() / 1e18
     coll_added = 0
@@ -683,15 +733,14 @@ def open_troves(accounts, contracts, active_accounts, inactive_accounts, price_i
 
     number_opentroves = min(int(round(float(number_opentroves))), len(inactive_accounts))
 
-    for i in range(0, number_opentroves):
-        np.random.seed(2033 + index + i*i)
-        CR_ratio = target_cr_a + target_cr_b * np.random.chisquare(df=target_cr_chi_square_df)
-
-        np.random.seed(20 + 10 * i + index)
-        quantity_ibgt = np.random.gamma(collateral_gamma_k, scale=collateral_gamma_theta)
+    CR_ratios = target_cr_a + target_cr_b * streams.agents('open_troves_CR', index, number_opentroves).chisquare(target_cr_chi_square_df)
+    quantities_ibgt = streams.agents('open_troves_quantity', index, number_opentroves).gamma(collateral_gamma_k, collateral_gamma_theta)
+    rational_inattentions = streams.agents('open_troves_inattention', index, number_opentroves).gamma(rational_inattention_gamma_k, rational_inattention_gamma_theta)
 
-        np.random.seed(209870- index + i*i)
-        rational_inattention = np.random.gamma(rational_inattention_gamma_k, scale=rational_inattention_gamma_theta)
+    for i in range(0, number_opentroves):
+        CR_ratio = CR_ratios[i]
+        quantity_ibgt = quantities_ibgt[i]
+        rational_inattention = rational_inattentions[i]
         supply_trove = price_ibgt_current * quantity_ibgt / CR_ratio
         if supply_trove < MIN_NET_DEBT:
             supply_trove = MIN_NET_DEBT
@@ -710,11 +759,10 @@ Stability Pool
 """
 
 def stability_update(accounts, contracts, active_accounts, return_stability, index):
-    supply = contracts.nectToken.totalSupply() / 1e18
-    stability_pool_previous = contracts.stabilityPool.getTotalNECTDeposits() / 1e18
+    supply = nect_supply(contracts) / 1e18
+    stability_pool_previous = stability_pool_deposits(contracts) / 1e18
 
-    np.random.seed(27+3*index)
-    shock_stability = np.random.normal(0,sd_stability)
+    shock_stability = streams.stream('stability_update', index).normal(0,sd_stability)
     natural_rate_current = natural_rate[index]
     if stability_pool_previous == 0:
         stability_pool = stability_initial
@@ -727,12 +775,17 @@ def stability_update(accounts, contracts, active_accounts, return_stability, ind
         print("Warning! Stability pool supposed to be greater than supply", stability_pool, supply)
         stability_pool = supply
 
-    if stability_pool > stability_pool_previous:
+    mirror = getattr(contracts, 'mirror', None)
+    if stability_pool > stability_pool_previous and mirror is not None:
+        # the largest holders but the whale first, whose deposit is the one withdrawn below
+        for account, deposit in mirror.donors(floatToWei(stability_pool - stability_pool_previous), exclude=(accounts[0].address,)):
+            contracts.stabilityPool.provideToSP(deposit, ZERO_ADDRESS, { 'from': account, 'gas_limit': 8000000, 'allow_revert': True })
+    elif stability_pool > stability_pool_previous:
         remaining = stability_pool - stability_pool_previous
         i = 0
         while remaining > 0 and i < len(active_accounts):
           account = index2address(accounts, active_accounts, i)
-          balance = contracts.nectToken.balanceOf(account) / 1e18
+          balance = nect_balance_of(contracts, account) / 1e18
           deposit = min(balance, remaining)
           if deposit > 0:
               contracts.stabilityPool.provideToSP(floatToWei(deposit), ZERO_ADDRESS, { 'from': account, 'gas_limit': 8000000, 'allow_revert': True })
@@ -835,12 +888,21 @@ sd_redemption = 0.001
 redemption_start = 0.8
 
 def redeem_trove(accounts, contracts, i, price_ibgt_current):
-    nect_balance = contracts.nectToken.balanceOf(accounts[i])
-    [firstRedemptionHint, partialRedemptionHintNICR, truncatedNECTamount] = contracts.hintHelpers.getRedemptionHints(nect_balance, price_ibgt_current, 70)
-    if truncatedNECTamount == Wei(0):
-        return None
-    approxHint = contracts.hintHelpers.getApproxHint(partialRedemptionHintNICR, 2000, 0)
-    hints = contracts.sortedTroves.findInsertPosition(partialRedemptionHintNICR, approxHint[0], approxHint[0])
+    nect_balance = nect_balance_of(contracts, accounts[i])
+    mirror = getattr(contracts, 'mirror', None)
+    if mirror is not None:
+        #the same hints from the mirror's sorted list, the price converted as the call would
+        [firstRedemptionHint, partialRedemptionHintNICR, truncatedNECTamount, partial] = mirror.redemption_hints(int(nect_balance), int(Wei(price_ibgt_current)), 70)
+        if truncatedNECTamount == 0:
+            return None
+        approxHint = (ZERO_ADDRESS, 0, 0)
+        hints = mirror.insert_hints(partialRedemptionHintNICR, partial)
+    else:
+        [firstRedemptionHint, partialRedemptionHintNICR, truncatedNECTamount] = contracts.hintHelpers.getRedemptionHints(nect_balance, price_ibgt_current, 70)
+        if truncatedNECTamount == Wei(0):
+            return None
+        approxHint = contracts.hintHelpers.getApproxHint(partialRedemptionHintNICR, 2000, 0)
+        hints = contracts.sortedTroves.findInsertPosition(partialRedemptionHintNICR, approxHint[0], approxHint[0])
     try:
         tx = contracts.troveManager.redeemCollateral(
             truncatedNECTamount,
@@ -879,18 +941,17 @@ def redeem_trove(accounts, contracts, i, price_ibgt_current):
 
 def price_stabilizer(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index):
 
-    stability_pool = contracts.stabilityPool.getTotalNECTDeposits() / 1e18
+    stability_pool = stability_pool_deposits(contracts) / 1e18
     redemption_pool = 0
     redemption_fee = 0
     issuance_NECT_stabilizer = 0
 
-    supply = contracts.nectToken.totalSupply() / 1e18
+    supply = nect_supply(contracts) / 1e18
     #Liquidity Pool
     liquidity_pool = supply - stability_pool
 
     # next iteration step for liquidity pool
-    np.random.seed(20*index)
-    shock_liquidity = np.random.normal(0,sd_liquidity)
+    shock_liquidity = streams.stream('liquidity', index).normal(0,sd_liquidity)
 
     liquidity_pool_next = liquidity_pool * drift_liquidity * (1+shock_liquidity)
 
@@ -918,8 +979,7 @@ def price_stabilizer(accounts, contracts, active_accounts, inactive_accounts, pr
 
     #Floor Arbitrageurs
     if price_NECT_current < 1 - rate_redemption:
-        np.random.seed(30*index)
-        shock_redemption = np.random.normal(0, sd_redemption)
+        shock_redemption = streams.stream('redemption', index).normal(0, sd_redemption)
         redemption_ratio = max(1, redemption_start * (1+shock_redemption))
 
         supply_target = stability_pool + \
@@ -939,7 +999,7 @@ def price_stabilizer(accounts, contracts, active_accounts, inactive_accounts, pr
         i = 0
         while remaining > 0 and i < len(active_accounts):
           account = index2address(accounts, active_accounts, i)
-          balance = contracts.nectToken.balanceOf(account) / 1e18
+          balance = nect_balance_of(contracts, account) / 1e18
           redemption = min(balance, remaining)
           if redemption > 0:
               tx = redeem_trove(accounts, contracts, 0, price_ibgt_current)
@@ -962,15 +1022,14 @@ def price_stabilizer(accounts, contracts, active_accounts, inactive_accounts, pr
 
 """# POLLEN Market"""
 
-def POLLEN_market(index, data):
+def POLLEN_market(index, windows):
     #quantity_POLLEN = (POLLEN_total_supply/3)*(1-0.5**(index/period))
-    np.random.seed(2+3*index)
     if index <= month:
         price_POLLEN_current = price_POLLEN[index-1]
-        annualized_earning = (index/month)**0.5 * np.random.normal(200000000,500000)
+        annualized_earning = (index/month)**0.5 * streams.stream('POLLEN_market', index).normal(200000000,500000)
     else:
-        revenue_issuance = sum(data['issuance_fee'][index - month:index])
-        revenue_redemption = sum(data['redemption_fee'][index - month:index])
+        revenue_issuance = windows['issuance_fee'].total()
+        revenue_redemption = windows['redemption_fee'].total()
         annualized_earning = 365 * (revenue_issuance+revenue_redemption) / 30
         #discounting factor to factor in the risk in early days
         discount=index/period
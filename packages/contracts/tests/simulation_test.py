@@ -1,11 +1,14 @@
 import pytest
 
-import csv
+import os
 
 from brownie import *
 from accounts import *
 from helpers import *
 from simulation_helpers import *
+from result_sink import ColumnSink, read_columns
+from profiling import profiler_from_env
+from chain_mirror import ChainMirror
 
 class Contracts: pass
 
@@ -121,6 +124,18 @@ def contracts():
     contracts.collSurplusPool = CollSurplusPool.deploy({ 'from': accounts[0] })
     contracts.borrowerOperations = BorrowerOperationsTester.deploy({ 'from': accounts[0] })
     contracts.hintHelpers = HintHelpers.deploy({ 'from': accounts[0] })
+    contracts.multiTroveGetter = MultiTroveGetter.deploy(
+        contracts.troveManager.address,
+        contracts.sortedTroves.address,
+        { 'from': accounts[0] }
+    )
+    contracts.systemStateGetter = SystemStateGetter.deploy(
+        contracts.troveManager.address,
+        contracts.sortedTroves.address,
+        contracts.stabilityPool.address,
+        contracts.priceFeedTestnet.address,
+        { 'from': accounts[0] }
+    )
     contracts.nectToken = NECTToken.deploy(
         contracts.troveManager.address,
         contracts.stabilityPool.address,
@@ -160,6 +175,52 @@ def print_expectations():
     print("SD(tau)     = ", rational_inattention_gamma_k**(0.5) * rational_inattention_gamma_theta * 100, "%")
     print("\n")
 
+# Per-step results stream to a directory of .npy columns (result_sink.py), which can be
+# read one column at a time; tests/simulation.csv is exported from it at the end, with the
+# same columns as before. SIMULATION_VERBOSE=1 prints every iteration again.
+SIMULATION_COLUMNS = ['iteration', 'iBGT_price', 'price_NECT', 'price_POLLEN', 'num_troves', 'total_coll', 'total_debt', 'TCR', 'recovery_mode', 'last_ICR', 'SP_NECT', 'SP_iBGT', 'total_coll_added', 'total_coll_liquidated', 'total_nect_redempted']
+SIMULATION_DTYPES = {'iteration': 'int64', 'num_troves': 'int64', 'recovery_mode': 'bool'}
+verbose = os.environ.get('SIMULATION_VERBOSE', '0') not in ('', '0')
+log = print if verbose else (lambda *args, **kwargs: None)
+
+# Streams the per-step results; tests/simulation.csv is exported when the test ends,
+# also when it fails partway.
+@pytest.fixture
+def simulation_sink():
+    with ColumnSink('tests/simulation', SIMULATION_COLUMNS, SIMULATION_DTYPES, rows=720) as sink:
+        yield sink
+    read_columns('tests/simulation').to_csv('tests/simulation.csv', index=False)
+
+# SIMULATION_PROFILE=1 times every phase of the loop and every contract call in it
+# (SIMULATION_PROFILE=memory also traces allocations); the per-phase summary goes to
+# tests/simulation_profile.csv and the folded stacks, for a flamegraph, to
+# tests/simulation_profile.folded. Unset, the profiler does nothing.
+@pytest.fixture
+def simulation_profiler():
+    profiler = profiler_from_env('SIMULATION_PROFILE')
+    yield profiler
+    if profiler.enabled:
+        profiler.close()
+        profiler.write_summary('tests/simulation_profile.csv')
+        profiler.write_folded('tests/simulation_profile.folded')
+        print(profiler.summary().head(20))
+
+# The loop reads the system state from a ChainMirror (chain_mirror.py) that follows the
+# events of its transactions, instead of calling the contracts for it, and picks the
+# accounts to draw NECT from out of its balances; SIMULATION_MIRROR=0 reads the contracts
+# again. The mirror is compared with the chain every SIMULATION_MIRROR_CHECK steps (a day
+# by default, 0 turns it off) and the test fails on a difference.
+@pytest.fixture
+def simulation_mirror(add_accounts, contracts):
+    if os.environ.get('SIMULATION_MIRROR', '1') == '0':
+        return None
+    mirror = ChainMirror(contracts, holders=accounts)
+    #the deployment and setup transactions were not sent through the mirror
+    mirror.sync(contracts, accounts)
+    return mirror
+
+mirror_check = int(os.environ.get('SIMULATION_MIRROR_CHECK', str(day)))
+
 def _test_test(contracts):
     print(len(accounts))
     contracts.borrowerOperations.openTrove(Wei(1e18), Wei(2000e18), ZERO_ADDRESS, ZERO_ADDRESS,
@@ -188,7 +249,12 @@ def _test_test(contracts):
 * redemption & redemption fee
 * POLLEN pool return determined
 """
-def test_run_simulation(add_accounts, contracts, print_expectations):
+def test_run_simulation(add_accounts, contracts, print_expectations, simulation_sink, simulation_profiler, simulation_mirror):
+    profiler = simulation_profiler
+    mirror = simulation_mirror
+    if mirror is not None:
+        contracts = mirror.watch(contracts)
+    contracts = profiler.proxy(contracts)
     NECT_GAS_COMPENSATION = contracts.troveManager.NECT_GAS_COMPENSATION() / 1e18
     MIN_NET_DEBT = contracts.troveManager.MIN_NET_DEBT() / 1e18
 
@@ -206,6 +272,7 @@ def test_run_simulation(add_accounts, contracts, print_expectations):
     price_POLLEN_current = price_POLLEN_initial
 
     data = {"airdrop_gain": [0] * n_sim, "liquidation_gain": [0] * n_sim, "issuance_fee": [0] * n_sim, "redemption_fee": [0] * n_sim}
+    windows = revenue_windows(data)
     total_nect_redempted = 0
     total_coll_added = whale_coll
     total_coll_liquidated = 0
@@ -215,60 +282,76 @@ def test_run_simulation(add_accounts, contracts, print_expectations):
 
     logGlobalState(contracts)
 
-    with open('tests/simulation.csv', 'w', newline='') as csvfile:
-        datawriter = csv.writer(csvfile, delimiter=',')
-        datawriter.writerow(['iteration', 'iBGT_price', 'price_NECT', 'price_POLLEN', 'num_troves', 'total_coll', 'total_debt', 'TCR', 'recovery_mode', 'last_ICR', 'SP_NECT', 'SP_iBGT', 'total_coll_added', 'total_coll_liquidated', 'total_nect_redempted'])
-
-        #Simulation Process
-        for index in range(1, n_sim):
-            print('\n  --> Iteration', index)
-            print('  -------------------\n')
+    sink = simulation_sink
+    #Simulation Process
+    for index in range(1, n_sim):
+        with profiler.phase('step'):
+            log('\n  --> Iteration', index)
+            log('  -------------------\n')
             #exogenous ibgt price input
             price_ibgt_current = price_ibgt[index]
             contracts.priceFeedTestnet.setPrice(floatToWei(price_ibgt_current), { 'from': accounts[0] })
 
             #trove liquidation & return of stability pool
-            result_liquidation = liquidate_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, price_POLLEN_current, data, index)
+            with profiler.phase('liquidate_troves'):
+                result_liquidation = liquidate_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, price_POLLEN_current, data, windows, index)
             total_coll_liquidated = total_coll_liquidated + result_liquidation[0]
             return_stability = result_liquidation[1]
 
+            #trove book after the liquidations, one paged read for closes and adjustments
+            with profiler.phase('read_troves'):
+                troves = read_trove_book(contracts)
+
             #close troves
-            result_close = close_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index)
+            with profiler.phase('close_troves'):
+                result_close = close_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index, troves)
 
             #adjust troves
-            [coll_added_adjust, issuance_NECT_adjust] = adjust_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, index)
+            with profiler.phase('adjust_troves'):
+                [coll_added_adjust, issuance_NECT_adjust] = adjust_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, index, troves)
 
             #open troves
-            [coll_added_open, issuance_NECT_open] = open_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index)
+            with profiler.phase('open_troves'):
+                [coll_added_open, issuance_NECT_open] = open_troves(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index)
             total_coll_added = total_coll_added + coll_added_adjust + coll_added_open
             #active_accounts.sort(key=lambda a : a.get('CR_initial'))
 
             #Stability Pool
-            stability_update(accounts, contracts, active_accounts, return_stability, index)
+            with profiler.phase('stability_update'):
+                stability_update(accounts, contracts, active_accounts, return_stability, index)
 
             #Calculating Price, Liquidity Pool, and Redemption
-            [price_NECT, redemption_pool, redemption_fee, issuance_NECT_stabilizer] = price_stabilizer(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index)
+            with profiler.phase('price_stabilizer'):
+                [price_NECT, redemption_pool, redemption_fee, issuance_NECT_stabilizer] = price_stabilizer(accounts, contracts, active_accounts, inactive_accounts, price_ibgt_current, price_NECT, index)
             total_nect_redempted = total_nect_redempted + redemption_pool
-            print('NECT price', price_NECT)
-            print('POLLEN price', price_POLLEN_current)
+            log('NECT price', price_NECT)
+            log('POLLEN price', price_POLLEN_current)
 
             issuance_fee = price_NECT * (issuance_NECT_adjust + issuance_NECT_open + issuance_NECT_stabilizer)
             data['issuance_fee'][index] = issuance_fee
             data['redemption_fee'][index] = redemption_fee
 
             #POLLEN Market
-            result_POLLEN = POLLEN_market(index, data)
+            with profiler.phase('POLLEN_market'):
+                result_POLLEN = POLLEN_market(index, windows)
+                push_windows(windows, data, index)
             price_POLLEN_current = result_POLLEN[0]
             #annualized_earning = result_POLLEN[1]
             #MC_POLLEN_current = result_POLLEN[2]
 
-            [iBGT_price, num_troves, total_coll, total_debt, TCR, recovery_mode, last_ICR, SP_NECT, SP_iBGT] = logGlobalState(contracts)
-            print('Total redempted ', total_nect_redempted)
-            print('Total iBGT added ', total_coll_added)
-            print('Total iBGT liquid', total_coll_liquidated)
-            print(f'Ratio iBGT liquid {100 * total_coll_liquidated / total_coll_added}%')
-            print(' ----------------------\n')
+            with profiler.phase('logGlobalState'):
+                [iBGT_price, num_troves, total_coll, total_debt, TCR, recovery_mode, last_ICR, SP_NECT, SP_iBGT] = logGlobalState(contracts, verbose)
+            log('Total redempted ', total_nect_redempted)
+            log('Total iBGT added ', total_coll_added)
+            log('Total iBGT liquid', total_coll_liquidated)
+            log(f'Ratio iBGT liquid {100 * total_coll_liquidated / total_coll_added}%')
+            log(' ----------------------\n')
+
+            if mirror is not None and mirror_check and index % mirror_check == 0:
+                with profiler.phase('mirror_check'):
+                    mismatches = mirror.check(contracts, accounts)
+                assert not mismatches, '\n'.join(mismatches)
 
-            datawriter.writerow([index, iBGT_price, price_NECT, price_POLLEN_current, num_troves, total_coll, total_debt, TCR, recovery_mode, last_ICR, SP_NECT, SP_iBGT, total_coll_added, total_coll_liquidated, total_nect_redempted])
+            sink.record(dict(zip(SIMULATION_COLUMNS, [index, iBGT_price, price_NECT, price_POLLEN_current, num_troves, total_coll, total_debt, TCR, recovery_mode, last_ICR, SP_NECT, SP_iBGT, total_coll_added, total_coll_liquidated, total_nect_redempted])))
 
             assert price_NECT > 0